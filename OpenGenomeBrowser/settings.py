@@ -43,6 +43,13 @@ FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHand
 
 CACHE_DIR = os.environ.get('CACHE_DIR', '/tmp/ogb-cache')
 CACHE_MAXSIZE = int(os.environ.get('CACHE_MAXSIZE', 20))
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'disk')  # 'disk', 'sqlite', 'sqlite:///...' or 'redis://...'
+CACHE_MEMORY_MAXBYTES = int(os.environ.get('CACHE_MEMORY_MAXBYTES', 64 * 1024 ** 2))  # per function, 0: disabled
+CACHE_MAXBYTES = int(os.environ.get('CACHE_MAXBYTES', 10 * 1024 ** 3))  # all of CACHE_DIR, 0: disabled
+CACHE_EVICTION_POLICY = os.environ.get('CACHE_EVICTION_POLICY', 'lru')  # 'lru' or 'lfu'
+CACHE_COMPRESS = os.environ.get('CACHE_COMPRESS', 'false').lower() == 'true'  # zstd, requires zstandard
+PRESENCE_MATRIX_DIR = os.environ.get('PRESENCE_MATRIX_DIR', f'{CACHE_DIR}/.presence-matrix')
+PATHWAY_ASSETS_DIR = os.environ.get('PATHWAY_ASSETS_DIR', f'{CACHE_DIR}/.pathway-assets')  # minified, compressed maps
 
 GENBANK_LOAD_EC = os.environ.get('GENBANK_LOAD_EC', 'true').lower() == 'true'
 
@@ -73,6 +80,8 @@ LOGOUT_REDIRECT_URL = '/?info=You are logged out.'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 HUEY_WORKERS = int(os.environ.get('HUEY_WORKERS', 4))
+GTM_PERMUTATIONS = int(os.environ.get('GTM_PERMUTATIONS', 10000))  # gene trait matching, method 'permutation'
+PLOT_WORKERS = int(os.environ.get('PLOT_WORKERS', 2))  # processes that render plots, 0: render in the web server
 
 # Application definition
 INSTALLED_APPS = [
@@ -16,8 +16,9 @@ from OpenGenomeBrowser import settings
 
 from db_setup.FolderLooper import FolderLooper, MockGenome, MockOrganism
 from website.serializers import GenomeSerializer, OrganismSerializer
-from website.models import Organism, Genome, Tag, TaxID, GenomeContent, Gene, PathwayMap, Annotation
-from website.models.GenomeContent import create_blast_dbs
+from website.models import Organism, Genome, Tag, TaxID, GenomeContent, GenomeContentAnnotation, Gene, PathwayMap, \
+    Annotation
+from website.models.GenomeContent import create_blast_dbs, create_locus_index, update_missing_descriptions
 
 folder_looper = FolderLooper(settings.FOLDER_STRUCTURE)
 
@@ -101,12 +102,14 @@ def sanity_check_folder_structure(verbose=True) -> (int, int):
     return n_organisms, n_genomes
 
 
-def import_folder_structure(delete_missing: bool = True, auto_delete_missing: bool = False):
+def import_folder_structure(delete_missing: bool = True, auto_delete_missing: bool = False, workers: int = 1):
     """
     Load organisms and genomes from folder_structure into PostgreSQL database
 
     :param delete_missing: if True (default), check if organisms/genomes have gone missing
     :param auto_delete_missing: if True, remove missing organisms/genomes without console prompt
+    :param workers: if > 1, parse the genomes in this many processes. The database is still written by a single
+                    process, one transaction per organism. Organisms that fail to import are skipped and reported at the end.
     """
 
     # perform sanity checks
@@ -121,14 +124,123 @@ def import_folder_structure(delete_missing: bool = True, auto_delete_missing: bo
     print(F"Number of genomes to import: {n_genomes}")
 
     organism_generator = folder_looper.organisms(skip_ignored=True, sanity_check=False)
+    if workers > 1:
+        failures = import_organisms_parallel(list(organism_generator), workers=workers)
+        reload_color_css()
+        update_missing_descriptions()
+        if failures:
+            color_print(f'\nFailed to import {len(failures)} organisms:', color=Fore.RED)
+            for name, error in failures.items():
+                color_print(f'   └── {name} :: {error}', color=Fore.RED)
+            sys.exit(1)
+        sanity_check_postgres()
+        return
+
     for organism in progressbar(organism_generator, max_value=n_organisms, redirect_stdout=True):
         organism: MockOrganism
         import_organism(organism.name, update_css=False)
 
     reload_color_css()
+    update_missing_descriptions()
     sanity_check_postgres()
 
 
+def _plan_organism(organism: MockOrganism) -> [(str, dict, dict)]:
+    """
+    Find out which files of an organism's genomes have to be parsed, see GenomeContent.plan_update.
+
+    :returns: list of (genome identifier, fingerprints of the files, kwargs for parse_genome or None)
+    """
+    jobs = []
+    for genome in organism.genomes(skip_ignored=True, sanity_check=False):
+        try:
+            gc = GenomeContent.objects.get(identifier=genome.identifier)
+        except GenomeContent.DoesNotExist:
+            gc = GenomeContent(identifier=genome.identifier)
+        plan = gc.plan_update(base_path=genome.path, metadata=genome.json)
+        if plan['full_reload']:
+            custom_annotations = genome.json.get('custom_annotations') or []
+        else:
+            custom_annotations = plan['load']
+        with_gbk = plan['full_reload'] or plan['gbk']
+        kwargs = dict(
+            gbk=f'{genome.path}/{genome.json["cds_tool_gbk_file"]}', base_path=genome.path,
+            custom_annotations=custom_annotations, load_ec=settings.GENBANK_LOAD_EC, with_gbk=with_gbk
+        ) if with_gbk or custom_annotations else None
+        jobs.append((genome.identifier, plan['fingerprints'], kwargs))
+    return jobs
+
+
+def _parse_organism(organism: MockOrganism) -> (dict, dict):
+    """
+    Runs in a worker process: hash and parse the files of an organism's genomes. Only reads from the database.
+
+    :returns: ({identifier: parsed}, {identifier: error message}). parsed includes the fingerprints of the files, so
+              GenomeContent.update does not hash them again
+    """
+    from website.models.GenomeContent import parse_genome
+    parsed, errors = {}, {}
+    try:
+        jobs = _plan_organism(organism)
+    except Exception as e:
+        return parsed, {organism.name: f'{type(e).__name__}: {e}'}
+    for identifier, fingerprints, kwargs in jobs:
+        try:
+            parsed[identifier] = parse_genome(**kwargs) if kwargs else {'gbk': None, 'custom_files': {}}
+            parsed[identifier]['fingerprints'] = fingerprints
+        except Exception as e:
+            errors[identifier] = f'{type(e).__name__}: {e}'
+    return parsed, errors
+
+
+def import_organisms_parallel(organisms: [MockOrganism], workers: int) -> {str: str}:
+    """
+    Hash and parse genomes in a process pool, write them to the database in this process (one transaction per
+    organism).
+
+    Organisms are written in the order of the input, independent of which worker finishes first.
+
+    :returns: {organism name: error message} of the organisms that failed to import
+    """
+    import multiprocessing
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    from progressbar import ProgressBar
+    from django.db import connections
+
+    print(f'Parsing {len(organisms)} organisms using {workers} workers...')
+
+    # forked workers must not use the database connection of this process
+    connections.close_all()
+
+    failures = {}
+    bar = ProgressBar(max_value=len(organisms), redirect_stdout=True)
+
+    def write(organism: MockOrganism, future):
+        try:
+            parsed, errors = future.result()
+            if errors:
+                raise AssertionError(f'Failed to parse genomes: {errors}')
+            import_organism(organism.name, update_css=False, parsed=parsed)
+        except Exception as e:
+            failures[organism.name] = f'{type(e).__name__}: {e}'
+            color_print(f'   └── failed: {failures[organism.name]}', color=Fore.RED)
+        bar.update(bar.value + 1)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+        pending = deque()
+        for organism in organisms:
+            pending.append((organism, executor.submit(_parse_organism, organism)))
+            # bound the number of parsed organisms that wait in memory for the writer
+            if len(pending) >= 2 * workers:
+                write(*pending.popleft())
+        while pending:
+            write(*pending.popleft())
+
+    bar.finish()
+    return failures
+
+
 def reload_organism_genomecontents(name: str = None, all: bool = False, assembly_stats_only: bool = False):
     """
     Forcefully reload fastas and annotations into database.
@@ -158,12 +270,15 @@ def reload_organism_genomecontents(name: str = None, all: bool = False, assembly
         raise AssertionError('Do nothing. Please specify --name=<organism-name> or --all')
 
     if not assembly_stats_only:
+        update_missing_descriptions()
         print('consider reloading orthologs.')
 
 
-def import_organism(name: str, update_css: bool = True):
+def import_organism(name: str, update_css: bool = True, parsed: dict = None):
     """
     Import organism into PostgreSQL database
+
+    :param parsed: {genome identifier: pre-parsed files}, see import_organisms_parallel
     """
     organism = MockOrganism(path=f'{settings.FOLDER_STRUCTURE}/organisms/{name}')
     with transaction.atomic():
@@ -218,9 +333,10 @@ def import_organism(name: str, update_css: bool = True):
         o.save()
 
         for g in genomes:
-            GenomeSerializer.update_genomecontent(g)
+            GenomeSerializer.update_genomecontent(g, parsed=parsed.get(g.identifier) if parsed else None)
 
     if update_css:
+        update_missing_descriptions()
         reload_color_css()
         sanity_check_postgres()
         print('consider reloading orthologs.')
@@ -245,12 +361,15 @@ def reload_color_css() -> None:
     Annotation.create_annotype_color_css()
 
 
-def import_pathway_maps() -> None:
+def import_pathway_maps(incremental: bool = False, workers: int = None) -> None:
     """
     (Re)load pathway maps into PostgreSQL database
+
+    :param incremental: only reload maps whose svg changed and remove maps whose svg disappeared
+    :param workers: number of processes that parse the svgs, default: number of CPUs
     """
     from website.models import PathwayMap
-    PathwayMap.reload_maps()
+    PathwayMap.reload_maps(incremental=incremental, workers=workers)
 
 
 def remove_missing_organisms(auto_delete_missing: bool = False) -> None:
@@ -565,6 +684,110 @@ def load_blast_dbs(reload: bool, genome: str = None, older_than_days: int = None
             create_blast_dbs(gc, reload=True)
 
 
+def load_locus_indices(reload: bool = False, genome: str = None) -> None:
+    """
+    Create missing locus indices. (Random-access indices for gbk, faa and ffn files, see lib/sequence_index.)
+
+    :param reload: if True: Recreate all locus indices.
+    :param genome: identifier of a genome. Default: all genomes
+    """
+    if genome is None:
+        genomes = GenomeContent.objects.all()
+    else:
+        genomes = [GenomeContent.objects.get(identifier=genome)]
+
+    def must_update(gc: GenomeContent) -> bool:
+        return any(index is None for index in [gc.locus_index('gbk'), gc.locus_index('faa')]) or \
+               (gc.genome.cds_ffn(relative=False) and gc.locus_index('ffn') is None)
+
+    n_gcs = len(genomes)
+    for i, gc in enumerate(genomes):
+        print(f'{i + 1}/{n_gcs} :: {gc} ::', end=' ')
+        if reload or must_update(gc):
+            print('create')
+            create_locus_index(gc)
+        else:
+            print('Pass')
+
+
+def refresh_genome_annotations(genome: str = None) -> None:
+    """
+    Recompute the Genome-Annotation links (and copy numbers) from the Gene-Annotation links.
+
+    :param genome: identifier of a genome. Default: all genomes
+    """
+    if genome is None:
+        genomes = GenomeContent.objects.all()
+    else:
+        genomes = [GenomeContent.objects.get(identifier=genome)]
+
+    n_gcs = len(genomes)
+    for i, gc in enumerate(genomes):
+        print(f'{i + 1}/{n_gcs} :: {gc}')
+        with transaction.atomic():
+            GenomeContentAnnotation.objects.refresh(genomecontent=gc)
+
+
+def cache_stats(reset: bool = False) -> None:
+    """
+    Print size, hits, misses and compute time saved of all caches in CACHE_DIR.
+
+    :param reset: if true, reset hits, misses and times afterwards
+    """
+    from lib.ogb_cache.stats import cache_summary, get_stats
+
+    summary = cache_summary(settings.CACHE_DIR)
+    print(f'{"cache":<60} {"entries":>8} {"MB":>10} {"hits":>8} {"misses":>8} {"hit rate":>8} {"saved (s)":>10}')
+    for row in summary:
+        hit_rate = '-' if row['hit_rate'] is None else f'{row["hit_rate"]:.0%}'
+        print(f'{row["name"]:<60} {row["entries"]:>8} {row["nbytes"] / 1024 ** 2:>10.1f} {row["hits"]:>8} '
+              f'{row["misses"]:>8} {hit_rate:>8} {row["seconds_saved"]:>10.1f}')
+    nbytes = sum(row['nbytes'] for row in summary)
+    color_print(f'total: {nbytes / 1024 ** 2:.1f} MB of {settings.CACHE_MAXBYTES / 1024 ** 2:.1f} MB '
+                f'({settings.CACHE_EVICTION_POLICY})', Fore.CYAN)
+
+    if reset:
+        get_stats(settings.CACHE_DIR).reset()
+        print('reset statistics')
+
+
+def evict_cache(maxbytes: int = None, policy: str = None) -> None:
+    """
+    Remove cache entries until all of CACHE_DIR uses at most maxbytes.
+
+    :param maxbytes: budget in bytes. Default: CACHE_MAXBYTES
+    :param policy: 'lru' or 'lfu'. Default: CACHE_EVICTION_POLICY
+    """
+    from lib.ogb_cache.eviction import evict_cache_dir
+    from lib.ogb_cache.stats import get_stats
+
+    removed = evict_cache_dir(
+        settings.CACHE_DIR,
+        maxbytes=settings.CACHE_MAXBYTES if maxbytes is None else maxbytes,
+        policy=settings.CACHE_EVICTION_POLICY if policy is None else policy,
+        stats=get_stats(settings.CACHE_DIR)
+    )
+    for entry in removed:
+        print(f'removed {entry.name}/{entry.key} ({entry.nbytes / 1024 ** 2:.1f} MB)')
+    color_print(f'removed {len(removed)} entries, {sum(e.nbytes for e in removed) / 1024 ** 2:.1f} MB', Fore.CYAN)
+
+
+def rebuild_presence_matrices(anno_type: str = None) -> None:
+    """
+    Rebuild the genome x annotation presence matrices from scratch. Normally, they are updated automatically.
+
+    :param anno_type: only rebuild this anno_type. Default: all anno_types, this also starts dirty.log over
+    """
+    from website.models.Annotation import annotation_types
+    from website.models.helpers.presence_matrix import invalidate, load
+
+    anno_types = list(annotation_types) if anno_type is None else [anno_type]
+    invalidate(None if anno_type is None else anno_types)
+    for anno_type in anno_types:
+        matrix = load(anno_type)
+        print(f'{anno_type}: {len(matrix.genomes)} genomes x {len(matrix.annotations)} annotations, {len(matrix.indices)} links')
+
+
 @transaction.atomic
 def update_taxids(download_taxdump: bool = False) -> None:
     """
@@ -709,14 +932,14 @@ for example: [GO, EC, KG, KR, EP, EO, ED]. default: [] (empty list)
 
         with transaction.atomic():
             if gc_annos:
-                # remove GenomeContent -> Annotation
-                gc.annotations.remove(*gc_annos)
-                # remove GenomeContent.Gene -> Annotation
+                # remove GenomeContent.Gene -> Annotation, GenomeContent -> Annotation is derived from it
                 gene_anno_connections.delete()
+                GenomeContentAnnotation.objects.refresh(genomecontent=gc, anno_types=anno_types)
 
+            gc.forget_links(anno_types=anno_types, custom_files=custom_files_to_remove)
             if custom_files_to_remove:
                 gc.custom_files = custom_files
-                gc.save()
+            gc.save()
 
             if reload:
                 o = MockOrganism(path=f'{settings.FOLDER_STRUCTURE}/organisms/{gc.organism.name}')
@@ -732,12 +955,6 @@ for example: [GO, EC, KG, KR, EP, EO, ED]. default: [] (empty list)
                 print(gc)
                 gc.update()
                 n_gc_annos_after = gc.annotations.filter(anno_type__in=anno_types).distinct().count()
-                n_gene_annos_after = Annotation.objects.filter(
-                    gene__genomecontent__identifier=gc.identifier,
-                    anno_type__in=anno_types
-                ).distinct().count()
-                assert n_gc_annos_after == n_gene_annos_after, \
-                    f'Genome-Annotation links are inconsistent with Gene-Annotation'
                 print(
                     f'       number of annotations before: {n_gc_annos} after:{n_gc_annos_after}')
             else:
@@ -746,6 +963,9 @@ for example: [GO, EC, KG, KR, EP, EO, ED]. default: [] (empty list)
     for gc in genomes:
         _reload_custom_annotations(gc)
 
+    if reload and not simulate_only:
+        update_missing_descriptions(anno_types)
+
 
 if __name__ == "__main__":
     from fire import Fire
@@ -764,7 +984,12 @@ if __name__ == "__main__":
         # advanced
         'reload-color-css': reload_color_css,
         'load-blast-dbs': load_blast_dbs,
+        'load-locus-indices': load_locus_indices,
+        'refresh-genome-annotations': refresh_genome_annotations,
+        'rebuild-presence-matrices': rebuild_presence_matrices,
         'update-taxids': update_taxids,
+        'cache-stats': cache_stats,
+        'evict-cache': evict_cache,
 
         # more advanced
         'reload-organism-genomecontents': reload_organism_genomecontents,
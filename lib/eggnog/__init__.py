@@ -0,0 +1 @@
+from .eggnog_parser import parse_eggnog, EGGNOG_VERSIONS, EGGNOG_ANNO_TYPES
@@ -0,0 +1,126 @@
+import re
+from io import BytesIO
+import numpy as np
+import pandas as pd
+
+"""
+Column-oriented parser for eggnog-mapper output (emapper.annotations).
+
+Instead of splitting and validating line by line, the file is read in large blocks. Each block is parsed into columns
+by pandas, the annotation columns are split/exploded as a whole and reduced to sets of annotations and links before
+the next block is read. Every distinct annotation is validated against its regex only once. Memory is bounded by the
+block size plus the size of the result.
+"""
+
+# anno_type -> (split on ',', transform)
+_TRANSFORMS = {
+    'GO': (True, lambda s: s),
+    'EC': (True, lambda s: 'EC:' + s),
+    'KG': (True, lambda s: s.str.slice(3)),  # 'ko:K00001' -> 'K00001'
+    'KR': (True, lambda s: s),
+    'EP': (False, lambda s: 'EP:' + s),
+    'EO': (False, lambda s: 'EO:' + s.str.partition('@')[0]),
+    'ED': (False, lambda s: 'ED:' + s.str.partition(',')[0].str.partition(';')[0]),
+}
+
+# version -> (number of columns, value of empty cells, {anno_type: column})
+EGGNOG_VERSIONS = {
+    'eggnog': (22, '', {'GO': 6, 'EC': 7, 'KG': 8, 'KR': 11, 'EP': 5, 'EO': 18, 'ED': 21}),
+    'eggnog-2.1.2': (21, '-', {'GO': 9, 'EC': 10, 'KG': 11, 'KR': 14, 'EP': 8, 'EO': 4, 'ED': 7}),
+}
+
+EGGNOG_ANNO_TYPES = list(_TRANSFORMS.keys())
+
+
+def _read_blocks(file: str, block_size: int):
+    """ :returns: generator of bytes that end with a complete line """
+    with open(file, 'rb') as f:
+        remainder = b''
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            block = remainder + block
+            cut = block.rfind(b'\n') + 1
+            if cut == 0:
+                remainder = block
+                continue
+            remainder = block[cut:]
+            yield block[:cut]
+        if remainder:
+            yield remainder + b'\n'
+
+
+def _check_block(block: bytes, n_columns: int, file: str) -> None:
+    """ Assert that every non-comment line has n_columns, by counting tabs per line in numpy. """
+    data = np.frombuffer(block, dtype=np.uint8)
+    line_ends = np.flatnonzero(data == ord('\n'))
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+    tabs = np.cumsum(data == ord('\t'))
+    n_tabs = tabs[line_ends] - np.concatenate(([0], tabs[line_ends[:-1]]))
+    is_comment = data[line_starts] == ord('#')
+    bad = np.flatnonzero(~is_comment & (n_tabs != n_columns - 1))
+    if len(bad):
+        line = block[line_starts[bad[0]]:line_ends[bad[0]]].decode('utf-8')
+        raise AssertionError(f'Error parsing file: {file} {len(line.split(chr(9)))=} {n_columns=} {line=}')
+
+
+def _parse_block(block: bytes, n_columns: int, empty: str, columns: {str: int}) -> {str: pd.DataFrame}:
+    df = pd.read_csv(
+        BytesIO(block), sep='\t', header=None, names=range(n_columns), dtype=str,
+        keep_default_na=False, quoting=3, engine='c'
+    )
+    df = df[~df[0].str.startswith('#')]
+    if len(df) == 0:  # e.g. a block that only contains the footer
+        return {anno_type: pd.DataFrame({'locus_tag': [], 'name': []}, dtype=object) for anno_type in columns}
+    locus_tags = df[0].str.rpartition('|')[2]
+
+    result = {}
+    for anno_type, column in columns.items():
+        split, transform = _TRANSFORMS[anno_type]
+        values = df[column]
+        mask = values != empty
+        links = pd.DataFrame({'locus_tag': locus_tags[mask], 'name': values[mask]})
+        if split:
+            links['name'] = links['name'].str.split(',')
+            links = links.explode('name')
+        # transform each distinct value only once
+        codes, uniques = pd.factorize(links['name'])
+        if len(uniques):  # str.partition of an empty series has no columns
+            links['name'] = transform(pd.Series(uniques, dtype=object)).values[codes]
+        result[anno_type] = links
+    return result
+
+
+def parse_eggnog(file: str, version: str, regexes: {str: re.Pattern}, block_size: int = 64 * 1024 ** 2) \
+        -> {str: ({str}, {(str, str)})}:
+    """
+    Parse an eggnog-mapper annotation file.
+
+    :param file: path to the emapper.annotations file
+    :param version: 'eggnog' (eggnog-mapper v1) or 'eggnog-2.1.2'
+    :param regexes: {anno_type: regex} for all EGGNOG_ANNO_TYPES, every annotation must match its regex
+    :param block_size: number of bytes to parse at once
+    :returns: {anno_type: ({'anno1', 'anno2', ...}, {('gene1', 'anno1), ('gene1', 'anno2'), ...})}
+    """
+    assert version in EGGNOG_VERSIONS, f'Eggnog version not supported: {file} {version=} {list(EGGNOG_VERSIONS)=}'
+    n_columns, empty, columns = EGGNOG_VERSIONS[version]
+
+    result = {anno_type: (set(), set()) for anno_type in columns}
+    for block in _read_blocks(file, block_size):
+        _check_block(block, n_columns, file)
+        for anno_type, links in _parse_block(block, n_columns, empty, columns).items():
+            names, relationships = result[anno_type]
+            names.update(pd.unique(links['name']))
+            relationships.update(zip(links['locus_tag'], links['name']))
+
+    for anno_type, (names, relationships) in result.items():
+        # validate each distinct annotation only once
+        regex = regexes[anno_type]
+        names = list(names)
+        matches = pd.Series(names, dtype=object).str.match(regex.pattern, flags=regex.flags)
+        if not matches.all():
+            annotation = names[np.flatnonzero(~matches.values)[0]]
+            raise AssertionError(f"Error: Annotation '{annotation}' does not match regex '{regex.pattern}'!")
+    return result
+
@@ -0,0 +1,136 @@
+from unittest import TestCase
+import os
+import re
+import random
+import tempfile
+from .eggnog_parser import parse_eggnog, EGGNOG_ANNO_TYPES
+
+REGEXES = {
+    'GO': re.compile(r'^GO:[0-9]{7}$'),
+    'EC': re.compile(r'^EC:[0-9\-]+\.[0-9\-]+\.[0-9\-]+\.[0-9n\-]+$'),
+    'KG': re.compile(r'^K[0-9]{5}$'),
+    'KR': re.compile(r'^R[0-9]{5}$'),
+    'EP': re.compile(r'^EP:.+$'),
+    'EO': re.compile(r'^EO:.+$'),
+    'ED': re.compile(r'^ED:.+$'),
+}
+
+
+def parse_eggnog_loop(file: str) -> {str: ({str}, {(str, str)})}:
+    # the line-by-line parser that parse_eggnog replaced (eggnog-2.1.2 only)
+    result = {anno_type: (set(), set()) for anno_type in EGGNOG_ANNO_TYPES}
+
+    def add_anno(annotations: list, anno_type: str):
+        all_annotations, annotations_relationships = result[anno_type]
+        for annotation in annotations:
+            assert REGEXES[anno_type].match(annotation) is not None
+            all_annotations.update(annotations)
+            annotations_relationships.update([(locus_tag, anno) for anno in annotations])
+
+    with open(file) as f:
+        for line in f:
+            if line.startswith('#'): continue
+            line = line.rstrip('\n').split('\t')
+            assert len(line) == 21
+            locus_tag = line[0].rsplit('|', maxsplit=1)[-1]
+            if line[9] != '-': add_anno(line[9].split(','), 'GO')
+            if line[10] != '-': add_anno([f'EC:{l}' for l in line[10].split(',')], 'EC')
+            if line[11] != '-': add_anno([l[3:] for l in line[11].split(',')], 'KG')
+            if line[14] != '-': add_anno(line[14].split(','), 'KR')
+            if line[8] != '-': add_anno([f'EP:{line[8]}'], 'EP')
+            if line[4] != '-': add_anno([f'EO:{line[4].split("@", maxsplit=1)[0]}'], 'EO')
+            if line[7] != '-': add_anno([f"ED:{line[7].split(',', maxsplit=1)[0].split(';', maxsplit=1)[0]}"], 'ED')
+    return result
+
+
+def mock_eggnog_file(file: str, n_genes: int, seed: int = 42) -> None:
+    rng = random.Random(seed)
+
+    def sample(fmt: str, n_max: int, k_max: int) -> str:
+        k = rng.randint(0, k_max)
+        return ','.join(fmt.format(rng.randint(1, n_max)) for _ in range(k)) or '-'
+
+    with open(file, 'w') as f:
+        f.write('## emapper-2.1.2\n#query\t' + '\t'.join(f'col{i}' for i in range(1, 21)) + '\n')
+        for i in range(n_genes):
+            line = ['-'] * 21
+            line[0] = f'gnl|Prokka|STRAIN1_{i:06d}'
+            line[4] = f'COG{rng.randint(1, 5000):04d}@1|root,COG{rng.randint(1, 5000):04d}@2|Bacteria'
+            line[7] = rng.choice(['ABC transporter', 'Transcriptional regulator, LysR family', '-'])
+            line[8] = rng.choice(['abcT', 'lysR', 'rpoB', '-'])
+            line[9] = sample('GO:{:07d}', 30000, 40)
+            line[10] = sample('1.1.1.{}', 300, 2)
+            line[11] = sample('ko:K{:05d}', 20000, 2)
+            line[14] = sample('R{:05d}', 10000, 4)
+            f.write('\t'.join(line) + '\n')
+        f.write('## 3 queries scanned\n')
+
+
+class TestEggnogParser(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.tmp.name, 'mock.emapper.annotations')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_vs_line_by_line(self):
+        mock_eggnog_file(self.file, n_genes=2000)
+        expected = parse_eggnog_loop(self.file)
+        self.assertEqual(parse_eggnog(self.file, version='eggnog-2.1.2', regexes=REGEXES), expected)
+        # lines that span several blocks
+        self.assertEqual(parse_eggnog(self.file, version='eggnog-2.1.2', regexes=REGEXES, block_size=50_000), expected)
+
+    def test_footer_in_own_block(self):
+        mock_eggnog_file(self.file, n_genes=20)
+        expected = parse_eggnog_loop(self.file)
+        with open(self.file, 'a') as f:
+            f.write('## Total time (seconds): 1.0\n')
+        with open(self.file, 'rb') as f:
+            data = f.read()
+        footer_start = data.rfind(b'\n## 3 queries scanned') + 1
+        # the block boundary falls just before the footer
+        self.assertEqual(
+            parse_eggnog(self.file, version='eggnog-2.1.2', regexes=REGEXES, block_size=footer_start), expected)
+
+    def test_only_comments(self):
+        with open(self.file, 'w') as f:
+            f.write('## emapper-2.1.2\n## 0 queries scanned\n')
+        result = parse_eggnog(self.file, version='eggnog-2.1.2', regexes=REGEXES)
+        self.assertEqual(result, {anno_type: (set(), set()) for anno_type in EGGNOG_ANNO_TYPES})
+
+    def test_transforms(self):
+        line = ['-'] * 21
+        line[0] = 'gnl|Prokka|STRAIN1_000001'
+        line[4] = 'COG0001@1|root,COG0002@2|Bacteria'
+        line[7] = 'Transcriptional regulator, LysR family; other'
+        line[10] = '1.1.1.1,2.7.1.-'
+        line[11] = 'ko:K00001'
+        with open(self.file, 'w') as f:
+            f.write('\t'.join(line))  # no trailing newline
+        result = parse_eggnog(self.file, version='eggnog-2.1.2', regexes=REGEXES)
+        self.assertEqual(result['EC'], ({'EC:1.1.1.1', 'EC:2.7.1.-'},
+                                        {('STRAIN1_000001', 'EC:1.1.1.1'), ('STRAIN1_000001', 'EC:2.7.1.-')}))
+        self.assertEqual(result['KG'], ({'K00001'}, {('STRAIN1_000001', 'K00001')}))
+        self.assertEqual(result['EO'][0], {'EO:COG0001'})
+        self.assertEqual(result['ED'][0], {'ED:Transcriptional regulator'})
+        self.assertEqual(result['GO'], (set(), set()))
+
+    def test_wrong_number_of_columns(self):
+        with open(self.file, 'w') as f:
+            f.write('\t'.join(['-'] * 20) + '\n')
+        with self.assertRaises(AssertionError):
+            parse_eggnog(self.file, version='eggnog-2.1.2', regexes=REGEXES)
+
+    def test_invalid_annotation(self):
+        line = ['-'] * 21
+        line[0] = 'STRAIN1_000001'
+        line[9] = 'GO:123'
+        with open(self.file, 'w') as f:
+            f.write('\t'.join(line) + '\n')
+        with self.assertRaises(AssertionError):
+            parse_eggnog(self.file, version='eggnog-2.1.2', regexes=REGEXES)
+
+    def test_unknown_version(self):
+        with self.assertRaises(AssertionError):
+            parse_eggnog(self.file, version='eggnog-99', regexes=REGEXES)
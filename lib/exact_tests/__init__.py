@@ -0,0 +1 @@
+from .exact_tests import METHODS, exact_test, fisher_two_sided, fisher_pvalue_table, boschloo_two_sided
@@ -0,0 +1,194 @@
+import os
+import numpy as np
+from scipy.special import gammaln
+
+"""
+Vectorized exact tests for many 2x2 contingency tables with the same column sums, as in gene trait matching:
+
+                    group 1     group 2
+    annotation      a           b
+    no annotation   n1 - a      n2 - b
+
+Fisher: all tables are tested in one call. Under H0, a follows a hypergeometric distribution that only depends on
+n1, n2 and the row sum k = a + b. The log-factorials are computed once per (n1, n2), the distribution once per k.
+
+Boschloo: there is no shortcut, the tables are distributed over a process pool.
+"""
+
+METHODS = ['fast-fisher', 'fisher', 'boschloo']
+
+# like R's fisher.test: probabilities within this relative tolerance count as equally extreme
+_REL_TOLERANCE = 1e-7
+
+
+def _log_factorial(n: int) -> np.ndarray:
+    return gammaln(np.arange(n + 1) + 1)
+
+
+def _fisher_given_k(log_factorial: np.ndarray, n1: int, n2: int, k: int) -> (int, np.ndarray):
+    """
+    :returns: smallest possible a given the row sum k, two-sided p-values of all possible a (ascending)
+    """
+    log_comb = lambda total, x: log_factorial[total] - log_factorial[x] - log_factorial[total - x]
+
+    # distribution of a given k: log-pmf of all possible values
+    x = np.arange(max(0, k - n2), min(k, n1) + 1)
+    log_pmf = log_comb(n1, x) + log_comb(n2, k - x) - log_comb(n1 + n2, k)
+
+    # p-value: sum of the probabilities of all values that are at most as likely as the observed one
+    sorted_log_pmf = np.sort(log_pmf)
+    cumulative = np.cumsum(np.exp(sorted_log_pmf))
+    pvalues = cumulative[np.searchsorted(sorted_log_pmf, log_pmf + _REL_TOLERANCE, side='right') - 1]
+    return x[0], np.minimum(pvalues, 1.)
+
+
+def fisher_two_sided(a: np.ndarray, b: np.ndarray, n1: int, n2: int) -> np.ndarray:
+    """
+    Two-sided Fisher's exact test.
+
+    :param a: number of genomes in group 1 that have the annotation, one entry per table
+    :param b: number of genomes in group 2 that have the annotation, one entry per table
+    :param n1: size of group 1
+    :param n2: size of group 2
+    :returns: p-values
+    """
+    a, b = np.asarray(a, dtype=np.int64), np.asarray(b, dtype=np.int64)
+    assert a.shape == b.shape, f'a and b must have the same shape: {a.shape=} {b.shape=}'
+    assert ((0 <= a) & (a <= n1) & (0 <= b) & (b <= n2)).all(), f'Counts must be within 0..n1 and 0..n2: {n1=} {n2=}'
+
+    log_factorial = _log_factorial(n1 + n2)
+
+    k = a + b
+    pvalues = np.empty(len(a), dtype=np.float64)
+    order = np.argsort(k, kind='stable')
+    starts = np.flatnonzero(np.diff(k[order], prepend=-1))
+    for start, end in zip(starts, np.append(starts[1:], len(order))):
+        tables = order[start:end]
+        a_min, pvalues_given_k = _fisher_given_k(log_factorial, n1, n2, int(k[tables[0]]))
+        pvalues[tables] = pvalues_given_k[a[tables] - a_min]
+
+    return pvalues
+
+
+def fisher_pvalue_table(k: np.ndarray, n1: int, n2: int) -> (np.ndarray, np.ndarray):
+    """
+    Two-sided Fisher p-values of all possible tables with these row sums, e.g. for permutation tests, where the row
+    sums do not change. The p-value of the table with row sum k[i] and a is table[k_index[i], a].
+
+    :param k: row sums (a + b)
+    :returns: table of shape (number of distinct row sums, n1 + 1), 1 for impossible tables; k_index
+    """
+    k = np.asarray(k, dtype=np.int64)
+    assert ((0 <= k) & (k <= n1 + n2)).all(), f'Row sums must be within 0..n1+n2: {n1=} {n2=}'
+
+    log_factorial = _log_factorial(n1 + n2)
+    unique_k, inverse = np.unique(k, return_inverse=True)
+    table = np.ones((len(unique_k), n1 + 1), dtype=np.float64)
+    for i, k_ in enumerate(unique_k):
+        a_min, pvalues_given_k = _fisher_given_k(log_factorial, n1, n2, int(k_))
+        table[i, a_min:a_min + len(pvalues_given_k)] = pvalues_given_k
+    return table, inverse
+
+
+def _boschloo_chunk(args: ([(int, int)], int, int)) -> [float]:
+    from scipy.stats import boschloo_exact
+    tables, n1, n2 = args
+    return [boschloo_exact([[a, b], [n1 - a, n2 - b]]).pvalue for a, b in tables]
+
+
+def boschloo_two_sided(a: np.ndarray, b: np.ndarray, n1: int, n2: int, workers: int = None) -> np.ndarray:
+    """
+    Two-sided Boschloo's exact test, parallelized over a process pool.
+
+    :param workers: number of processes, default: number of CPUs
+    :returns: p-values
+    """
+    tables = list(zip(np.asarray(a).tolist(), np.asarray(b).tolist()))
+    workers = min(workers or os.cpu_count(), len(tables))
+    if workers <= 1:
+        return np.array(_boschloo_chunk((tables, n1, n2)), dtype=np.float64)
+
+    from concurrent.futures import ProcessPoolExecutor
+    chunk_size = -(-len(tables) // (workers * 4))  # several chunks per worker to balance the load
+    chunks = [(tables[i:i + chunk_size], n1, n2) for i in range(0, len(tables), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pvalues = [pvalue for chunk in pool.map(_boschloo_chunk, chunks) for pvalue in chunk]
+    return np.array(pvalues, dtype=np.float64)
+
+
+def exact_test(method: str, a: np.ndarray, b: np.ndarray, n1: int, n2: int, workers: int = None) -> np.ndarray:
+    """
+    :param method: 'fast-fisher' or 'fisher' (both: vectorized Fisher's exact test) or 'boschloo'
+    :returns: two-sided p-values of the tables [[a, b], [n1 - a, n2 - b]]
+    """
+    if method in ('fast-fisher', 'fisher'):
+        return fisher_two_sided(a, b, n1, n2)
+    elif method == 'boschloo':
+        return boschloo_two_sided(a, b, n1, n2, workers=workers)
+    raise AssertionError(f"method must be either 'fast-fisher', 'fisher' or 'boschloo'. {method=}")
+
+
+if __name__ == '__main__':
+    from time import time
+
+
+    def unique_tables(n1: int, n2: int, n_annotations: int, seed: int = 42) -> (np.ndarray, np.ndarray):
+        # mock gene trait matching: most annotations have similar frequencies in both groups
+        rng = np.random.default_rng(seed)
+        frequency = rng.beta(0.3, 0.3, n_annotations)
+        shift = rng.normal(0, 0.05, n_annotations)
+        a = rng.binomial(n1, frequency)
+        b = rng.binomial(n2, np.clip(frequency + shift, 0, 1))
+        tables = np.unique(np.stack([a, b]), axis=1)
+        return tables[0], tables[1]
+
+
+    def benchmark(sizes: [int] = (100, 1000, 5000), n_annotations: int = 20_000, n_boschloo: int = 32,
+                  max_rowwise: int = 5_000):
+        """
+        :param sizes: number of genomes per group
+        :param n_annotations: annotations per run, duplicate tables are removed like in gtm
+        :param n_boschloo: number of tables for the Boschloo benchmark (slow!)
+        :param max_rowwise: extrapolate the row-by-row timing if there are more tables
+        """
+        from scipy.stats import fisher_exact, boschloo_exact
+        try:
+            from fast_fisher import fast_fisher_cython
+        except ImportError:
+            fast_fisher_cython = None
+
+        for n in sizes:
+            a, b = unique_tables(n, n, n_annotations)
+            print(f'{n} vs {n} genomes: {len(a)} unique tables')
+
+            start = time()
+            pvalues = fisher_two_sided(a, b, n, n)
+            print(f'  fisher, vectorized:          {time() - start:8.3f}s')
+
+            sample = slice(0, min(len(a), max_rowwise))
+            extrapolate = len(a) / len(a[sample])
+            start = time()
+            expected = np.array([fisher_exact([[a_, b_], [n - a_, n - b_]])[1] for a_, b_ in zip(a[sample], b[sample])])
+            print(f'  fisher, scipy row by row:    {(time() - start) * extrapolate:8.3f}s')
+            assert np.allclose(pvalues[sample], expected, rtol=1e-6, atol=1e-300), 'vectorized Fisher differs from scipy'
+
+            if fast_fisher_cython is not None:
+                start = time()
+                for a_, b_ in zip(a, b):
+                    fast_fisher_cython.test1t(int(a_), int(b_), int(n - a_), int(n - b_))
+                print(f'  fisher, fast-fisher:         {time() - start:8.3f}s')
+
+            if n_boschloo and n <= 1000:
+                a_, b_ = a[:n_boschloo], b[:n_boschloo]
+                start = time()
+                expected = [boschloo_exact([[x, y], [n - x, n - y]]).pvalue for x, y in zip(a_, b_)]
+                print(f'  boschloo, row by row:        {time() - start:8.3f}s ({len(a_)} tables)')
+                start = time()
+                pvalues = boschloo_two_sided(a_, b_, n, n)
+                print(f'  boschloo, {os.cpu_count():>2} processes:     {time() - start:8.3f}s ({len(a_)} tables)')
+                assert np.allclose(pvalues, expected), 'parallel Boschloo differs'
+
+
+    from fire import Fire
+
+    Fire(benchmark)
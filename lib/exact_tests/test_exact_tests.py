@@ -0,0 +1,58 @@
+from unittest import TestCase
+import numpy as np
+from scipy.stats import fisher_exact
+from .exact_tests import fisher_two_sided, fisher_pvalue_table, exact_test
+
+
+def all_tables(n1: int, n2: int) -> (np.ndarray, np.ndarray):
+    a, b = np.meshgrid(np.arange(n1 + 1), np.arange(n2 + 1), indexing='ij')
+    return a.ravel(), b.ravel()
+
+
+def scipy_fisher(a: np.ndarray, b: np.ndarray, n1: int, n2: int) -> np.ndarray:
+    return np.array([fisher_exact([[a_, b_], [n1 - a_, n2 - b_]])[1] for a_, b_ in zip(a, b)])
+
+
+class TestFisher(TestCase):
+    def test_all_tables_vs_scipy(self):
+        for n1, n2 in [(1, 1), (3, 5), (7, 7), (12, 4), (20, 31)]:
+            a, b = all_tables(n1, n2)
+            np.testing.assert_allclose(
+                fisher_two_sided(a, b, n1, n2), scipy_fisher(a, b, n1, n2), rtol=1e-6, atol=1e-12,
+                err_msg=f'{n1=} {n2=}'
+            )
+
+    def test_large_groups_vs_scipy(self):
+        n1, n2 = 150, 230
+        rng = np.random.default_rng(0)
+        a, b = rng.integers(0, n1 + 1, size=50), rng.integers(0, n2 + 1, size=50)
+        np.testing.assert_allclose(fisher_two_sided(a, b, n1, n2), scipy_fisher(a, b, n1, n2), rtol=1e-6, atol=1e-12)
+
+    def test_order_and_duplicates(self):
+        a, b = np.array([3, 0, 3, 1, 0]), np.array([0, 4, 0, 2, 4])
+        pvalues = fisher_two_sided(a, b, 3, 4)
+        self.assertEqual(pvalues[0], pvalues[2])
+        self.assertEqual(pvalues[1], pvalues[4])
+        np.testing.assert_allclose(pvalues, scipy_fisher(a, b, 3, 4), rtol=1e-6)
+
+    def test_empty(self):
+        self.assertEqual(len(fisher_two_sided(np.array([], dtype=int), np.array([], dtype=int), 3, 4)), 0)
+
+    def test_invalid_counts(self):
+        with self.assertRaises(AssertionError):
+            fisher_two_sided(np.array([4]), np.array([0]), 3, 4)
+
+    def test_pvalue_table(self):
+        n1, n2 = 6, 9
+        a, b = all_tables(n1, n2)
+        table, k_index = fisher_pvalue_table(a + b, n1, n2)
+        self.assertEqual(table.shape, (n1 + n2 + 1, n1 + 1))
+        np.testing.assert_array_equal(table[k_index, a], fisher_two_sided(a, b, n1, n2))
+        # impossible tables, e.g. a = 0 with k = n1 + n2
+        self.assertEqual(table[-1, 0], 1.)
+
+    def test_exact_test(self):
+        a, b = all_tables(4, 5)
+        np.testing.assert_array_equal(exact_test('fisher', a, b, 4, 5), exact_test('fast-fisher', a, b, 4, 5))
+        with self.assertRaises(AssertionError):
+            exact_test('chi2', a, b, 4, 5)
@@ -0,0 +1,374 @@
+import os
+import io
+import time
+import mmap
+import fcntl
+import shutil
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import BinaryIO
+
+"""
+Storage backends for ogb_cache. They store serialized results (bytes) under (name, key):
+    name: usually the function, e.g. 'plugins.calculate_blast.calculate_blast'
+    key:  hash of the arguments
+
+Each backend keeps track of the order in which entries were used, so evicting the least recently used entries does
+not require scanning the whole cache.
+
+Writes are atomic, i.e. readers never see partially written results.
+"""
+
+MMAP_THRESHOLD = 1024 ** 2  # memory-map larger files instead of reading them
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Exclusive lock across processes (flock). The lock is released by the OS if the holding process dies.
+
+    The lock file is removed on release. A waiter that acquired the lock on a file that was removed in the meantime
+    tries again, otherwise two processes could hold "the same" lock.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+    try:
+        yield
+    finally:
+        os.unlink(path)
+        os.close(fd)
+
+
+class CacheBackend:
+    lock_dir: str
+
+    def lock(self, name: str, key: str):
+        """
+        :returns: context manager that holds an exclusive lock for (name, key) across processes, used to make sure
+                  that only one process computes a result while the others wait for it
+        """
+        return file_lock(os.path.join(self.lock_dir, f'{name}.{key}.lock'))
+
+    def get(self, name: str, key: str) -> (bytes, datetime):
+        """
+        :returns: (data, time of creation), marks the entry as recently used
+        :raises KeyError: if there is no such entry
+        """
+        raise NotImplementedError
+
+    def set(self, name: str, key: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    def open(self, name: str, key: str) -> (BinaryIO, datetime):
+        """
+        :returns: (file object, time of creation), for streaming large results
+        :raises KeyError: if there is no such entry
+        """
+        data, created = self.get(name, key)
+        return io.BytesIO(data), created
+
+    def delete(self, name: str, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self, name: str) -> None:
+        """ Remove all entries of name and remember when, see cleared """
+        raise NotImplementedError
+
+    def cleared(self, name: str) -> datetime or None:
+        """ :returns: time of the last clear, entries created before are invalid (e.g. in the memory of other processes) """
+        raise NotImplementedError
+
+    def evict(self, name: str, maxsize: int) -> [str]:
+        """
+        Remove the least recently used entries of name until at most maxsize remain.
+
+        :returns: keys of the removed entries
+        """
+        raise NotImplementedError
+
+
+class DiskBackend(CacheBackend):
+    """
+    CACHE_DIR/function/:                    cache_fn_dir
+    CACHE_DIR/function/<hash>/:             cache_res_dir
+    CACHE_DIR/function/<hash>/res.bin:      serialized result, its mtime is the time of creation
+    CACHE_DIR/.cleared/function:            its mtime is the time of the last clear
+
+    The mtime of cache_res_dir is the time of last use. The LRU order of each cache_fn_dir is kept in memory: it is
+    built from the mtimes of the entries once and then updated in O(1). Other processes may add entries, therefore
+    the directory is re-scanned every rescan_every inserts.
+    """
+
+    def __init__(self, cache_dir: str, rescan_every: int = 100):
+        self.cache_dir = cache_dir
+        self.lock_dir = os.path.join(cache_dir, '.locks')
+        self.rescan_every = rescan_every
+        self._lru = {}  # {name: OrderedDict({key: None}), least recently used first}
+        self._n_inserts = {}
+        self._lock = threading.Lock()
+
+    def cache_fn_dir(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def cache_res_dir(self, name: str, key: str) -> str:
+        return os.path.join(self.cache_dir, name, key)
+
+    def _res_file(self, name: str, key: str) -> str:
+        return os.path.join(self.cache_dir, name, key, 'res.bin')
+
+    def _scan(self, name: str) -> OrderedDict:
+        cache_fn_dir = self.cache_fn_dir(name)
+        if not os.path.isdir(cache_fn_dir):
+            return OrderedDict()
+        entries = []
+        for entry in os.scandir(cache_fn_dir):
+            try:
+                entries.append((entry.stat().st_mtime, entry.name))
+            except FileNotFoundError:
+                pass  # removed by another process
+        return OrderedDict((key, None) for mtime, key in sorted(entries))
+
+    def _index(self, name: str) -> OrderedDict:
+        if name not in self._lru:
+            self._lru[name] = self._scan(name)
+            self._n_inserts[name] = 0
+        return self._lru[name]
+
+    def get(self, name: str, key: str) -> (bytes, datetime):
+        f, created = self.open(name, key)
+        with f:
+            if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+                # the mapping stays valid even if the file is replaced or removed
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = f.read()
+        return data, created
+
+    def open(self, name: str, key: str) -> (BinaryIO, datetime):
+        try:
+            f = open(self._res_file(name, key), 'rb')
+        except FileNotFoundError:
+            raise KeyError(key)
+        created = datetime.fromtimestamp(os.fstat(f.fileno()).st_mtime)
+        os.utime(self.cache_res_dir(name, key))  # mark as recently used for other processes
+        with self._lock:
+            index = self._index(name)
+            index[key] = None
+            index.move_to_end(key)
+        return f, created
+
+    def set(self, name: str, key: str, data: bytes) -> None:
+        os.makedirs(self.cache_res_dir(name, key), exist_ok=True)
+        res_file = self._res_file(name, key)
+        with open(f'{res_file}.{os.getpid()}.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(f'{res_file}.{os.getpid()}.tmp', res_file)
+        with self._lock:
+            index = self._index(name)
+            index[key] = None
+            index.move_to_end(key)
+            self._n_inserts[name] += 1
+
+    def delete(self, name: str, key: str) -> None:
+        with self._lock:
+            self._index(name).pop(key, None)
+        _remove(self.cache_res_dir(name, key))
+
+    def _cleared_file(self, name: str) -> str:
+        return os.path.join(self.cache_dir, '.cleared', name)
+
+    def clear(self, name: str) -> None:
+        os.makedirs(os.path.dirname(self._cleared_file(name)), exist_ok=True)
+        with open(self._cleared_file(name), 'a'):
+            os.utime(self._cleared_file(name))
+        with self._lock:
+            self._lru[name] = OrderedDict()
+            self._n_inserts[name] = 0
+        _remove(self.cache_fn_dir(name))
+
+    def cleared(self, name: str) -> datetime or None:
+        try:
+            return datetime.fromtimestamp(os.path.getmtime(self._cleared_file(name)))
+        except FileNotFoundError:
+            return None
+
+    def evict(self, name: str, maxsize: int) -> [str]:
+        with self._lock:
+            if self._n_inserts.get(name, 0) >= self.rescan_every:
+                del self._lru[name]
+            index = self._index(name)
+            to_remove = [index.popitem(last=False)[0] for _ in range(max(0, len(index) - maxsize))]
+        for key in to_remove:
+            _remove(self.cache_res_dir(name, key))
+        return to_remove
+
+
+class SQLiteBackend(CacheBackend):
+    """ All entries in a single SQLite database. Safe to use from multiple processes. """
+
+    def __init__(self, file: str):
+        self.file = file
+        self.lock_dir = os.path.join(os.path.dirname(os.path.abspath(file)), '.locks')
+        os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS cache (
+                    name TEXT NOT NULL, key TEXT NOT NULL, data BLOB NOT NULL,
+                    created REAL NOT NULL, accessed REAL NOT NULL,
+                    PRIMARY KEY (name, key)
+                )
+            ''')
+            connection.execute('CREATE INDEX IF NOT EXISTS cache_lru ON cache (name, accessed)')
+            connection.execute('CREATE TABLE IF NOT EXISTS cleared (name TEXT PRIMARY KEY, time REAL NOT NULL)')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.file, timeout=60)
+
+    def get(self, name: str, key: str) -> (bytes, datetime):
+        with self._connect() as connection:
+            row = connection.execute('SELECT data, created FROM cache WHERE name = ? AND key = ?', (name, key)).fetchone()
+            if row is None:
+                raise KeyError(key)
+            connection.execute('UPDATE cache SET accessed = ? WHERE name = ? AND key = ?', (time.time(), name, key))
+        data, created = row
+        return data, datetime.fromtimestamp(created)
+
+    def set(self, name: str, key: str, data: bytes) -> None:
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)', (name, key, data, now, now))
+
+    def delete(self, name: str, key: str) -> None:
+        with self._connect() as connection:
+            connection.execute('DELETE FROM cache WHERE name = ? AND key = ?', (name, key))
+
+    def clear(self, name: str) -> None:
+        with self._connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO cleared VALUES (?, ?)', (name, time.time()))
+            connection.execute('DELETE FROM cache WHERE name = ?', (name,))
+
+    def cleared(self, name: str) -> datetime or None:
+        with self._connect() as connection:
+            row = connection.execute('SELECT time FROM cleared WHERE name = ?', (name,)).fetchone()
+        return None if row is None else datetime.fromtimestamp(row[0])
+
+    def evict(self, name: str, maxsize: int) -> [str]:
+        with self._connect() as connection:
+            to_remove = [key for key, in connection.execute(
+                'SELECT key FROM cache WHERE name = ? ORDER BY accessed DESC LIMIT -1 OFFSET ?', (name, maxsize)
+            )]
+            connection.executemany('DELETE FROM cache WHERE name = ? AND key = ?', [(name, key) for key in to_remove])
+        return to_remove
+
+
+class RedisBackend(CacheBackend):
+    """
+    Entries are Redis hashes, the LRU order of each name is a sorted set (score: time of last access).
+
+    Requires redis-py: pip install redis
+    """
+
+    def __init__(self, url: str, prefix: str = 'ogb_cache'):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, name: str, key: str) -> str:
+        return f'{self.prefix}:{name}:{key}'
+
+    def _lru(self, name: str) -> str:
+        return f'{self.prefix}:{name}'
+
+    def lock(self, name: str, key: str):
+        # works across hosts. the lock expires if the holder dies, but not before a long computation is done
+        return self.redis.lock(f'{self.prefix}:lock:{name}:{key}', timeout=60 * 60)
+
+    def get(self, name: str, key: str) -> (bytes, datetime):
+        data, created = self.redis.hmget(self._key(name, key), 'data', 'created')
+        if data is None:
+            raise KeyError(key)
+        self.redis.zadd(self._lru(name), {key: time.time()})
+        return data, datetime.fromtimestamp(float(created))
+
+    def set(self, name: str, key: str, data: bytes) -> None:
+        now = time.time()
+        pipeline = self.redis.pipeline()
+        pipeline.hset(self._key(name, key), mapping={'data': data, 'created': now})
+        pipeline.zadd(self._lru(name), {key: now})
+        pipeline.execute()
+
+    def delete(self, name: str, key: str) -> None:
+        pipeline = self.redis.pipeline()
+        pipeline.delete(self._key(name, key))
+        pipeline.zrem(self._lru(name), key)
+        pipeline.execute()
+
+    def clear(self, name: str) -> None:
+        self.redis.set(f'{self.prefix}:cleared:{name}', time.time())
+        keys = [key.decode('utf-8') for key in self.redis.zrange(self._lru(name), 0, -1)]
+        pipeline = self.redis.pipeline()
+        for key in keys:
+            pipeline.delete(self._key(name, key))
+        pipeline.delete(self._lru(name))
+        pipeline.execute()
+
+    def cleared(self, name: str) -> datetime or None:
+        cleared = self.redis.get(f'{self.prefix}:cleared:{name}')
+        return None if cleared is None else datetime.fromtimestamp(float(cleared))
+
+    def evict(self, name: str, maxsize: int) -> [str]:
+        n_remove = self.redis.zcard(self._lru(name)) - maxsize
+        if n_remove <= 0:
+            return []
+        to_remove = [key.decode('utf-8') for key, score in self.redis.zpopmin(self._lru(name), n_remove)]
+        for key in to_remove:
+            self.redis.delete(self._key(name, key))
+        return to_remove
+
+
+def _remove(path: str) -> None:
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    except Exception as e:
+        logging.warning(f'Could not delete cache: {path=} {e=}')
+
+
+_backends = {}
+
+
+def get_backend(backend: str, cache_dir: str) -> CacheBackend:
+    """
+    :param backend: 'disk', 'sqlite' (CACHE_DIR/ogb_cache.sqlite3), 'sqlite:////path/to/file.sqlite3'
+                    or 'redis://host:port/db'
+    :param cache_dir: root directory of the cache
+    :returns: backend instance, shared within the process
+    """
+    if (backend, cache_dir) not in _backends:
+        if backend == 'disk':
+            instance = DiskBackend(cache_dir)
+        elif backend == 'sqlite':
+            instance = SQLiteBackend(os.path.join(cache_dir, 'ogb_cache.sqlite3'))
+        elif backend.startswith('sqlite:///'):
+            instance = SQLiteBackend(backend[len('sqlite:///'):])
+        elif backend.startswith('redis://') or backend.startswith('rediss://'):
+            instance = RedisBackend(backend)
+        else:
+            raise AssertionError(f"Unknown cache backend: {backend}. Use 'disk', 'sqlite', 'sqlite:///...' or 'redis://...'")
+        _backends[(backend, cache_dir)] = instance
+    return _backends[(backend, cache_dir)]
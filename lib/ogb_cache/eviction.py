@@ -0,0 +1,132 @@
+import os
+import time
+import threading
+from collections import namedtuple
+from .backends import _remove
+from .stats import CacheStats
+
+"""
+Byte-budgeted eviction across all of CACHE_DIR.
+
+Every subdirectory of CACHE_DIR is a cache (e.g. 'downloader', 'core-genome-dendrogram' or the subdirectories of
+ogb_cache functions) and every file or directory in it is an entry. Hidden files and files directly in CACHE_DIR
+(e.g. locks, statistics, the SQLite backend) are ignored.
+
+Policies:
+    lru: remove the least recently used entries first (time of last modification, ogb_cache updates it on each hit)
+    lfu: remove the least frequently used entries first (hits according to CacheStats, ties: lru)
+"""
+
+POLICIES = ['lru', 'lfu']
+
+# scanning all of CACHE_DIR is expensive: enforce_budget does it at most once per ENFORCE_BUDGET_SECONDS or
+# ENFORCE_BUDGET_CALLS calls (per cache_dir and process)
+ENFORCE_BUDGET_SECONDS = 60
+ENFORCE_BUDGET_CALLS = 100
+
+_budget_lock = threading.Lock()
+_budget_checks = {}  # {cache_dir: [time of the last scan (monotonic), calls since]}
+
+CacheEntry = namedtuple('CacheEntry', ['name', 'key', 'path', 'nbytes', 'accessed'])
+
+
+def _size(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    nbytes = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                nbytes += os.path.getsize(os.path.join(root, file))
+            except FileNotFoundError:
+                pass  # removed by another process
+    return nbytes
+
+
+def scan_cache_dir(cache_dir: str) -> [CacheEntry]:
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return entries
+    for cache in os.scandir(cache_dir):
+        if cache.name.startswith('.') or not cache.is_dir():
+            continue
+        for entry in os.scandir(cache.path):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                entries.append(CacheEntry(cache.name, entry.name, entry.path, _size(entry.path), entry.stat().st_mtime))
+            except FileNotFoundError:
+                pass  # removed by another process
+    return entries
+
+
+def evict_cache_dir(
+        cache_dir: str,
+        maxbytes: int,
+        policy: str = 'lru',
+        stats: CacheStats = None,
+        min_age: int = 60
+) -> [CacheEntry]:
+    """
+    Remove entries until all caches in cache_dir together use at most maxbytes.
+
+    :param cache_dir: root directory of the caches
+    :param maxbytes: budget in bytes
+    :param policy: 'lru' or 'lfu'
+    :param stats: statistics, used for 'lfu' and updated for removed entries
+    :param min_age: never remove entries that were modified less than min_age seconds ago, they may still be written
+    :returns: removed entries
+    """
+    assert policy in POLICIES, f'Unknown eviction policy: {policy}. Use one of {POLICIES}'
+    assert policy != 'lfu' or stats is not None, 'The lfu policy requires stats'
+
+    entries = scan_cache_dir(cache_dir)
+    nbytes = sum(entry.nbytes for entry in entries)
+    if nbytes <= maxbytes:
+        return []
+
+    if policy == 'lru':
+        entries.sort(key=lambda entry: entry.accessed)
+    else:
+        hits = stats.hits()
+        entries.sort(key=lambda entry: (hits.get((entry.name, entry.key), 0), entry.accessed))
+
+    removed = []
+    too_recent = time.time() - min_age
+    for entry in entries:
+        if nbytes <= maxbytes:
+            break
+        if entry.accessed > too_recent:
+            continue
+        _remove(entry.path)
+        nbytes -= entry.nbytes
+        removed.append(entry)
+
+    if stats is not None:
+        for name in set(entry.name for entry in removed):
+            stats.forget(name, [entry.key for entry in removed if entry.name == name])
+
+    return removed
+
+
+def _budget_due(cache_dir: str) -> bool:
+    """ :returns: whether cache_dir should be scanned on this call """
+    with _budget_lock:
+        check = _budget_checks.setdefault(cache_dir, [None, 0])
+        check[1] += 1
+        if check[0] is not None and check[1] < ENFORCE_BUDGET_CALLS and \
+                time.monotonic() - check[0] < ENFORCE_BUDGET_SECONDS:
+            return False
+        _budget_checks[cache_dir] = [time.monotonic(), 0]
+        return True
+
+
+def enforce_budget(cache_dir: str, maxbytes: int, policy: str = 'lru', stats: CacheStats = None) -> [CacheEntry]:
+    """
+    Throttled evict_cache_dir, to be called whenever something was added to cache_dir.
+
+    :returns: removed entries, empty if the scan was skipped
+    """
+    if not _budget_due(os.path.abspath(cache_dir)):
+        return []
+    return evict_cache_dir(cache_dir, maxbytes=maxbytes, policy=policy, stats=stats)
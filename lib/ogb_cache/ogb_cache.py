@@ -1,42 +1,70 @@
 import logging
 import os
-import json
 import shutil
-import pickle
-import time
-from hashlib import sha1
+import threading
+from time import perf_counter, monotonic
+from functools import wraps
+from collections import OrderedDict
 from datetime import timedelta, datetime
-
-WAIT_TOLERANCE = timedelta(seconds=10)
+from .backends import CacheBackend, DiskBackend, get_backend
+from .stats import CacheStats, get_stats
+from .eviction import enforce_budget as enforce_cache_budget
+from .serialization import hash_arguments, encode, decode, iter_payload
 
 """
 CACHE_DIR/:                 cache_dir
 CACHE_DIR/function/:        cache_fn_dir
 CACHE_DIR/function/<hash>/: cache_res_dir
+
+Two tiers: results are kept in an in-process LRU (bounded by bytes) in front of a storage backend (see backends.py).
+How arguments are hashed and results are serialized: see serialization.py
+
+Decorated functions can be cleared (function.clear()). Other processes notice it within CLEARED_CHECK_SECONDS and
+drop the results they keep in memory.
 """
 
+CLEARED_CHECK_SECONDS = 5
 
-def _dump_res(cache_res_dir, res) -> None:
-    with open(f'{cache_res_dir}/res.pickle', 'wb') as f:
-        pickle.dump(res, f)
 
+class MemoryLRU:
+    """ In-process LRU cache, bounded by the size of the serialized results. All operations are O(1). """
 
-def _load_res(cache_res_dir) -> tuple:
-    with open(f'{cache_res_dir}/res.pickle', 'rb') as f:
-        res = pickle.load(f)
-    return res
+    def __init__(self, maxbytes: int):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._entries = OrderedDict()  # {key: (res, nbytes, created)}, least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key) -> (object, datetime):
+        """ :raises KeyError: if key is not cached """
+        with self._lock:
+            res, nbytes, created = self._entries[key]
+            self._entries.move_to_end(key)
+            return res, created
 
+    def put(self, key, res, nbytes: int, created: datetime) -> None:
+        if nbytes > self.maxbytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (res, nbytes, created)
+            self.nbytes += nbytes
+            while self.nbytes > self.maxbytes:
+                self._pop(next(iter(self._entries)))
 
-def _load_timestamp(cache_res_dir: str) -> datetime:
-    with open(f'{cache_res_dir}/timestamp.txt') as f:
-        timestamp = datetime.fromisoformat(f.read().strip())
-    return timestamp
+    def pop(self, key) -> None:
+        with self._lock:
+            self._pop(key)
 
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
 
-def _dump_timestamp(cache_res_dir: str) -> None:
-    timestamp = datetime.now().isoformat()
-    with open(f'{cache_res_dir}/timestamp.txt', 'w') as f:
-        f.write(timestamp)
+    def _pop(self, key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
 
 
 def clear_cache(cache_fn_dir: str, maxsize: int) -> None:
@@ -60,113 +88,219 @@ def clear_cache(cache_fn_dir: str, maxsize: int) -> None:
             logging.warning(f'Could not delete cache: {dir=} {e=}')
 
 
-def _hash(args, kwargs):
-    try:
-        args_hash = sha1(json.dumps(args, sort_keys=True).encode("utf-8")).hexdigest()
-    except TypeError as e:
-        raise type(e)(str(e) + f' - Could not hash args. ({args=})')
-
-    try:
-        kwargs_hash = sha1(json.dumps(kwargs, sort_keys=True).encode("utf-8")).hexdigest()
-    except TypeError as e:
-        raise type(e)(str(e) + f' - Could not hash kwargs. ({kwargs=})')
-
-    return f'{args_hash}:{kwargs_hash}'
+def _expired(created: datetime, invalid_after: timedelta, cleared: datetime = None) -> bool:
+    """ :param cleared: time of the last clear of the function, see CacheBackend.cleared """
+    if cleared is not None and created < cleared:
+        return True
+    return invalid_after is not None and datetime.now() - created > invalid_after
 
 
 def load_cache_or_run(
-        cache_dir: str,
-        wait_tolerance: timedelta,
+        backend: CacheBackend,
+        memory: MemoryLRU,
         invalid_after: timedelta,
         add_cache_dir_kwarg: bool,
         maxsize: int,
         func, args, kwargs,
-        cache_subdir: str = None
+        cache_subdir: str = None,
+        stats: CacheStats = None,
+        enforce_budget=None,
+        compress: bool = False,
+        cleared: datetime = None
 ):
     if not cache_subdir:
         cache_subdir = f'{func.__module__}.{func.__name__}'
-    cache_fn_dir = os.path.join(cache_dir, cache_subdir)
-    hash = _hash(args, kwargs)
-    cache_res_dir = os.path.join(cache_fn_dir, hash)
-
-    dir_exists = os.path.isdir(cache_res_dir)
+    hash = hash_arguments(args, kwargs)
 
-    if invalid_after is not None and dir_exists:
-        cache_age = datetime.now() - datetime.fromtimestamp(os.path.getctime(cache_res_dir))
-        if cache_age > invalid_after:
-            print(f'----- ogb cache : invalidate ----- {cache_fn_dir}/{hash}')
-            shutil.rmtree(cache_res_dir)
-            dir_exists = False
-
-    if dir_exists:
-        print(f'----- ogb cache : load ----- {cache_fn_dir}/{hash}')
+    # tier 1: memory. results are shared between callers, do not modify them!
+    if memory is not None:
         try:
-            res = _load_res(cache_res_dir)
-        except Exception:
-            time.sleep(wait_tolerance.total_seconds())
-            res = _load_res(cache_res_dir)
+            res, created = memory.get((cache_subdir, hash))
+            if not _expired(created, invalid_after, cleared):
+                if stats is not None:
+                    stats.record_hit(cache_subdir, hash)
+                return res
+            memory.pop((cache_subdir, hash))
+        except KeyError:
+            pass
+
+    # tier 2: backend
+    try:
+        res, data, created = _load(backend, cache_subdir, hash, invalid_after, cleared)
+        if stats is not None:
+            stats.record_hit(cache_subdir, hash)
+    except KeyError:
+        # single flight: the first caller computes the result, concurrent callers wait for it
+        with backend.lock(cache_subdir, hash):
+            try:
+                res, data, created = _load(backend, cache_subdir, hash, invalid_after, cleared)
+                if stats is not None:
+                    stats.record_hit(cache_subdir, hash)
+            except KeyError:
+                start = perf_counter()
+                res, data, created = _run(backend, cache_subdir, hash, add_cache_dir_kwarg, compress, func, args, kwargs)
+                if stats is not None:
+                    stats.record_miss(cache_subdir, hash, nbytes=len(data), seconds=perf_counter() - start)
+
+                # delete old entries
+                removed = backend.evict(cache_subdir, maxsize=maxsize)
+                if stats is not None and removed:
+                    stats.forget(cache_subdir, removed)
+                if enforce_budget is not None:
+                    enforce_budget()
+
+    if memory is not None:
+        memory.put((cache_subdir, hash), res, nbytes=len(data), created=created)
 
-        # only update timestamp if cache successfully read
-        _dump_timestamp(cache_res_dir)
+    return res
 
-    else:
-        print(f'----- ogb cache : run  ----- {cache_fn_dir}/{hash}')
-        os.makedirs(cache_res_dir)
-        try:
-            _dump_timestamp(cache_res_dir)
 
-            # run function
-            if add_cache_dir_kwarg:
-                res = func(*args, **kwargs, cache_res_dir=cache_res_dir)
-            else:
-                res = func(*args, **kwargs)
+def _load(backend: CacheBackend, cache_subdir: str, hash: str, invalid_after: timedelta,
+          cleared: datetime = None) -> (object, bytes, datetime):
+    """ :raises KeyError: if the result is not cached or expired """
+    data, created = backend.get(cache_subdir, hash)
 
-            # save output to cache
+    if _expired(created, invalid_after, cleared):
+        print(f'----- ogb cache : invalidate ----- {cache_subdir}/{hash}')
+        backend.delete(cache_subdir, hash)
+        raise KeyError(hash)
 
-            _dump_res(cache_res_dir, res)
-        except Exception as e:
-            logging.warning(f'Failed to create cache! {cache_res_dir=}')
-            shutil.rmtree(cache_res_dir)
-            raise e
+    print(f'----- ogb cache : load ----- {cache_subdir}/{hash}')
+    return decode(data), data, created
 
-    # delete old files
-    clear_cache(cache_fn_dir=cache_fn_dir, maxsize=maxsize)
 
-    return res
+def _run(backend: CacheBackend, cache_subdir: str, hash: str, add_cache_dir_kwarg: bool, compress: bool,
+         func, args, kwargs) -> (object, bytes, datetime):
+    print(f'----- ogb cache : run  ----- {cache_subdir}/{hash}')
+    created = datetime.now()
+    try:
+        # run function
+        if add_cache_dir_kwarg:
+            assert isinstance(backend, DiskBackend), 'add_cache_dir_kwarg requires the disk backend'
+            cache_res_dir = backend.cache_res_dir(cache_subdir, hash)
+            os.makedirs(cache_res_dir, exist_ok=True)
+            res = func(*args, **kwargs, cache_res_dir=cache_res_dir)
+        else:
+            res = func(*args, **kwargs)
+
+        # save output to cache
+        data = encode(res, compress=compress)
+        backend.set(cache_subdir, hash, data)
+    except Exception as e:
+        logging.warning(f'Failed to create cache! {cache_subdir}/{hash}')
+        backend.delete(cache_subdir, hash)
+        raise e
+    return res, data, created
 
 
 def ogb_cache(
         cache_root: str,
         maxsize: int,
-        wait_tolerance: timedelta = WAIT_TOLERANCE,
         add_cache_dir_kwarg: bool = False,
         cache_subdir: str = None,
-        invalid_after: timedelta = None
+        invalid_after: timedelta = None,
+        backend: str = 'disk',
+        memory_maxbytes: int = 0,
+        maxbytes: int = 0,
+        policy: str = 'lru',
+        compress: bool = False
 ):
     """
     This is a decorator function. Example usage:
 
-    @ogb_cache(cache_root=/tmp, maxsize=2, wait_tolerance=timedelta(seconds=30))
+    @ogb_cache(cache_root=/tmp, maxsize=2)
     def go_2(cache_res_dir: str):
         ...
 
     :param cache_root: root directory of the cache. will create a subfolder for each cached function
     :param maxsize: max entries in the cache
-    :param wait_tolerance: if cache cannot be loaded, try again after wait_tolerance
     :param add_cache_dir_kwarg: if true, add kwarg to function: {cache_res_dir: /cache_root/function/hash}
     :param cache_subdir: to specify a cache subdir instead of having the name automatically generated
+    :param invalid_after: recalculate results that are older than this
+    :param backend: where to store results: 'disk', 'sqlite', 'sqlite:///...' or 'redis://...', see backends.get_backend
+    :param memory_maxbytes: additionally keep up to this many bytes of results in memory (per function), 0: disabled
+    :param maxbytes: byte budget for all caches in cache_root together, enforced after misses (throttled, see
+        eviction.enforce_budget), 0: disabled
+    :param policy: eviction policy for maxbytes: 'lru' or 'lfu', see eviction.py
+    :param compress: compress results with zstd (requires zstandard)
+
+    Functions that return str or bytes get an additional method, stream(*args, **kwargs), which returns the result as
+    a generator of bytes that is read from the backend in chunks, e.g. for StreamingHttpResponse.
+
+    All decorated functions get the method clear(), which removes all cached results of the function from the
+    backend and from memory (in other processes within CLEARED_CHECK_SECONDS), and cached(*args, **kwargs), which
+    returns whether a valid result for the arguments is cached, without computing it.
     """
     cache_dir = os.path.expanduser(cache_root)
     os.makedirs(cache_dir, exist_ok=True)
+    storage = get_backend(backend, cache_dir)
+    memory = MemoryLRU(maxbytes=memory_maxbytes) if memory_maxbytes > 0 else None
+    stats = get_stats(cache_dir)
+
+    def enforce_budget():
+        enforce_cache_budget(cache_dir, maxbytes=maxbytes, policy=policy, stats=stats)
 
     def inner(func):
+        name = cache_subdir or f'{func.__module__}.{func.__name__}'
+        last_cleared = [None, None]  # [time of the last check (monotonic), time of the last clear]
+
+        def cleared() -> datetime or None:
+            if last_cleared[0] is None or monotonic() - last_cleared[0] > CLEARED_CHECK_SECONDS:
+                last_cleared[:] = [monotonic(), storage.cleared(name)]
+            return last_cleared[1]
+
+        @wraps(func)
         def wrapper(*args, **kwargs):
             res = load_cache_or_run(
-                cache_dir=cache_dir, wait_tolerance=wait_tolerance, invalid_after=invalid_after, add_cache_dir_kwarg=add_cache_dir_kwarg,
-                maxsize=maxsize, func=func, args=args, kwargs=kwargs, cache_subdir=cache_subdir
+                backend=storage, memory=memory, invalid_after=invalid_after,
+                add_cache_dir_kwarg=add_cache_dir_kwarg, maxsize=maxsize, func=func, args=args, kwargs=kwargs,
+                cache_subdir=name, stats=stats, enforce_budget=enforce_budget if maxbytes > 0 else None,
+                compress=compress, cleared=cleared()
             )
             return res
 
+        def clear() -> None:
+            storage.clear(name)
+            if memory is not None:
+                memory.clear()
+            stats.forget(name)
+            last_cleared[:] = [None, None]
+
+        def cached(*args, **kwargs) -> bool:
+            hash = hash_arguments(args, kwargs)
+            if memory is not None:
+                try:
+                    if not _expired(memory.get((name, hash))[1], invalid_after, cleared()):
+                        return True
+                except KeyError:
+                    pass
+            try:
+                f, created = storage.open(name, hash)
+            except KeyError:
+                return False
+            f.close()
+            return not _expired(created, invalid_after, cleared())
+
+        def stream(*args, **kwargs):
+            hash = hash_arguments(args, kwargs)
+            try:
+                f, created = storage.open(name, hash)
+                if _expired(created, invalid_after, cleared()):
+                    f.close()
+                    raise KeyError(hash)
+                print(f'----- ogb cache : stream ----- {name}/{hash}')
+                stats.record_hit(name, hash)
+            except KeyError:
+                res = wrapper(*args, **kwargs)  # computes and stores the result
+                try:
+                    f, created = storage.open(name, hash)
+                except KeyError:  # already evicted again
+                    return iter([res.encode('utf-8') if isinstance(res, str) else res])
+            return iter_payload(f)
+
+        wrapper.stream = stream
+        wrapper.clear = clear
+        wrapper.cached = cached
         return wrapper
 
     return inner
@@ -176,7 +310,7 @@ if __name__ == '__main__':
     from OpenGenomeBrowser.settings import CACHE_DIR, CACHE_MAXSIZE
 
 
-    @ogb_cache(cache_root=CACHE_DIR, maxsize=2, add_cache_dir_kwarg=True, wait_tolerance=timedelta(seconds=1))
+    @ogb_cache(cache_root=CACHE_DIR, maxsize=2, add_cache_dir_kwarg=True, memory_maxbytes=1024)
     def go(a, cache_res_dir: str):
         assert os.path.isdir(cache_res_dir)
         return a
@@ -0,0 +1,153 @@
+import pickle
+from typing import BinaryIO, Iterator
+from hashlib import sha1
+
+"""
+Hashing of arguments and serialization of results for ogb_cache.
+
+Serialized results start with a header: MAGIC, codec, compression.
+    str:     utf-8, stored raw
+    bytes:   stored raw
+    pickle:  everything else
+Compression (zstd) requires zstandard: pip install zstandard
+"""
+
+MAGIC = b'ogb\x01'
+HEADER_LENGTH = len(MAGIC) + 2
+
+STR, BYTES, PICKLE = b's', b'b', b'p'
+RAW, ZSTD = b'-', b'z'
+
+CHUNK_SIZE = 1024 ** 2
+
+
+def _update_hash(h, obj) -> None:
+    # bool before int: True == 1
+    if obj is None:
+        h.update(b'N')
+    elif obj is True or obj is False:
+        h.update(b'T' if obj else b'F')
+    elif isinstance(obj, int):
+        h.update(b'i%d;' % obj)
+    elif isinstance(obj, float):
+        h.update(b'f' + obj.hex().encode('ascii') + b';')
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8')
+        h.update(b's%d:' % len(data))
+        h.update(data)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        h.update(b'b%d:' % len(obj))
+        h.update(obj)
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'l%d:' % len(obj))
+        for item in obj:
+            _update_hash(h, item)
+    elif isinstance(obj, (set, frozenset)):
+        h.update(b'S%d:' % len(obj))
+        for digest in sorted(_digest(item) for item in obj):
+            h.update(digest)
+    elif isinstance(obj, dict):
+        h.update(b'd%d:' % len(obj))
+        for digest in sorted(_digest(key) + _digest(value) for key, value in obj.items()):
+            h.update(digest)
+    else:
+        raise TypeError(f'Cannot hash object of type {type(obj).__name__}: {obj!r}')
+
+
+def _digest(obj) -> bytes:
+    h = sha1()
+    _update_hash(h, obj)
+    return h.digest()
+
+
+def hash_arguments(args: tuple, kwargs: dict) -> str:
+    """
+    Canonical hash of the arguments of a function call: independent of the order of sets and dicts, lists and
+    tuples are equivalent. Supports None, bool, int, float, str, bytes, lists, tuples, sets and dicts.
+
+    :raises TypeError: if an argument cannot be hashed
+    """
+    h = sha1()
+    try:
+        _update_hash(h, args)
+    except TypeError as e:
+        raise TypeError(f'{e} - Could not hash args. ({args=})')
+    try:
+        _update_hash(h, kwargs)
+    except TypeError as e:
+        raise TypeError(f'{e} - Could not hash kwargs. ({kwargs=})')
+    return h.hexdigest()
+
+
+def encode(res, compress: bool = False) -> bytes:
+    """
+    :param res: result of a cached function
+    :param compress: compress with zstd
+    :returns: serialized result, including header
+    """
+    if isinstance(res, str):
+        codec, payload = STR, res.encode('utf-8')
+    elif isinstance(res, bytes):
+        codec, payload = BYTES, res
+    else:
+        codec, payload = PICKLE, pickle.dumps(res, protocol=pickle.HIGHEST_PROTOCOL)
+
+    if compress:
+        import zstandard
+        return MAGIC + codec + ZSTD + zstandard.ZstdCompressor().compress(payload)
+    return MAGIC + codec + RAW + payload
+
+
+def _header(data) -> (bytes, bytes):
+    header = bytes(data[:HEADER_LENGTH])
+    assert header[:len(MAGIC)] == MAGIC, f'Not a serialized ogb_cache result: {header=}'
+    return header[-2:-1], header[-1:]
+
+
+def decode(data):
+    """
+    :param data: serialized result (bytes-like, e.g. a memory-mapped file)
+    :returns: result
+    """
+    codec, compression = _header(data)
+    payload = memoryview(data)[HEADER_LENGTH:]
+
+    if compression == ZSTD:
+        import zstandard
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+
+    if codec == STR:
+        return str(payload, 'utf-8')
+    elif codec == BYTES:
+        return bytes(payload)
+    elif codec == PICKLE:
+        return pickle.loads(payload)
+    raise AssertionError(f'Unknown codec: {codec=}')
+
+
+def iter_payload(f: BinaryIO) -> Iterator[bytes]:
+    """
+    Stream the content of a serialized str or bytes result, e.g. into a HTTP response. Closes f.
+
+    :param f: file object of a serialized result
+    :returns: generator of chunks of the raw (utf-8 encoded, decompressed) result
+    """
+    try:
+        codec, compression = _header(f.read(HEADER_LENGTH))
+        assert codec in (STR, BYTES), f'Only str and bytes results can be streamed: {codec=}'
+    except Exception:
+        f.close()
+        raise
+    return _iter_chunks(f, compression)
+
+
+def _iter_chunks(f: BinaryIO, compression: bytes) -> Iterator[bytes]:
+    try:
+        if compression == ZSTD:
+            import zstandard
+            yield from zstandard.ZstdDecompressor().read_to_iter(f, read_size=CHUNK_SIZE)
+        else:
+            while chunk := f.read(CHUNK_SIZE):
+                yield chunk
+    finally:
+        f.close()
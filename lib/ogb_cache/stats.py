@@ -0,0 +1,172 @@
+import os
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+
+"""
+Statistics of cached functions, shared by all processes: CACHE_DIR/.stats.sqlite3
+
+For each entry, the time it took to compute the result is stored. Every hit saves that much time.
+
+Hits are counted in memory and written in batches: every FLUSH_SECONDS, every FLUSH_HITS hits, before the statistics
+are read and when the process exits.
+"""
+
+FLUSH_SECONDS = 10
+FLUSH_HITS = 100
+
+
+class CacheStats:
+    def __init__(self, cache_dir: str):
+        self.file = os.path.join(cache_dir, '.stats.sqlite3')
+        self._lock = threading.Lock()
+        self._hits = {}  # {(name, key): [hits, accessed]}, not yet written
+        self._n_hits = 0
+        self._flushed = time.monotonic()
+        atexit.register(self.flush)
+        os.makedirs(cache_dir, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    name TEXT NOT NULL, key TEXT NOT NULL,
+                    nbytes INTEGER NOT NULL, seconds REAL NOT NULL,
+                    hits INTEGER NOT NULL, accessed REAL NOT NULL,
+                    PRIMARY KEY (name, key)
+                )
+            ''')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS functions (
+                    name TEXT PRIMARY KEY,
+                    hits INTEGER NOT NULL DEFAULT 0, misses INTEGER NOT NULL DEFAULT 0,
+                    seconds_computed REAL NOT NULL DEFAULT 0, seconds_saved REAL NOT NULL DEFAULT 0
+                )
+            ''')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.file, timeout=5)
+
+    def _write(self, statements: [(str, tuple)]) -> None:
+        # statistics must never break the cache itself
+        try:
+            with self._connect() as connection:
+                for sql, params in statements:
+                    connection.execute(sql, params)
+        except sqlite3.Error as e:
+            logging.warning(f'Could not update cache statistics: {self.file=} {e=}')
+
+    def record_hit(self, name: str, key: str) -> None:
+        with self._lock:
+            hits = self._hits.setdefault((name, key), [0, 0.])
+            hits[0] += 1
+            hits[1] = time.time()
+            self._n_hits += 1
+            if self._n_hits < FLUSH_HITS and time.monotonic() - self._flushed < FLUSH_SECONDS:
+                return
+        self.flush()
+
+    def flush(self) -> None:
+        """ Write the hits that were counted in memory. """
+        with self._lock:
+            pending, self._hits, self._n_hits = self._hits, {}, 0
+            self._flushed = time.monotonic()
+        statements = []
+        for (name, key), (hits, accessed) in pending.items():
+            statements.append((
+                'UPDATE entries SET hits = hits + ?, accessed = ? WHERE name = ? AND key = ?',
+                (hits, accessed, name, key)
+            ))
+            statements.append(('''
+                INSERT INTO functions (name, hits, seconds_saved)
+                VALUES (?, ?, ? * COALESCE((SELECT seconds FROM entries WHERE name = ? AND key = ?), 0))
+                ON CONFLICT (name) DO UPDATE SET
+                    hits = hits + excluded.hits, seconds_saved = seconds_saved + excluded.seconds_saved
+            ''', (name, hits, hits, name, key)))
+        if statements:
+            self._write(statements)
+
+    def record_miss(self, name: str, key: str, nbytes: int, seconds: float) -> None:
+        self._write([
+            ('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, 0, ?)', (name, key, nbytes, seconds, time.time())),
+            ('''
+                INSERT INTO functions (name, misses, seconds_computed) VALUES (?, 1, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    misses = misses + 1, seconds_computed = seconds_computed + excluded.seconds_computed
+            ''', (name, seconds)),
+        ])
+
+    def forget(self, name: str, keys: [str] = None) -> None:
+        """
+        Remove the statistics of entries that no longer exist. The totals per function are kept.
+
+        :param keys: default: all entries of name
+        """
+        self.flush()
+        if keys is None:
+            self._write([('DELETE FROM entries WHERE name = ?', (name,))])
+        else:
+            self._write([('DELETE FROM entries WHERE name = ? AND key = ?', (name, key)) for key in keys])
+
+    def hits(self) -> {(str, str): int}:
+        """ :returns: {(name, key): number of hits} """
+        self.flush()
+        with self._connect() as connection:
+            return {(name, key): hits for name, key, hits in connection.execute('SELECT name, key, hits FROM entries')}
+
+    def functions(self) -> [dict]:
+        """ :returns: [{name, hits, misses, seconds_computed, seconds_saved, entries, nbytes}, ...] """
+        self.flush()
+        with self._connect() as connection:
+            rows = connection.execute('''
+                SELECT f.name, f.hits, f.misses, f.seconds_computed, f.seconds_saved,
+                       COUNT(e.key), COALESCE(SUM(e.nbytes), 0)
+                FROM functions f LEFT JOIN entries e ON e.name = f.name
+                GROUP BY f.name ORDER BY f.name
+            ''').fetchall()
+        columns = ['name', 'hits', 'misses', 'seconds_computed', 'seconds_saved', 'entries', 'nbytes']
+        return [dict(zip(columns, row)) for row in rows]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._hits, self._n_hits = {}, 0
+        self._write([('DELETE FROM functions', ()), ('UPDATE entries SET hits = 0', ())])
+
+
+def cache_summary(cache_dir: str) -> [dict]:
+    """
+    Combine the statistics with the actual size of the caches on disk.
+
+    :returns: [{name, entries, nbytes, hits, misses, hit_rate, seconds_computed, seconds_saved}, ...]
+    """
+    from .eviction import scan_cache_dir
+
+    summary = {}
+    for entry in scan_cache_dir(cache_dir):
+        row = summary.setdefault(entry.name, dict(
+            name=entry.name, entries=0, nbytes=0, hits=0, misses=0, seconds_computed=0., seconds_saved=0.))
+        row['entries'] += 1
+        row['nbytes'] += entry.nbytes
+
+    for function in get_stats(cache_dir).functions():
+        row = summary.setdefault(function['name'], dict(
+            name=function['name'], entries=function['entries'], nbytes=function['nbytes']))  # not on disk
+        for key in ['hits', 'misses', 'seconds_computed', 'seconds_saved']:
+            row[key] = function[key]
+
+    for row in summary.values():
+        n_calls = row['hits'] + row['misses']
+        row['hit_rate'] = row['hits'] / n_calls if n_calls else None
+
+    return sorted(summary.values(), key=lambda row: row['nbytes'], reverse=True)
+
+
+_stats = {}
+
+
+def get_stats(cache_dir: str) -> CacheStats:
+    """ :returns: CacheStats instance, shared within the process """
+    if cache_dir not in _stats:
+        _stats[cache_dir] = CacheStats(cache_dir)
+    return _stats[cache_dir]
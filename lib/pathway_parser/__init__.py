@@ -0,0 +1 @@
+from .pathway_parser import parse_map, parse_maps
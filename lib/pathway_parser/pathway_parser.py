@@ -0,0 +1,126 @@
+import os
+import json
+import multiprocessing
+from hashlib import sha1
+from xml.parsers import expat
+from xml.sax.saxutils import escape, quoteattr
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+Parse pathway maps (svg) in a single streaming pass with expat, without building a document tree:
+
+    - the title (attribute of the root element)
+    - the annotations of each shape (data-annotations attribute)
+    - optionally the minified svg: no comments, no xml declaration/doctype, no <metadata>, no whitespace between tags
+
+Several maps are parsed in a pool of spawned worker processes, see parse_maps.
+"""
+
+_KEEP_WHITESPACE = {'text', 'tspan', 'textPath', 'style', 'script'}
+
+
+class _Parser:
+    def __init__(self, minify: bool):
+        self.minify = minify
+        self.title = None
+        self.shapes = []
+        self.out = []
+        self.stack = []  # open elements
+        self.text = []  # pending character data
+        self.open_tag = False  # start tag written without '>'
+        self.skip = 0  # depth inside <metadata>
+
+        self.parser = expat.ParserCreate()
+        self.parser.ordered_attributes = True
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        if minify:
+            self.parser.CharacterDataHandler = self.text.append
+
+    def _flush(self) -> None:
+        text = ''.join(self.text)
+        self.text.clear()
+        if self.skip or not text or (not text.strip() and self.stack[-1] not in _KEEP_WHITESPACE):
+            return
+        if self.open_tag:
+            self.out.append('>')
+            self.open_tag = False
+        self.out.append(escape(text))
+
+    def start(self, name: str, attributes: list) -> None:
+        attributes = dict(zip(attributes[::2], attributes[1::2]))
+        if self.title is None:
+            self.title = attributes.get('title')
+        if 'data-annotations' in attributes:
+            self.shapes.append(json.loads(attributes['data-annotations']))
+
+        if not self.minify:
+            return
+        self._flush()
+        if self.skip or name == 'metadata':
+            self.skip += 1
+            return
+        if self.open_tag:
+            self.out.append('>')
+        self.out.append(f'<{name}' + ''.join(f' {key}={quoteattr(value)}' for key, value in attributes.items()))
+        self.open_tag = True
+        self.stack.append(name)
+
+    def end(self, name: str) -> None:
+        if not self.minify:
+            return
+        self._flush()
+        if self.skip:
+            self.skip -= 1
+            return
+        self.stack.pop()
+        self.out.append('/>' if self.open_tag else f'</{name}>')
+        self.open_tag = False
+
+
+def parse_map(path: str, minify: bool = False) -> dict:
+    """
+    :param path: of the svg
+    :param minify: whether to return the minified svg
+    :returns: {filename, sha1, title, shapes: [[annotation, ...], ...], svg: minified svg (bytes) or None}
+    :raises ValueError: if the svg is invalid
+    """
+    with open(path, 'rb') as f:
+        source = f.read()
+
+    parser = _Parser(minify=minify)
+    try:
+        parser.parser.Parse(source, True)
+    except (expat.ExpatError, json.JSONDecodeError) as e:
+        raise ValueError(f'Failed to parse map {path}: {e}') from e
+
+    for shape in parser.shapes:
+        assert type(shape) is list, f'Map {path} contains a shape with invalid data-annotations: {shape}'
+
+    return dict(
+        filename=os.path.basename(path),
+        sha1=sha1(source).hexdigest(),
+        title=parser.title,
+        shapes=parser.shapes,
+        svg=''.join(parser.out).encode('utf-8') if minify else None
+    )
+
+
+def parse_maps(paths: [str], minify: bool = False, workers: int = None):
+    """
+    :param paths: of the svgs
+    :param minify: see parse_map
+    :param workers: number of processes, default: os.cpu_count(), 0: parse in this process
+    :returns: iterator over the results of parse_map, in the order of paths
+    """
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 0 or len(paths) <= 1:
+        yield from (parse_map(path, minify) for path in paths)
+        return
+
+    with ProcessPoolExecutor(
+            max_workers=min(workers, len(paths)), mp_context=multiprocessing.get_context('spawn')
+    ) as pool:
+        chunksize = max(1, len(paths) // (4 * workers))
+        yield from pool.map(parse_map, paths, [minify] * len(paths), chunksize=chunksize)
@@ -0,0 +1,82 @@
+from unittest import TestCase
+import os
+import json
+import tempfile
+from hashlib import sha1
+from xml.etree import ElementTree
+from .pathway_parser import parse_map, parse_maps
+
+SVG = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">
+<svg xmlns="http://www.w3.org/2000/svg" title="Glycolysis &amp; Gluconeogenesis">
+    <!-- a comment -->
+    <metadata>
+        <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"><rdf:Description/></rdf:RDF>
+    </metadata>
+    <style><![CDATA[ .shape > rect { fill: red; } ]]></style>
+    <g id="shapes">
+        <rect class="shape" data-annotations='[{"name": "K00844", "type": "KEGG"}, {"name": "EC:2.7.1.1", "type": "EC"}]'/>
+        <text x="1">  hexokinase &lt;HK&gt;  </text>
+        <circle data-annotations='[{"name": "C00031", "type": "Compound"}]'></circle>
+    </g>
+</svg>
+'''
+
+
+class TestPathwayParser(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'map00010.svg')
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(SVG)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_parse(self):
+        parsed = parse_map(self.path)
+        self.assertEqual(parsed['filename'], 'map00010.svg')
+        self.assertEqual(parsed['sha1'], sha1(SVG.encode('utf-8')).hexdigest())
+        self.assertEqual(parsed['title'], 'Glycolysis & Gluconeogenesis')
+        self.assertEqual(parsed['shapes'], [
+            [{'name': 'K00844', 'type': 'KEGG'}, {'name': 'EC:2.7.1.1', 'type': 'EC'}],
+            [{'name': 'C00031', 'type': 'Compound'}],
+        ])
+        self.assertIsNone(parsed['svg'])
+
+    def test_minify(self):
+        svg = parse_map(self.path, minify=True)['svg'].decode('utf-8')
+
+        # dropped: xml declaration, doctype, comments, metadata, whitespace between tags
+        for dropped in ['<?xml', '<!DOCTYPE', 'a comment', 'metadata', 'rdf:', '\n', '>    <']:
+            self.assertNotIn(dropped, svg)
+
+        # kept: text (including its whitespace), entities, content of CDATA sections, data-annotations
+        root = ElementTree.fromstring(svg)
+        ns = '{http://www.w3.org/2000/svg}'
+        self.assertEqual(root.get('title'), 'Glycolysis & Gluconeogenesis')
+        self.assertEqual(root.find(f'.//{ns}text').text, '  hexokinase <HK>  ')
+        self.assertEqual(root.find(f'.//{ns}style').text, ' .shape > rect { fill: red; } ')
+        annotations = [json.loads(shape.get('data-annotations')) for shape in root.iter() if 'data-annotations' in shape.attrib]
+        self.assertEqual(annotations, parse_map(self.path)['shapes'])
+
+        # empty elements are self-closing
+        self.assertIn('<circle data-annotations=', svg)
+        self.assertNotIn('</circle>', svg)
+
+    def test_minify_is_stable(self):
+        svg = parse_map(self.path, minify=True)['svg']
+        minified_path = os.path.join(self.tmp.name, 'minified.svg')
+        with open(minified_path, 'wb') as f:
+            f.write(svg)
+        self.assertEqual(parse_map(minified_path, minify=True)['svg'], svg)
+
+    def test_invalid(self):
+        with open(self.path, 'w') as f:
+            f.write('<svg><g></svg>')
+        with self.assertRaises(ValueError):
+            parse_map(self.path)
+
+    def test_parse_maps(self):
+        paths = [self.path, self.path]
+        self.assertEqual(list(parse_maps(paths, minify=True, workers=0)), [parse_map(self.path, minify=True)] * 2)
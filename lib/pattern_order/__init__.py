@@ -0,0 +1 @@
+from .pattern_order import pattern_order
@@ -0,0 +1,19 @@
+import numpy as np
+
+"""
+Order the rows of a presence/absence matrix (e.g. annotations x genomes) so that similar rows are next to each other.
+"""
+
+
+def pattern_order(presence: np.ndarray) -> np.ndarray:
+    """
+    Sort by the number of True values (descending), then by the pattern itself (True before False, from the first
+    column on). Identical patterns end up next to each other.
+
+    :param presence: boolean matrix, one pattern per row
+    :returns: order of the rows (stable: identical patterns keep their relative order)
+    """
+    presence = np.asarray(presence, dtype=bool)
+    packed = np.packbits(presence, axis=1)
+    keys = tuple(~packed[:, i] for i in reversed(range(packed.shape[1])))
+    return np.lexsort(keys + (-presence.sum(axis=1),))
@@ -0,0 +1,54 @@
+from unittest import TestCase
+import numpy as np
+import pandas as pd
+from .pattern_order import pattern_order
+
+
+def rank_order(presence: np.ndarray) -> np.ndarray:
+    """ The previous implementation (MatrixMaker.__sort_coverage_matrix): rank the distinct patterns by their sum """
+    matrix = pd.DataFrame(presence)
+    patterns = sorted(set(tuple(row.values) for i, row in matrix.iterrows()), key=lambda x: sum(x))
+    pattern_to_rank = {p: i for i, p in enumerate(patterns)}
+    ranks = matrix.apply(lambda row: pattern_to_rank[tuple(row.values)], axis=1)
+    return ranks.sort_values(ascending=False).index.values
+
+
+def groups(presence: np.ndarray, order: np.ndarray) -> [tuple]:
+    """ :returns: the sequence of patterns, consecutive identical patterns merged """
+    patterns = [tuple(row) for row in presence[order]]
+    return [pattern for i, pattern in enumerate(patterns) if i == 0 or pattern != patterns[i - 1]]
+
+
+class TestPatternOrder(TestCase):
+    def test_hand_checked(self):
+        presence = np.array([
+            [0, 1, 0],
+            [1, 1, 1],
+            [1, 0, 0],
+            [0, 1, 0],
+            [1, 1, 0],
+            [0, 0, 0],
+        ], dtype=bool)
+        self.assertEqual(pattern_order(presence).tolist(), [1, 4, 2, 0, 3, 5])
+
+    def test_stable(self):
+        presence = np.array([[1, 0], [0, 1], [1, 0], [0, 1]], dtype=bool)
+        self.assertEqual(pattern_order(presence).tolist(), [0, 2, 1, 3])
+
+    def test_vs_rank_order(self):
+        # same properties as the previous ordering: sums do not increase and identical patterns are contiguous
+        rng = np.random.default_rng(0)
+        for n_rows, n_columns in [(1, 1), (40, 3), (200, 9), (300, 20)]:
+            presence = rng.random((n_rows, n_columns)) < 0.4
+            new, old = pattern_order(presence), rank_order(presence)
+
+            self.assertEqual(sorted(new.tolist()), list(range(n_rows)))
+            np.testing.assert_array_equal(presence[new].sum(axis=1), presence[old].sum(axis=1))
+            new_groups, old_groups = groups(presence, new), groups(presence, old)
+            self.assertEqual(len(new_groups), len(set(new_groups)), 'identical patterns are not contiguous')
+            self.assertEqual(len(old_groups), len(set(old_groups)))
+            self.assertEqual(set(new_groups), set(old_groups))
+
+    def test_empty(self):
+        self.assertEqual(len(pattern_order(np.zeros((0, 4), dtype=bool))), 0)
+        self.assertEqual(pattern_order(np.zeros((3, 0), dtype=bool)).tolist(), [0, 1, 2])
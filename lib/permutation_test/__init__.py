@@ -0,0 +1 @@
+from .permutation_test import pack, popcount, min_pvalues, adjusted_pvalues, PermutationJob
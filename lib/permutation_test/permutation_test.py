@@ -0,0 +1,191 @@
+import os
+import json
+import shutil
+import numpy as np
+
+from lib.exact_tests import fisher_pvalue_table
+
+"""
+Permutation test (label shuffling) for gene trait matching with family-wise error control (Westfall-Young, single-step
+minP): in each permutation, the genomes are randomly assigned to the two groups (keeping the group sizes) and the
+smallest Fisher p-value of all annotations is recorded. The adjusted p-value of an annotation is the fraction of
+permutations with a smaller or equal minimal p-value.
+
+The presence of the annotations is bit-packed: one row of uint64 words per annotation, one bit per genome. Counting
+how many genomes of group 1 have each annotation is a bitwise AND with the packed group 1 followed by a popcount.
+The row sums (a + b) do not change under permutation, so the Fisher p-values are looked up in a precomputed table.
+
+The permutations are split into chunks that can be calculated independently (e.g. by huey workers), see
+PermutationJob.
+"""
+
+_REL_TOLERANCE = 1e-7
+
+# number of set bits of every uint16
+_POPCOUNT = np.array([bin(i).count('1') for i in range(2 ** 16)], dtype=np.uint8)
+
+
+def pack(rows: np.ndarray, columns: np.ndarray, shape: (int, int)) -> np.ndarray:
+    """
+    Bit-pack a sparse boolean matrix.
+
+    :param rows: row indices of the True entries
+    :param columns: column indices of the True entries, no duplicate (row, column) pairs
+    :param shape: (number of rows, number of columns)
+    :returns: uint64 array of shape (number of rows, number of words), column j is bit j % 64 of word j // 64
+    """
+    n_rows, n_columns = shape
+    n_words = max(1, -(-n_columns // 64))
+    rows, columns = np.asarray(rows, dtype=np.int64), np.asarray(columns, dtype=np.int64)
+
+    keys = rows * n_words + columns // 64
+    bits = np.left_shift(np.uint64(1), (columns % 64).astype(np.uint64))
+    order = np.argsort(keys, kind='stable')
+    keys, bits = keys[order], bits[order]
+
+    packed = np.zeros(n_rows * n_words, dtype=np.uint64)
+    if len(keys):
+        starts = np.flatnonzero(np.diff(keys, prepend=-1))
+        packed[keys[starts]] = np.bitwise_or.reduceat(bits, starts)
+    return packed.reshape(n_rows, n_words)
+
+
+def popcount(words: np.ndarray) -> np.ndarray:
+    """ :returns: number of set bits of uint64 words, summed over the last axis """
+    words = np.ascontiguousarray(words, dtype=np.uint64)
+    return _POPCOUNT[words.view(np.uint16)].sum(axis=-1, dtype=np.int32)
+
+
+def min_pvalues(
+        packed: np.ndarray,
+        n1: int,
+        n2: int,
+        n_permutations: int,
+        seed: int,
+        batch_bytes: int = 64 * 1024 ** 2
+) -> np.ndarray:
+    """
+    :param packed: presence of the annotations (rows) in the genomes, see pack
+    :param n1: size of group 1
+    :param n2: size of group 2
+    :param n_permutations: number of permutations
+    :param seed: of the random number generator
+    :param batch_bytes: approximate memory usage, several permutations are counted at once
+    :returns: for each permutation, the smallest two-sided Fisher p-value of all annotations
+    """
+    n_rows, n_words = packed.shape
+    n = n1 + n2
+    assert n_words * 64 >= n, f'packed has too few columns: {packed.shape=} {n1=} {n2=}'
+
+    pvalue_table, k_index = fisher_pvalue_table(popcount(packed), n1, n2)
+    rng = np.random.default_rng(seed)
+    batch = max(1, batch_bytes // max(1, 8 * n_rows * n_words))
+
+    result = np.ones(n_permutations, dtype=np.float64)
+    for start in range(0, n_permutations, batch):
+        size = min(batch, n_permutations - start)
+        # random group 1 of each permutation
+        group_1 = np.argsort(rng.random((size, n)), axis=1)[:, :n1]
+        masks = pack(np.repeat(np.arange(size), n1), group_1.ravel(), shape=(size, n))
+        counts = popcount(packed[np.newaxis, :, :] & masks[:, np.newaxis, :])  # shape: (size, n_rows)
+        if n_rows:
+            result[start:start + size] = pvalue_table[k_index[np.newaxis, :], counts].min(axis=1)
+    return result
+
+
+def adjusted_pvalues(pvalues: np.ndarray, min_pvalues: np.ndarray) -> np.ndarray:
+    """
+    Single-step minP adjustment (Westfall-Young), controls the family-wise error rate.
+
+    :param pvalues: observed p-values
+    :param min_pvalues: result of min_pvalues, all permutations
+    :returns: adjusted p-values
+    """
+    sorted_min_pvalues = np.sort(min_pvalues)
+    n_smaller = np.searchsorted(sorted_min_pvalues, np.asarray(pvalues) * (1 + _REL_TOLERANCE), side='right')
+    return (n_smaller + 1) / (len(sorted_min_pvalues) + 1)
+
+
+class PermutationJob:
+    """
+    The permutations of one gene trait matching, split into chunks that are calculated independently.
+
+    job_dir/job.json:         n1, n2, permutations and seed of each chunk
+    job_dir/packed.npy:       presence of the annotations (see pack)
+    job_dir/<chunk>.npy:      result of min_pvalues for this chunk
+    job_dir/<chunk>.failed:   error message if the chunk failed
+    """
+
+    def __init__(self, job_dir: str):
+        self.job_dir = job_dir
+
+    @property
+    def exists(self) -> bool:
+        return os.path.isdir(self.job_dir)
+
+    def create(self, packed: np.ndarray, n1: int, n2: int, n_permutations: int, n_chunks: int, seed: int = 0) -> bool:
+        """
+        :returns: False if the job already exists (e.g. created by another process), otherwise the chunks must be run
+        """
+        try:
+            os.makedirs(self.job_dir)
+        except FileExistsError:
+            return False
+
+        np.save(os.path.join(self.job_dir, 'packed.npy'), packed)
+        n_chunks = max(1, min(n_chunks, n_permutations))
+        chunks = [dict(n_permutations=len(permutations), seed=seed + i)
+                  for i, permutations in enumerate(np.array_split(np.arange(n_permutations), n_chunks))]
+        self._write(os.path.join(self.job_dir, 'job.json'), json.dumps(dict(n1=n1, n2=n2, chunks=chunks)).encode())
+        return True
+
+    @property
+    def config(self) -> dict:
+        """ :raises FileNotFoundError: if the job is still being created """
+        with open(os.path.join(self.job_dir, 'job.json')) as f:
+            return json.load(f)
+
+    def run_chunk(self, chunk: int) -> None:
+        try:
+            config = self.config
+            packed = np.load(os.path.join(self.job_dir, 'packed.npy'), mmap_mode='r')
+            result = min_pvalues(packed, config['n1'], config['n2'], **config['chunks'][chunk])
+        except Exception as e:
+            self._write(os.path.join(self.job_dir, f'{chunk}.failed'), str(e).encode())
+            raise e
+
+        with open(os.path.join(self.job_dir, f'{chunk}.npy.tmp'), 'wb') as f:
+            np.save(f, result)
+        os.replace(os.path.join(self.job_dir, f'{chunk}.npy.tmp'), os.path.join(self.job_dir, f'{chunk}.npy'))
+
+    def progress(self) -> (int, int, int):
+        """ :returns: number of chunks that are done, failed, total """
+        try:
+            n_chunks = len(self.config['chunks'])
+        except FileNotFoundError:
+            return 0, 0, 0
+        files = set(os.listdir(self.job_dir))
+        n_done = sum(f'{chunk}.npy' in files for chunk in range(n_chunks))
+        n_failed = sum(f'{chunk}.failed' in files for chunk in range(n_chunks))
+        return n_done, n_failed, n_chunks
+
+    def errors(self) -> [str]:
+        errors = []
+        for file in sorted(os.listdir(self.job_dir)):
+            if file.endswith('.failed'):
+                with open(os.path.join(self.job_dir, file)) as f:
+                    errors.append(f.read())
+        return errors
+
+    def min_pvalues(self) -> np.ndarray:
+        """ :returns: the results of all chunks, concatenated """
+        n_chunks = len(self.config['chunks'])
+        return np.concatenate([np.load(os.path.join(self.job_dir, f'{chunk}.npy')) for chunk in range(n_chunks)])
+
+    def remove(self) -> None:
+        shutil.rmtree(self.job_dir, ignore_errors=True)
+
+    def _write(self, file: str, data: bytes) -> None:
+        with open(f'{file}.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(f'{file}.tmp', file)
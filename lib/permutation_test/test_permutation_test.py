@@ -0,0 +1,87 @@
+from unittest import TestCase
+import tempfile
+import numpy as np
+from .permutation_test import pack, popcount, min_pvalues, adjusted_pvalues, PermutationJob
+
+
+def to_dense(packed: np.ndarray, n_columns: int) -> np.ndarray:
+    bits = (packed[:, :, np.newaxis] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    return bits.reshape(len(packed), -1)[:, :n_columns].astype(bool)
+
+
+class TestPack(TestCase):
+    def test_pack(self):
+        packed = pack(rows=[0, 0, 1, 2], columns=[0, 3, 1, 2], shape=(3, 4))
+        self.assertEqual(packed.dtype, np.uint64)
+        self.assertEqual(packed.tolist(), [[0b1001], [0b0010], [0b0100]])
+
+    def test_pack_multiple_words(self):
+        packed = pack(rows=[0, 0, 1], columns=[63, 64, 129], shape=(2, 130))
+        self.assertEqual(packed.shape, (2, 3))
+        self.assertEqual(packed.tolist(), [[2 ** 63, 1, 0], [0, 0, 2]])
+
+    def test_pack_unordered_and_empty(self):
+        packed = pack(rows=[1, 0, 1], columns=[5, 2, 0], shape=(3, 6))
+        self.assertEqual(packed.tolist(), [[0b100], [0b100001], [0]])
+        self.assertEqual(pack(rows=[], columns=[], shape=(2, 0)).tolist(), [[0], [0]])
+
+    def test_pack_random_vs_dense(self):
+        rng = np.random.default_rng(1)
+        dense = rng.random((20, 150)) < 0.3
+        rows, columns = np.nonzero(dense)
+        np.testing.assert_array_equal(to_dense(pack(rows, columns, shape=dense.shape), 150), dense)
+
+    def test_popcount(self):
+        words = np.array([[0, 1], [2 ** 64 - 1, 0], [0b1011, 2 ** 63]], dtype=np.uint64)
+        self.assertEqual(popcount(words).tolist(), [1, 64, 4])
+        self.assertEqual(popcount(np.array([0b111], dtype=np.uint64)), 3)
+
+
+class TestAdjustedPvalues(TestCase):
+    def test_adjusted_pvalues(self):
+        min_pvalues = np.array([0.5, 0.01, 0.2, 0.04])
+        # (number of permutations with a min p-value <= p + 1) / (number of permutations + 1)
+        adjusted = adjusted_pvalues(np.array([0.001, 0.01, 0.03, 0.2, 1.]), min_pvalues)
+        np.testing.assert_allclose(adjusted, [1 / 5, 2 / 5, 2 / 5, 4 / 5, 5 / 5])
+
+    def test_tolerance(self):
+        # equal p-values that differ by floating point errors count as equally extreme
+        self.assertEqual(adjusted_pvalues(np.array([0.1 * 3]), np.array([0.3]))[0], 1.)
+
+
+class TestMinPvalues(TestCase):
+    def test_bounds_and_reproducibility(self):
+        rng = np.random.default_rng(2)
+        dense = rng.random((30, 12)) < 0.5
+        packed = pack(*np.nonzero(dense), shape=dense.shape)
+        result = min_pvalues(packed, n1=5, n2=7, n_permutations=200, seed=3)
+        self.assertEqual(result.shape, (200,))
+        self.assertTrue(((0 < result) & (result <= 1)).all())
+        np.testing.assert_array_equal(result, min_pvalues(packed, n1=5, n2=7, n_permutations=200, seed=3))
+        # batching does not change the result
+        np.testing.assert_array_equal(
+            result, min_pvalues(packed, n1=5, n2=7, n_permutations=200, seed=3, batch_bytes=1))
+
+    def test_perfect_split(self):
+        # an annotation present in exactly n1 genomes reaches the smallest p-value if a permutation puts them in group 1
+        packed = pack(rows=[0, 0, 0], columns=[0, 1, 2], shape=(1, 6))
+        result = min_pvalues(packed, n1=3, n2=3, n_permutations=2000, seed=0)
+        self.assertAlmostEqual(result.min(), 0.1)  # 2 / C(6, 3)
+        self.assertAlmostEqual((result <= 0.1 + 1e-9).mean(), 0.1, delta=0.03)
+
+
+class TestPermutationJob(TestCase):
+    def test_job(self):
+        packed = pack(rows=[0, 0, 1, 1, 1], columns=[0, 1, 1, 2, 3], shape=(2, 6))
+        with tempfile.TemporaryDirectory() as tmp:
+            job = PermutationJob(f'{tmp}/job')
+            self.assertFalse(job.exists)
+            self.assertTrue(job.create(packed, n1=3, n2=3, n_permutations=50, n_chunks=3))
+            self.assertFalse(job.create(packed, n1=3, n2=3, n_permutations=50, n_chunks=3))
+            self.assertEqual(job.progress(), (0, 0, 3))
+            for chunk in range(3):
+                job.run_chunk(chunk)
+            self.assertEqual(job.progress(), (3, 0, 3))
+            self.assertEqual(len(job.min_pvalues()), 50)
+            job.remove()
+            self.assertFalse(job.exists)
@@ -0,0 +1 @@
+from .plot_renderer import render_flower_plot
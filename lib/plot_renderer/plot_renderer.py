@@ -0,0 +1,98 @@
+import os
+import sys
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+"""
+Render matplotlib plots to SVG in a pool of worker processes.
+
+pyplot keeps global state (the current figure), which is not thread-safe: in threaded WSGI servers, concurrent
+requests would draw into each other's figures, and rendering blocks the GIL of the web server. Each worker process
+renders one plot at a time into its own figure, with the headless Agg backend. The workers are spawned, not forked,
+so they do not inherit the state (threads, database connections) of the web server.
+
+With workers=0, plots are rendered in the calling process, one at a time.
+
+Under uWSGI, sys.executable is the uwsgi binary, so the workers are spawned with the python interpreter of the
+environment instead (see _python). If none is found, plots are rendered in the calling process. The pool is managed
+by a thread, uWSGI must run with --enable-threads (see start.sh).
+"""
+
+_lock = threading.Lock()  # protects _pool, serializes rendering if workers=0
+_pool = None
+
+
+def _init_worker() -> None:
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _render_flower_plot(genome_to_data: dict, n_core: int) -> str:
+    from io import StringIO
+    import matplotlib.pyplot as plt
+    from flower_plot import flower_plot
+
+    figures = set(plt.get_fignums())
+    plt.figure()  # flower_plot draws into the current figure
+    try:
+        ax = flower_plot(genome_to_data, n_core)
+        ax.figure.tight_layout()
+        svg = StringIO()
+        ax.figure.savefig(svg, format='svg')
+        return svg.getvalue()
+    finally:
+        for figure in set(plt.get_fignums()) - figures:
+            plt.close(figure)
+
+
+def _python() -> str or None:
+    """ :returns: python interpreter to spawn workers with, None if it cannot be found """
+    if os.path.basename(sys.executable).startswith('python'):
+        return sys.executable
+    for name in [f'python{sys.version_info.major}.{sys.version_info.minor}', f'python{sys.version_info.major}']:
+        python = os.path.join(sys.exec_prefix, 'bin', name)
+        if os.access(python, os.X_OK):
+            return python
+    return None
+
+
+def _render(function, args: tuple, workers: int):
+    global _pool
+
+    if workers > 0 and _python() is None:
+        logging.warning(f'No python interpreter found to spawn plot workers ({sys.executable=}), rendering in-process')
+        workers = 0
+
+    if workers <= 0:
+        with _lock:
+            _init_worker()
+            return function(*args)
+
+    with _lock:
+        if _pool is None:
+            context = multiprocessing.get_context('spawn')
+            context.set_executable(_python())
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker)
+        pool = _pool
+
+    try:
+        return pool.submit(function, *args).result()
+    except BrokenProcessPool:
+        # a worker died (e.g. killed by the OOM killer): start a new pool next time
+        with _lock:
+            if _pool is pool:
+                _pool = None
+        raise
+
+
+def render_flower_plot(genome_to_data: dict, n_core: int, workers: int = 2) -> str:
+    """
+    :param genome_to_data: {genome: {color, shell, unique}}, see website.views.FlowerPlot.get_flower_data
+    :param n_core: number of core annotations
+    :param workers: size of the process pool (created on first use), 0: render in this process
+    :returns: flower plot as svg
+    """
+    return _render(_render_flower_plot, (genome_to_data, n_core), workers=workers)
@@ -0,0 +1 @@
+from .sequence_index import GbkIndex, FastaIndex
@@ -0,0 +1,295 @@
+import os
+import re
+import cdblib
+
+"""
+Random-access indices for the sequence files of a genome.
+
+Both indices are stored as constant databases (cdb), so a lookup costs one seek in the index and one seek in the
+indexed file, regardless of the size of the genome.
+
+GbkIndex:   locus_tag  -> byte offset and length of the GenBank record (scaffold) that contains the locus_tag, of its
+                          header, of the features of the locus_tag and of the sequence, plus the span of the features
+FastaIndex: identifier -> byte offset and length of the sequence, plus the number of bases (faidx-style)
+"""
+
+
+class SequenceIndex:
+    def __init__(self, file: str, index: str):
+        self.file = file
+        self.index = index
+        if not self.is_valid(file, index):
+            raise FileNotFoundError(f'Index is missing or older than the indexed file: {index=} {file=}')
+        self._reader = cdblib.Reader.from_file_path(index)
+
+    @staticmethod
+    def is_valid(file: str, index: str) -> bool:
+        """ :returns: True if the index exists and is newer than the indexed file """
+        return os.path.isfile(index) and os.path.getmtime(index) >= os.path.getmtime(file)
+
+    def __contains__(self, key: str) -> bool:
+        return self._reader.get(key.encode('utf-8')) is not None
+
+    def _get(self, key: str) -> [int]:
+        value = self._reader.get(key.encode('utf-8'))
+        if value is None:
+            raise KeyError(f'Could not find {key} in {self.index}')
+        return [int(v) for v in value.split(b'\t')]
+
+    def offsets(self, keys: [str]) -> [(str, int, int)]:
+        """
+        :param keys: identifiers to look up
+        :returns: list of (key, offset, ...), sorted by offset, so the file can be read in a single pass
+        """
+        return sorted(((key, *self._get(key)) for key in keys), key=lambda entry: entry[1])
+
+    @staticmethod
+    def _write(index: str, entries) -> int:
+        """
+        :param index: path to the index file
+        :param entries: iterable of (key, values)
+        :returns: number of entries written
+        """
+        os.makedirs(os.path.dirname(index), exist_ok=True)
+        tmp_index = f'{index}.tmp'
+        seen = set()
+        with open(tmp_index, 'wb') as f, cdblib.Writer(f) as writer:
+            for key, values in entries:
+                if key in seen:
+                    continue
+                seen.add(key)
+                writer.put(key.encode('utf-8'), '\t'.join(str(v) for v in values).encode('utf-8'))
+        os.replace(tmp_index, index)
+        return len(seen)
+
+
+class _Feature:
+    """ Feature of a GenBank record, as seen by GbkIndex._scan """
+
+    def __init__(self, offset: int, location: bytes):
+        self.offset = offset
+        self.location = location
+        self.locus_tag = None
+        self._in_location = True
+
+    def add_line(self, stripped_line: bytes) -> None:
+        if stripped_line.startswith(b'/'):
+            self._in_location = False
+            if stripped_line.startswith(b'/locus_tag='):
+                self.locus_tag = stripped_line[11:].strip(b'"').decode('utf-8')
+        elif self._in_location:
+            self.location += stripped_line  # the location spans several lines
+
+
+class GbkIndex(SequenceIndex):
+    """
+    Map each locus_tag to the GenBank record it belongs to.
+
+    read_gene only reads the header of the record, the features of the locus_tag and the part of the sequence they
+    cover, so the cost of a lookup does not depend on the size of the scaffold.
+
+    Example usage:
+        GbkIndex.create(gbk='genome.gbk', index='genome.gbk.cdb')
+        record_text = GbkIndex(file='genome.gbk', index='genome.gbk.cdb').read_record('organism1_000001')
+    """
+
+    def read_record(self, locus_tag: str) -> str:
+        offset, length, *_ = self._get(locus_tag)
+        with open(self.file, 'rb') as f:
+            f.seek(offset)
+            return f.read(length).decode('utf-8')
+
+    def read_records(self, locus_tags: [str]):
+        """
+        Read the GenBank records that contain the locus_tags. Each record is only read once.
+
+        :returns: generator of (record_text, [locus_tag, ...])
+        """
+        offset_to_locus_tags = {}
+        for locus_tag, offset, length, *_ in self.offsets(locus_tags):
+            offset_to_locus_tags.setdefault((offset, length), []).append(locus_tag)
+
+        with open(self.file, 'rb') as f:
+            for (offset, length), record_locus_tags in offset_to_locus_tags.items():
+                f.seek(offset)
+                yield f.read(length).decode('utf-8'), record_locus_tags
+
+    def read_gene(self, locus_tag: str) -> (str, int, str):
+        """
+        Read the features of a locus_tag without the rest of its record.
+
+        The record text contains the header of the record, the features of the locus_tag and an empty sequence.
+        Biopython parses it into a SeqRecord whose sequence is undefined, but has the length of the scaffold.
+
+        :returns: (record_text, 0-based position of the sequence, sequence covered by the features)
+        """
+        offset, length, header_length, feature_offset, feature_length, origin_offset, start, end = self._get(locus_tag)
+        with open(self.file, 'rb') as f:
+            f.seek(offset)
+            header = f.read(header_length)
+            f.seek(feature_offset)
+            features = f.read(feature_length)
+            sequence = self._read_sequence(f, origin_offset, start, end)
+        record_text = (header + features).decode('utf-8') + 'ORIGIN\n//\n'
+        return record_text, start, sequence
+
+    @staticmethod
+    def _read_sequence(f, origin_offset: int, start: int, end: int) -> str:
+        """
+        Read the bases start:end of the ORIGIN section. Usually, all lines contain the same number of bases, so the
+        line that contains start can be calculated. Otherwise, the section is read from the beginning.
+        """
+        if origin_offset < 0:
+            return ''
+
+        f.seek(origin_offset)
+        first_line = f.readline()
+        line_bases = sum(len(block) for block in first_line.split()[1:])
+        position = 0
+        if line_bases:
+            line_number = start // line_bases
+            f.seek(origin_offset + line_number * len(first_line))
+            candidate = f.readline().split(maxsplit=1)
+            if candidate and candidate[0] == str(line_number * line_bases + 1).encode('ascii'):
+                position = line_number * line_bases
+                f.seek(origin_offset + line_number * len(first_line))
+            else:
+                f.seek(origin_offset)
+
+        blocks = []
+        read = position  # position after the last line that was read
+        for line in f:
+            if line.startswith(b'//') or read >= end:
+                break
+            bases = b''.join(line.split()[1:])
+            if read + len(bases) <= start:
+                position += len(bases)
+            else:
+                blocks.append(bases)
+            read += len(bases)
+        bases = b''.join(blocks).decode('ascii')
+        return bases[start - position:end - position].upper()
+
+    @staticmethod
+    def _scan(gbk: str):
+        """
+        Scan the GenBank file as text. This is much faster than parsing it with Biopython.
+
+        :returns: generator of (locus_tag, (record_offset, record_length, header_length, feature_offset, feature_length,
+            origin_offset, start, end)), origin_offset: -1 if the record has no sequence, start:end: 0-based span of
+            the features of the locus_tag
+        """
+        with open(gbk, 'rb') as f:
+            offset = 0
+            record_start = None
+            for line in f:
+                if line.startswith(b'LOCUS'):
+                    record_start = offset
+                    header_length = None
+                    origin_offset = -1
+                    in_features = False
+                    feature = None
+                    locus_tags = {}  # {locus_tag: [feature_offset, feature_end, start, end]}
+                elif line.startswith(b'//'):
+                    assert record_start is not None, f'Error parsing {gbk}: found // before LOCUS at byte {offset}'
+                    record_end = offset + len(line)
+                    for locus_tag, (feature_offset, feature_end, start, end) in locus_tags.items():
+                        yield locus_tag, (
+                            record_start, record_end - record_start, header_length,
+                            feature_offset, feature_end - feature_offset, origin_offset, start, end
+                        )
+                    record_start = None
+                elif record_start is not None:
+                    if in_features and not line.startswith(b' ' * 21):
+                        # a new feature or the end of the feature table: the previous feature is complete
+                        if feature is not None and feature.locus_tag is not None:
+                            start, end = GbkIndex._span(feature.location)
+                            entry = locus_tags.setdefault(feature.locus_tag, [feature.offset, offset, start, end])
+                            entry[1:] = [offset, min(entry[2], start), max(entry[3], end)]
+                        feature = _Feature(offset, line[21:].strip()) if line.startswith(b'     ') else None
+                        in_features = feature is not None
+
+                    if line.startswith(b'FEATURES'):
+                        in_features = True
+                        header_length = offset + len(line) - record_start
+                    elif line.startswith(b'ORIGIN'):
+                        origin_offset = offset + len(line)
+                    elif feature is not None and offset > feature.offset:
+                        feature.add_line(line.strip())
+                offset += len(line)
+
+    @staticmethod
+    def _span(location: bytes) -> (int, int):
+        """ :returns: 0-based span of a location, e.g. complement(join(1..10,<20..30)) -> (0, 30) """
+        if b':' in location:
+            return 0, 2 ** 62  # refers to another record: take the whole sequence
+        positions = [int(p) for p in re.findall(rb'[0-9]+', location)]
+        return min(positions) - 1, max(positions)
+
+    @classmethod
+    def create(cls, gbk: str, index: str) -> int:
+        return cls._write(index, cls._scan(gbk))
+
+
+class FastaIndex(SequenceIndex):
+    """
+    Index a fasta file, similar to samtools faidx.
+
+    Fasta headers may contain preambles, e.g. '>gnl|Prokka|organism1_000001', therefore only the part after the last '|'
+    is used as key.
+
+    Example usage:
+        FastaIndex.create(fasta='genome.faa', index='genome.faa.cdb')
+        sequence = FastaIndex(file='genome.faa', index='genome.faa.cdb').read_sequence('organism1_000001')
+    """
+
+    @staticmethod
+    def _decode(raw: bytes, expected_length: int) -> str:
+        sequence = raw.replace(b'\n', b'').replace(b'\r', b'').decode('utf-8')
+        assert len(sequence) == expected_length, f'Index seems to be corrupt: {len(sequence)=} != {expected_length=}'
+        return sequence.upper()
+
+    def read_sequence(self, identifier: str) -> str:
+        offset, n_bytes, length = self._get(identifier)
+        with open(self.file, 'rb') as f:
+            f.seek(offset)
+            return self._decode(f.read(n_bytes), length)
+
+    def read_sequences(self, identifiers: [str]):
+        """
+        Read the sequences in the order they appear in the file.
+
+        :returns: generator of (identifier, sequence)
+        """
+        with open(self.file, 'rb') as f:
+            for identifier, offset, n_bytes, length in self.offsets(identifiers):
+                f.seek(offset)
+                yield identifier, self._decode(f.read(n_bytes), length)
+
+    @staticmethod
+    def _scan(fasta: str):
+        """ :returns: generator of (identifier, (sequence_offset, sequence_bytes, sequence_length)) """
+
+        with open(fasta, 'rb') as f:
+            offset = 0
+            identifier, seq_start, seq_end, seq_length = None, None, None, 0
+            for line in f:
+                if line.startswith(b'>'):
+                    if identifier is not None:
+                        yield identifier, (seq_start, seq_end - seq_start, seq_length)
+                    header = line[1:].split(maxsplit=1)[0].decode('utf-8')
+                    identifier = header.rsplit('|', maxsplit=1)[-1]
+                    seq_start = seq_end = offset + len(line)
+                    seq_length = 0
+                else:
+                    bases = len(line.rstrip(b'\r\n'))
+                    if bases:
+                        seq_length += bases
+                        seq_end = offset + len(line)
+                offset += len(line)
+            if identifier is not None:
+                yield identifier, (seq_start, seq_end - seq_start, seq_length)
+
+    @classmethod
+    def create(cls, fasta: str, index: str) -> int:
+        return cls._write(index, cls._scan(fasta))
@@ -0,0 +1,166 @@
+from unittest import TestCase
+import os
+import time
+import tempfile
+from io import StringIO
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from Bio.SeqFeature import SeqFeature, FeatureLocation, CompoundLocation
+from .sequence_index import GbkIndex, FastaIndex
+
+
+def random_sequence(rng, length: int, alphabet: str = 'ACGT') -> str:
+    return ''.join(rng.choice(alphabet) for _ in range(length))
+
+
+def make_records(n_records: int = 3, n_genes: int = 4) -> [SeqRecord]:
+    import random
+    rng = random.Random(0)
+    records = []
+    for r in range(n_records):
+        record = SeqRecord(
+            Seq(random_sequence(rng, 600)), id=f'scf{r}', name=f'scf{r}', description=f'scaffold {r}',
+            annotations=dict(molecule_type='DNA')
+        )
+        for g in range(n_genes):
+            start = 100 * g + 10
+            record.features.append(SeqFeature(
+                FeatureLocation(start, start + 90, strand=1 if g % 2 else -1), type='CDS',
+                qualifiers=dict(locus_tag=[f'org_{r:02d}{g:04d}'], product=[f'protein {r}-{g}'])
+            ))
+        records.append(record)
+    return records
+
+
+class TestGbkIndex(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.gbk = os.path.join(self.tmp.name, 'genome.gbk')
+        self.index = os.path.join(self.tmp.name, 'index', 'genome.gbk.cdb')
+        self.records = make_records()
+        SeqIO.write(self.records, self.gbk, 'genbank')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        self.assertEqual(GbkIndex.create(gbk=self.gbk, index=self.index), 12)
+        index = GbkIndex(file=self.gbk, index=self.index)
+
+        for expected in self.records:
+            for feature in expected.features:
+                locus_tag = feature.qualifiers['locus_tag'][0]
+                self.assertIn(locus_tag, index)
+                record = SeqIO.read(StringIO(index.read_record(locus_tag)), 'genbank')
+                self.assertEqual(record.id, expected.id)
+                self.assertEqual(str(record.seq), str(expected.seq))
+                self.assertEqual(
+                    [f.qualifiers['locus_tag'][0] for f in record.features],
+                    [f.qualifiers['locus_tag'][0] for f in expected.features]
+                )
+
+        self.assertNotIn('missing', index)
+        with self.assertRaises(KeyError):
+            index.read_record('missing')
+
+    def test_read_records(self):
+        GbkIndex.create(gbk=self.gbk, index=self.index)
+        index = GbkIndex(file=self.gbk, index=self.index)
+        records = list(index.read_records(['org_020001', 'org_000003', 'org_000000']))
+        self.assertEqual([locus_tags for text, locus_tags in records], [['org_000003', 'org_000000'], ['org_020001']])
+        self.assertEqual([SeqIO.read(StringIO(text), 'genbank').id for text, locus_tags in records], ['scf0', 'scf2'])
+
+    def read_gene(self, index: GbkIndex, locus_tag: str) -> SeqRecord:
+        record_text, start, sequence = index.read_gene(locus_tag)
+        record = SeqIO.read(StringIO(record_text), 'genbank')
+        record.seq = Seq({start: sequence}, length=len(record.seq))
+        return record
+
+    def test_read_gene(self):
+        # gene and CDS of the same locus_tag, location that spans several lines
+        record = self.records[1]
+        join = CompoundLocation([FeatureLocation(start, start + 3, strand=1) for start in range(405, 590, 5)])
+        record.features.append(SeqFeature(join, type='gene', qualifiers=dict(locus_tag=['org_010004'])))
+        record.features.append(SeqFeature(join, type='CDS', qualifiers=dict(locus_tag=['org_010004'], note=['x'])))
+        SeqIO.write(self.records, self.gbk, 'genbank')
+        GbkIndex.create(gbk=self.gbk, index=self.index)
+        index = GbkIndex(file=self.gbk, index=self.index)
+
+        for expected in self.records:
+            for feature in expected.features:
+                locus_tag = feature.qualifiers['locus_tag'][0]
+                gene = self.read_gene(index, locus_tag)
+                self.assertEqual(gene.id, expected.id)
+                self.assertEqual(len(gene.seq), len(expected.seq))
+                self.assertEqual(
+                    [(f.type, str(f.location)) for f in gene.features],
+                    [(f.type, str(f.location)) for f in expected.features if f.qualifiers['locus_tag'][0] == locus_tag]
+                )
+                for f in gene.features:
+                    self.assertEqual(str(f.extract(gene).seq), str(f.extract(expected).seq))
+
+    def test_read_gene_irregular_origin(self):
+        # sequence lines of different lengths: the sequence is read from the start of ORIGIN
+        with open(self.gbk) as f:
+            text = f.read()
+        parts = text.split('ORIGIN\n')
+        for i, record in enumerate(self.records):
+            sequence = str(record.seq).lower()
+            lines = [sequence[:7]] + [sequence[j:j + 70] for j in range(7, len(sequence), 70)]
+            positions = [1] + list(range(8, len(sequence) + 1, 70))
+            parts[i + 1] = ''.join(f'{p:>9} {line}\n' for p, line in zip(positions, lines)) + \
+                           parts[i + 1][parts[i + 1].index('//'):]
+        with open(self.gbk, 'w') as f:
+            f.write('ORIGIN\n'.join(parts))
+
+        GbkIndex.create(gbk=self.gbk, index=self.index)
+        index = GbkIndex(file=self.gbk, index=self.index)
+        for expected in self.records:
+            for feature in expected.features:
+                gene = self.read_gene(index, feature.qualifiers['locus_tag'][0])
+                self.assertEqual(str(gene.features[0].extract(gene).seq), str(feature.extract(expected).seq))
+
+    def test_outdated_index(self):
+        GbkIndex.create(gbk=self.gbk, index=self.index)
+        past = time.time() - 10
+        os.utime(self.index, (past, past))
+        with self.assertRaises(FileNotFoundError):
+            GbkIndex(file=self.gbk, index=self.index)
+
+
+class TestFastaIndex(TestCase):
+    def setUp(self):
+        import random
+        rng = random.Random(1)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fasta = os.path.join(self.tmp.name, 'genome.faa')
+        self.index = os.path.join(self.tmp.name, 'genome.faa.cdb')
+        self.sequences = {f'org_{i:06d}': random_sequence(rng, length, 'ACDEFGHIKLMNPQRSTVWY')
+                          for i, length in enumerate([1, 59, 60, 61, 250])}
+        with open(self.fasta, 'w') as f:
+            for identifier, sequence in self.sequences.items():
+                f.write(f'>gnl|Prokka|{identifier} hypothetical protein\n')
+                for i in range(0, len(sequence), 60):
+                    f.write(sequence[i:i + 60].lower() + '\n')
+                f.write('\n')  # empty lines are ignored
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        self.assertEqual(FastaIndex.create(fasta=self.fasta, index=self.index), len(self.sequences))
+        index = FastaIndex(file=self.fasta, index=self.index)
+        for record in SeqIO.parse(self.fasta, 'fasta'):
+            identifier = record.id.rsplit('|', maxsplit=1)[-1]
+            self.assertEqual(index.read_sequence(identifier), str(record.seq).upper())
+            self.assertEqual(index.read_sequence(identifier), self.sequences[identifier])
+
+    def test_read_sequences(self):
+        FastaIndex.create(fasta=self.fasta, index=self.index)
+        index = FastaIndex(file=self.fasta, index=self.index)
+        identifiers = ['org_000004', 'org_000000', 'org_000002']
+        self.assertEqual(
+            list(index.read_sequences(identifiers)),
+            [(identifier, self.sequences[identifier]) for identifier in sorted(identifiers)]
+        )
@@ -2,3 +2,4 @@ from .calculate_orthofinder import calculate_orthofinder as calculate_core_genom
 from .calculate_gendiscal import calculate_gendiscal as calculate_genome_similarity
 from .calculate_dotplot import calculate_dotplot
 from .calculate_blast import calculate_blast
+from .calculate_gtm_permutations import calculate_gtm_permutations
@@ -1,9 +1,12 @@
 from ncbi_blast import Blast
-from OpenGenomeBrowser.settings import FOLDER_STRUCTURE, CACHE_DIR, CACHE_MAXSIZE
-from lib.ogb_cache.ogb_cache import ogb_cache, timedelta
+from OpenGenomeBrowser.settings import FOLDER_STRUCTURE, CACHE_DIR, CACHE_MAXSIZE, CACHE_BACKEND, CACHE_MEMORY_MAXBYTES, \
+    CACHE_MAXBYTES, CACHE_EVICTION_POLICY, CACHE_COMPRESS
+from lib.ogb_cache.ogb_cache import ogb_cache
 
 
-@ogb_cache(cache_root=CACHE_DIR, maxsize=CACHE_MAXSIZE, wait_tolerance=timedelta(seconds=30))
+@ogb_cache(cache_root=CACHE_DIR, maxsize=CACHE_MAXSIZE,
+           backend=CACHE_BACKEND, memory_maxbytes=CACHE_MEMORY_MAXBYTES,
+           maxbytes=CACHE_MAXBYTES, policy=CACHE_EVICTION_POLICY, compress=CACHE_COMPRESS)
 def calculate_blast(fasta_string: str, db: tuple, mode: str, **kwargs):
     blast = Blast(outfmt=5, verbose=False)
     db = [f'{FOLDER_STRUCTURE}/{f}' for f in db]
@@ -1,9 +1,12 @@
 from dot import DotPrep
-from OpenGenomeBrowser.settings import FOLDER_STRUCTURE, CACHE_DIR, CACHE_MAXSIZE
-from lib.ogb_cache.ogb_cache import ogb_cache, timedelta
+from OpenGenomeBrowser.settings import FOLDER_STRUCTURE, CACHE_DIR, CACHE_MAXSIZE, CACHE_BACKEND, CACHE_MEMORY_MAXBYTES, \
+    CACHE_MAXBYTES, CACHE_EVICTION_POLICY, CACHE_COMPRESS
+from lib.ogb_cache.ogb_cache import ogb_cache
 
 
-@ogb_cache(cache_root=CACHE_DIR, maxsize=CACHE_MAXSIZE, wait_tolerance=timedelta(minutes=1))
+@ogb_cache(cache_root=CACHE_DIR, maxsize=CACHE_MAXSIZE,
+           backend=CACHE_BACKEND, memory_maxbytes=CACHE_MEMORY_MAXBYTES,
+           maxbytes=CACHE_MAXBYTES, policy=CACHE_EVICTION_POLICY, compress=CACHE_COMPRESS)
 def calculate_dotplot(fasta_ref: str, fasta_qry: str, mincluster: int):
     coords, index = DotPrep().run_python(
         fasta_ref=f'{FOLDER_STRUCTURE}/{fasta_ref}',
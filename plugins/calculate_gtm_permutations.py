@@ -0,0 +1,9 @@
+from huey.contrib.djhuey import task
+
+
+@task()
+def calculate_gtm_permutations(job_dir: str, chunk: int):
+    from lib.permutation_test import PermutationJob
+    print(f'start gene trait matching permutations: {job_dir} :: chunk {chunk}')
+    PermutationJob(job_dir).run_chunk(chunk)
+    print(f'completed gene trait matching permutations: {job_dir} :: chunk {chunk}')
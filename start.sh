@@ -42,6 +42,7 @@ else
     --module=OpenGenomeBrowser.wsgi \
     --env DJANGO_SETTINGS_MODULE=OpenGenomeBrowser.settings \
     --master --pidfile=/tmp/opengenomebrowser-master.pid \
+    --enable-threads \
     --socket=/socket/ogb.sock \
     --processes="${UWSGI_WORKERS:-5}" \
     --harakiri="${HARAKIRI:-60}" \
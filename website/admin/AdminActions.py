@@ -1,5 +1,6 @@
 from django.contrib import messages
 from django.http import HttpResponseRedirect
+from django.shortcuts import render
 
 
 def download_taxdump(request):
@@ -33,12 +34,34 @@ def reload_css(request):
 
 
 def delete_sunburst_cache(request):
-    import os, shutil
-    from OpenGenomeBrowser.settings import CACHE_DIR
-    sunburst_cache_dir = f'{CACHE_DIR}/website.views.Home.sunburst'
-    if os.path.isdir(sunburst_cache_dir):
-        shutil.rmtree(sunburst_cache_dir)
-        messages.add_message(request, messages.SUCCESS, f'Deleted sunburst cache!')
-    else:
-        messages.add_message(request, messages.ERROR, f'No cache found.')
+    from website.views.Home import sunburst
+    sunburst.clear()
+    messages.add_message(request, messages.SUCCESS, f'Deleted sunburst cache!')
     return HttpResponseRedirect('/admin/')
+
+
+def cache_stats_view(request):
+    from OpenGenomeBrowser.settings import CACHE_DIR, CACHE_MAXBYTES, CACHE_EVICTION_POLICY
+    from lib.ogb_cache.stats import cache_summary
+    from website.views.helpers.extract_errors import extract_errors
+    context = extract_errors(request, dict(title='Cache statistics'))
+    context['summary'] = cache_summary(CACHE_DIR)
+    context['nbytes'] = sum(row['nbytes'] for row in context['summary'])
+    context['maxbytes'] = CACHE_MAXBYTES
+    context['policy'] = CACHE_EVICTION_POLICY
+    context['cache_dir'] = CACHE_DIR
+    return render(request, 'admin/cache-stats.html', context=context)
+
+
+def evict_cache(request):
+    from OpenGenomeBrowser.settings import CACHE_DIR, CACHE_MAXBYTES, CACHE_EVICTION_POLICY
+    from lib.ogb_cache.eviction import evict_cache_dir
+    from lib.ogb_cache.stats import get_stats
+    from urllib.parse import urlencode
+    try:
+        removed = evict_cache_dir(
+            CACHE_DIR, maxbytes=CACHE_MAXBYTES, policy=CACHE_EVICTION_POLICY, stats=get_stats(CACHE_DIR))
+        message = dict(info=f'Removed {len(removed)} cache entries!')
+    except Exception as e:
+        message = dict(danger=f'Something went wrong: {str(e)}')
+    return HttpResponseRedirect(f'/admin/cache-stats/?{urlencode(message)}')
@@ -5,7 +5,8 @@ from django.contrib.auth.decorators import permission_required
 
 from website.admin.MarkdownEditor import markdown_editor_view, markdown_editor_submit
 from website.admin.GenomeUpload import GenomeUploadView, genome_import_view, genome_import_submit, remove_genome
-from website.admin.AdminActions import download_taxdump, reload_taxids, reload_css, delete_sunburst_cache
+from website.admin.AdminActions import download_taxdump, reload_taxids, reload_css, delete_sunburst_cache, \
+    cache_stats_view, evict_cache
 
 
 class OgbAdminSite(admin.AdminSite):
@@ -44,6 +45,18 @@ class OgbAdminSite(admin.AdminSite):
                 name='delete-sunburst-cache'
             ),
 
+            path(
+                route=r'cache-stats/',
+                view=self.admin_view(cache_stats_view),  # any staff member may do this
+                name='cache-stats'
+            ),
+
+            path(
+                route=r'evict-cache/',
+                view=permission_required('website.add_genome')(self.admin_view(evict_cache)),
+                name='evict-cache'
+            ),
+
             path(
                 route=r'markdown-editor/',
                 view=permission_required(change_permissions)(self.admin_view(markdown_editor_view)),
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0014_alter_genomecontent_ani_similarity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='genomecontent',
+            name='input_files',
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.0.2 on 2026-10-18 10:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    """
+    Turn the auto-created GenomeContent.annotations table into the GenomeContentAnnotation through model. The table
+    is kept, only the n_genes column is added and filled from the Gene-Annotation links.
+    """
+
+    dependencies = [
+        ('website', '0015_genomecontent_input_files'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='GenomeContentAnnotation',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('n_genes', models.IntegerField(default=1, verbose_name='Number of genes')),
+                        ('annotation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='website.annotation')),
+                        ('genomecontent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='website.genomecontent')),
+                    ],
+                    options={
+                        'db_table': 'website_genomecontent_annotations',
+                        'unique_together': {('genomecontent', 'annotation')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='genomecontent',
+                    name='annotations',
+                    field=models.ManyToManyField(through='website.GenomeContentAnnotation', to='website.Annotation'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    sql='ALTER TABLE website_genomecontent_annotations ADD COLUMN n_genes integer NOT NULL DEFAULT 1',
+                    reverse_sql='ALTER TABLE website_genomecontent_annotations DROP COLUMN n_genes',
+                ),
+                migrations.RunSQL(
+                    sql='''
+                        UPDATE website_genomecontent_annotations ga SET n_genes = counts.n_genes
+                        FROM (
+                            SELECT gene.genomecontent_id, gene_anno.annotation_id, COUNT(*) AS n_genes
+                            FROM website_gene_annotations gene_anno
+                            JOIN website_gene gene ON gene.identifier = gene_anno.gene_id
+                            GROUP BY gene.genomecontent_id, gene_anno.annotation_id
+                        ) counts
+                        WHERE ga.genomecontent_id = counts.genomecontent_id AND ga.annotation_id = counts.annotation_id
+                    ''',
+                    reverse_sql=migrations.RunSQL.noop,
+                ),
+            ],
+        ),
+    ]
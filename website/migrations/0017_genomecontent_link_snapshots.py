@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0016_genomecontentannotation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='genomecontent',
+            name='link_snapshots',
+            field=models.JSONField(default=dict),
+        ),
+    ]
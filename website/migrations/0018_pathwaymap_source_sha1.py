@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0017_genomecontent_link_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pathwaymap',
+            name='source_sha1',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
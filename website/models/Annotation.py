@@ -148,76 +148,84 @@ class Annotation(models.Model):
                 print(f'Annotation-description file does not exist: {settings.ANNOTATION_DESCRIPTIONS}/{anno_type}.tsv')
 
     @staticmethod
-    def load_ortholog_annotations(batch_size: int = 1000):
-        from website.models import GenomeContent, Gene
+    def load_ortholog_annotations():
+        """
+        Import settings.ORTHOLOG_ANNOTATIONS (orthogroup<TAB>gene1, gene2, ...) with constant memory usage.
 
-        assert os.path.isfile(settings.ORTHOLOG_ANNOTATIONS), f'File does not exist: {settings.ORTHOLOG_ANNOTATIONS}'
+        The file is streamed into an unlogged staging table via COPY, genes that do not exist are filtered out by a
+        join in PostgreSQL.
+        """
+        from django.db import connection
+        from website.models import GenomeContentAnnotation, Gene, PathwayMap
+        from website.models.helpers.bulk_copy import copy_stream
 
-        print(f'Step 1: Deleting all ortholog-annotations.')
-        Annotation.objects.filter(anno_type='OL').delete()
+        assert os.path.isfile(settings.ORTHOLOG_ANNOTATIONS), f'File does not exist: {settings.ORTHOLOG_ANNOTATIONS}'
 
-        print(f'Step 2: Importing ortholog-annotations from {settings.ORTHOLOG_ANNOTATIONS}.')
+        annotation_table = Annotation._meta.db_table
+        gene_table = Gene._meta.db_table
+        gene_anno_table = Gene.annotations.through._meta.db_table
+        staging = '_staging_orthologs'
+        staging_descriptions = '_staging_ortholog_descriptions'
+
+        def ortholog_to_gene():
+            with open(settings.ORTHOLOG_ANNOTATIONS) as f:
+                for line in f:
+                    orthogroup, gene_ids = line.rstrip().split('\t', maxsplit=1)
+                    for gene_id in gene_ids.split(', '):
+                        yield orthogroup, gene_id.rsplit('|', maxsplit=1)[-1]
+
+        def descriptions(file: str):
+            with open(file) as f:
+                for line in f:
+                    yield line.strip().split('\t')
+
+        with connection.cursor() as cursor:
+            print(f'Step 1: Deleting all ortholog-annotations.')
+            # raw SQL: the ORM would load the names of all orthogroups to cascade the delete
+            for through in [Gene.annotations.through, GenomeContentAnnotation, PathwayMap.annotations.through]:
+                cursor.execute(f'''
+                    DELETE FROM "{through._meta.db_table}" t USING "{annotation_table}" a
+                    WHERE t.annotation_id = a.name AND a.anno_type = 'OL'
+                ''')
+            cursor.execute(f'DELETE FROM "{annotation_table}" WHERE anno_type = %s', ['OL'])
 
-        all_genomecontent_ids = set(GenomeContent.objects.all().values_list('identifier', flat=True))
-        all_genes = set(Gene.objects.all().values_list('identifier', flat=True))
-        orthogroups = []
-        genomecontent_to_ortholog_links = []
-        gene_to_ortholog_links = []
+            try:
+                print(f'Step 2: Streaming {settings.ORTHOLOG_ANNOTATIONS} into PostgreSQL.')
+                cursor.execute(f'DROP TABLE IF EXISTS "{staging}"')
+                cursor.execute(f'CREATE UNLOGGED TABLE "{staging}" (orthogroup text NOT NULL, gene_id text NOT NULL)')
+                copy_stream(staging, ['orthogroup', 'gene_id'], ortholog_to_gene())
+
+                cursor.execute(f'DROP TABLE IF EXISTS "{staging_descriptions}"')
+                cursor.execute(f'CREATE UNLOGGED TABLE "{staging_descriptions}" (name text NOT NULL, description text NOT NULL)')
+                description_file = f'{settings.ANNOTATION_DESCRIPTIONS}/OL.tsv'
+                if os.path.isfile(description_file):
+                    copy_stream(staging_descriptions, ['name', 'description'], descriptions(description_file))
+
+                print(f'Step 3: Creating orthogroups.')
+                cursor.execute(f'''
+                    INSERT INTO "{annotation_table}" (name, description, anno_type)
+                    SELECT o.orthogroup, COALESCE(MIN(d.description), '-'), 'OL'
+                    FROM (SELECT DISTINCT orthogroup FROM "{staging}") o
+                    LEFT JOIN "{staging_descriptions}" d ON d.name = o.orthogroup
+                    GROUP BY o.orthogroup
+                    ON CONFLICT DO NOTHING
+                ''')
+
+                print(f'Step 4: Creating orthogroups-to-genes.')
+                cursor.execute(f'''
+                    INSERT INTO "{gene_anno_table}" (gene_id, annotation_id)
+                    SELECT s.gene_id, s.orthogroup
+                    FROM "{staging}" s
+                    JOIN "{gene_table}" g ON g.identifier = s.gene_id
+                    ON CONFLICT DO NOTHING
+                ''')
+            finally:
+                cursor.execute(f'DROP TABLE IF EXISTS "{staging}"')
+                cursor.execute(f'DROP TABLE IF EXISTS "{staging_descriptions}"')
+
+        print('Step 5: Deriving orthogroups-to-genomes from orthogroups-to-genes.')
+        GenomeContentAnnotation.objects.refresh(anno_types=['OL'])
 
-        try:
-            adf = AnnotationDescriptionFile('OL', create_cdb=True)
-
-            def get_descr(query):
-                return adf.get_description_or_alternative(query, alternative='-')
-        except FileNotFoundError:
-            def get_descr(query):
-                return '-'
-
-        def load():
-            print(f'Step 3, batch {line_nr // batch_size}:', end=' ', flush=True)
-            # Create Annotation-Objects
-            print(f'+{len(orthogroups)} orthogroups', end=' ', flush=True)
-            Annotation.objects.bulk_create(orthogroups)
-
-            # Create many-to-many relationships
-            print(f'+{len(genomecontent_to_ortholog_links)} orthogroups-to-genomes.', end=' ', flush=True)
-            GenomeContent.annotations.through.objects.bulk_create(genomecontent_to_ortholog_links)
-
-            print(f'+{len(gene_to_ortholog_links)} orthogroups-to-genes.')
-            Gene.annotations.through.objects.bulk_create(gene_to_ortholog_links)
-
-        with open(settings.ORTHOLOG_ANNOTATIONS) as f:
-            for line_nr, line in enumerate(f, 1):
-                orthogroup, gene_ids = line.rstrip().split('\t', maxsplit=1)
-                gene_ids = [gid.rsplit('|', maxsplit=1)[-1] for gid in gene_ids.split(', ')]
-                genome_ids = set(gid.rsplit('_', maxsplit=1)[0] for gid in gene_ids)
-
-                orthogroups.append(Annotation(name=orthogroup, anno_type='OL', description=get_descr(orthogroup)))
-
-                gene_to_ortholog_links.extend(
-                    [
-                        Gene.annotations.through(gene_id=gene_id, annotation_id=orthogroup)
-                        for gene_id in gene_ids
-                        if gene_id in all_genes
-                    ]
-                )
-
-                genomecontent_to_ortholog_links.extend(
-                    [
-                        GenomeContent.annotations.through(genomecontent_id=genome_id, annotation_id=orthogroup)
-                        for genome_id in genome_ids
-                        if genome_id in all_genomecontent_ids
-                    ]
-                )
-
-                if line_nr % batch_size == 0:
-                    load()  # load batch
-
-                    orthogroups = []
-                    genomecontent_to_ortholog_links = []
-                    gene_to_ortholog_links = []
-
-        load()  # load last batch
         n_imported = Annotation.objects.filter(anno_type='OL').count()
         print(f'Success: Imported {n_imported} ortholog annotations.')
 
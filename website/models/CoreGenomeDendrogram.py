@@ -3,11 +3,13 @@ import os.path
 from django.db import models
 from hashlib import sha224
 
-from OpenGenomeBrowser.settings import ORTHOFINDER_ENABLED, CACHE_DIR, CACHE_MAXSIZE
+from OpenGenomeBrowser.settings import ORTHOFINDER_ENABLED, CACHE_DIR, CACHE_MAXSIZE, CACHE_MAXBYTES, CACHE_EVICTION_POLICY
 from plugins import calculate_core_genome_dendrogram
 from .GenomeContent import GenomeContent
 from .Genome import Genome
 from lib.ogb_cache.ogb_cache import clear_cache
+from lib.ogb_cache.eviction import enforce_budget
+from lib.ogb_cache.stats import get_stats
 
 
 class DendrogramManager(models.Manager):
@@ -80,3 +82,5 @@ class CoreGenomeDendrogram(models.Model):
     @staticmethod
     def clean_cache():
         clear_cache(cache_fn_dir=f'{CACHE_DIR}/core-genome-dendrogram', maxsize=CACHE_MAXSIZE)
+        if CACHE_MAXBYTES:
+            enforce_budget(CACHE_DIR, maxbytes=CACHE_MAXBYTES, policy=CACHE_EVICTION_POLICY, stats=get_stats(CACHE_DIR))
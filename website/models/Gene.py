@@ -1,18 +1,89 @@
+from io import StringIO
 from django.db import models
 from website.models.GenomeContent import GenomeContent
 from website.models.Annotation import Annotation
 from Bio import SeqIO
+from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 from Bio.SeqUtils import GC
 from OpenGenomeBrowser import settings
 
 
+class GeneManager(models.Manager):
+    def sequences(self, identifiers: [str], kind: str = 'dna'):
+        """
+        Fetch the sequences of many genes at once. The genes are grouped by genome, so each file is opened only once
+        and read in a single pass.
+
+        :param identifiers: gene identifiers
+        :param kind: 'dna' or 'protein'
+        :returns: generator of (identifier, sequence), ordered by genome. sequence is None for non-protein-coding genes.
+        :raises KeyError: if some genes do not exist
+        """
+        assert kind in ['dna', 'protein'], f"kind must be either 'dna' or 'protein', got {kind}."
+        identifiers = set(identifiers)
+
+        genome_to_genes = {}
+        for identifier, genomecontent_id in self.filter(identifier__in=identifiers).values_list('identifier', 'genomecontent_id'):
+            genome_to_genes.setdefault(genomecontent_id, set()).add(identifier)
+
+        n_found = sum(len(genes) for genes in genome_to_genes.values())
+        if n_found != len(identifiers):
+            raise KeyError(f'{len(identifiers)} genes were requested but only {n_found} genes were found.')
+
+        genomecontents = GenomeContent.objects.filter(identifier__in=genome_to_genes.keys()).select_related('genome__organism')
+        for genomecontent in genomecontents:
+            yield from self._sequences_of_genome(genomecontent, genome_to_genes[genomecontent.identifier], kind)
+
+    @classmethod
+    def _sequences_of_genome(cls, genomecontent: GenomeContent, locus_tags: {str}, kind: str):
+        locus_tags = set(locus_tags)
+
+        # try fasta index first: it points directly to the sequence
+        fasta_index = genomecontent.locus_index('ffn' if kind == 'dna' else 'faa')
+        if fasta_index is not None:
+            indexed = [locus_tag for locus_tag in locus_tags if locus_tag in fasta_index]
+            yield from fasta_index.read_sequences(indexed)
+            locus_tags.difference_update(indexed)
+
+        if not locus_tags:
+            return
+
+        # fall back to gbk: read only the records that contain the genes, or the whole file if there is no index
+        gbk_index = genomecontent.locus_index('gbk')
+        if gbk_index is not None and all(locus_tag in gbk_index for locus_tag in locus_tags):
+            scfs = (SeqIO.read(StringIO(record), "genbank") for record, _ in gbk_index.read_records(locus_tags))
+        else:
+            scfs = SeqIO.parse(genomecontent.genome.cds_gbk(relative=False), "genbank")
+
+        for scf in scfs:
+            for feature in scf.features:
+                locus_tag = feature.qualifiers.get('locus_tag', [0])[0]
+                if locus_tag not in locus_tags:
+                    continue
+                locus_tags.remove(locus_tag)
+                seqrecord = feature.extract(scf)
+                if kind == 'dna':
+                    yield locus_tag, str(seqrecord.seq).upper()
+                else:
+                    translations = [f.qualifiers['translation'][0] for f in seqrecord.features if 'translation' in f.qualifiers]
+                    yield locus_tag, translations[-1].upper() if translations else None
+            if not locus_tags:
+                return
+
+        raise KeyError(f'Could not find locus_tags {locus_tags} in {genomecontent.genome.cds_gbk(relative=False)}')
+
+
 class Gene(models.Model):
     """
     Represents a gene. Belongs to a Genome.
 
     Sequences aren't stored in the database and need to be retrieved from the gbk-file.
+    If the genome has a locus index (see GenomeContent.create_locus_index), only the features of the gene and the part
+    of the scaffold they cover are read.
     """
+    objects = GeneManager()
+
     genomecontent = models.ForeignKey(GenomeContent, on_delete=models.CASCADE)
 
     identifier = models.CharField(max_length=50, primary_key=True)
@@ -40,6 +111,10 @@ class Gene(models.Model):
         return f'>{self.identifier}\n{self.nucleotide_sequence()}'
 
     def nucleotide_sequence(self) -> str:
+        if not hasattr(self, '_gbk_record'):
+            ffn_index = self.genomecontent.locus_index('ffn')
+            if ffn_index is not None and self.identifier in ffn_index:
+                return ffn_index.read_sequence(self.identifier)
         self.__load_gbk_seqrecord()
         return str(self._gbk_record.seq).upper()
 
@@ -47,9 +122,13 @@ class Gene(models.Model):
         sequence = self.protein_sequence()
         if sequence is None:
             raise KeyError(f'The gene {self.identifier} is not protein-coding.')
-        return f'>{self.identifier}\n{self.protein_sequence()}'
+        return f'>{self.identifier}\n{sequence}'
 
     def protein_sequence(self):
+        if not hasattr(self, '_gbk_record'):
+            faa_index = self.genomecontent.locus_index('faa')
+            if faa_index is not None and self.identifier in faa_index:
+                return faa_index.read_sequence(self.identifier)
         self.__load_gbk_seqrecord()
         if 'translation' in self._all_qualifiers:
             return self._all_qualifiers['translation'][0].upper()
@@ -71,16 +150,26 @@ class Gene(models.Model):
     def __load_gbk_seqrecord(self):
         # ensure it's only loaded once
         if not hasattr(self, '_gbk_record'):
-            self._gbk_record = self.__get_gbk_seqrecord(self.genomecontent.genome.cds_gbk(relative=False), self.identifier)
+            gbk_index = self.genomecontent.locus_index('gbk')
+            if gbk_index is not None and self.identifier in gbk_index:
+                # read only the header of the scaffold, the features of the gene and the sequence they cover
+                file = gbk_index.file
+                record_text, start, sequence = gbk_index.read_gene(self.identifier)
+                scf = SeqIO.read(StringIO(record_text), "genbank")
+                scf.seq = Seq({start: sequence}, length=len(scf.seq))
+                scfs = [scf]
+            else:
+                file = self.genomecontent.genome.cds_gbk(relative=False)
+                scfs = SeqIO.parse(file, "genbank")
+            self._gbk_record = self.__get_gbk_seqrecord(scfs, self.identifier, file)
             all_qualifiers = dict()
             for f in self._gbk_record.features:
                 all_qualifiers.update(f.qualifiers)
             self._all_qualifiers = all_qualifiers
 
     @staticmethod
-    def __get_gbk_seqrecord(file: str, identifier: str) -> SeqRecord:
-        gb_records = SeqIO.parse(file, "genbank")
-        for scf in gb_records:
+    def __get_gbk_seqrecord(scfs, identifier: str, file: str) -> SeqRecord:
+        for scf in scfs:
             for feature in scf.features:
                 locus_tag = feature.qualifiers.get('locus_tag', [0])[0]  # returns [0] so it can be unpacked
                 if locus_tag == identifier:
@@ -1,10 +1,16 @@
 import os
+import csv
 import logging
-from django.db import models
+from contextlib import contextmanager
+from django.db import models, transaction
 from django.db.models import JSONField
-from website.models.Annotation import Annotation, AnnotationDescriptionFile, AnnotationType, annotation_types
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from website.models.Annotation import Annotation, AnnotationDescriptionFile, annotation_types
 from .TaxID import TaxID
 from .GenomeSimilarity import GenomeSimilarity
+from .GenomeContentAnnotation import GenomeContentAnnotation
+from website.models.helpers.bulk_copy import copy_merge, copy_delete
 from OpenGenomeBrowser import settings
 
 
@@ -22,7 +28,11 @@ class GenomeContent(models.Model):
 
     custom_files = JSONField(default=list)  # list [{"date": "2016-02-29", "file": "FAM19038.ko", "type": "KEGG"}]
 
-    annotations = models.ManyToManyField(Annotation)
+    input_files = JSONField(default=dict)  # {"FAM19038.ko": {"sha1": "...", "mtime": 1612345678.9, "size": 123}}
+
+    link_snapshots = JSONField(default=dict)  # {"gbk": "<sha1 of the snapshot>", "custom/FAM19038.ko": "..."}
+
+    annotations = models.ManyToManyField(Annotation, through=GenomeContentAnnotation)  # derived from Gene.annotations
 
     ani_similarity = models.ManyToManyField('self', through=GenomeSimilarity, symmetrical=True)
 
@@ -50,6 +60,38 @@ class GenomeContent(models.Model):
     def blast_db_ffn(self, relative=True):
         return f'{self.blast_dbs_path(relative=relative)}/ffn/{self.identifier}.ffn'
 
+    def locus_index_path(self, relative=True):
+        return f'{self.genome.base_path(relative=relative)}/.locus_index'
+
+    def locus_index_gbk(self, relative=True):
+        return f'{self.locus_index_path(relative=relative)}/gbk.cdb'
+
+    def locus_index_faa(self, relative=True):
+        return f'{self.locus_index_path(relative=relative)}/faa.cdb'
+
+    def locus_index_ffn(self, relative=True):
+        return f'{self.locus_index_path(relative=relative)}/ffn.cdb'
+
+    def locus_index(self, file_type: str):
+        """
+        :param file_type: 'gbk', 'faa' or 'ffn'
+        :returns: GbkIndex or FastaIndex, None if the file has no index or the index is outdated
+        """
+        from lib.sequence_index import GbkIndex, FastaIndex
+        genome = self.genome
+        get_file, get_index, index_class = {
+            'gbk': (genome.cds_gbk, self.locus_index_gbk, GbkIndex),
+            'faa': (genome.cds_faa, self.locus_index_faa, FastaIndex),
+            'ffn': (genome.cds_ffn, self.locus_index_ffn, FastaIndex),
+        }[file_type]
+        file = get_file(relative=False)
+        if file is None:
+            return None
+        try:
+            return index_class(file=file, index=get_index(relative=False))
+        except FileNotFoundError:
+            return None
+
     def __str__(self):
         return self.identifier
 
@@ -72,115 +114,538 @@ class GenomeContent(models.Model):
         from_partners = GenomeContent.objects.filter(to_ani__in=self.from_ani.all())
         return to_partners.union(from_partners)
 
-    def update(self):
-        # was the gbk file changed? if so -> reload everything
-        if self._gbk_file_size != os.stat(self.genome.cds_gbk(relative=False)).st_size:
-            load_genome(self)
+    def import_state_path(self, relative=True):
+        return f'{self.genome.base_path(relative=relative)}/.import_state'
+
+    def link_snapshot(self, source: str, relative=True):
+        """
+        The Gene-Annotation links each input file contributed at the last import, used to compute minimal diffs.
+
+        The file is only trusted if its sha1 matches link_snapshots, which is stored in the same transaction as the
+        links, see link_snapshot_file.
+
+        :param source: 'gbk' or 'custom/{file}', see link_sources
+        """
+        return f'{self.import_state_path(relative=relative)}/{source}.tsv'
+
+    def link_sources(self) -> [str]:
+        return ['gbk'] + [custom_source(file_dict) for file_dict in self.custom_files]
+
+    def plan_update(self, base_path: str = None, metadata: dict = None, fingerprints: dict = None) -> dict:
+        """
+        Decide which files update() has to (re)load by comparing the content hashes of the input files to those of
+        the last import.
+
+        :param base_path: absolute path to the genome folder, default: self.genome.base_path
+        :param metadata: genome.json-like dict with the file names, default: taken from self.genome
+        :param fingerprints: {file: fingerprint} computed earlier (e.g. by plan_update in a worker process), reused
+                             if the files did not change since
+        :returns: {
+            'full_reload': True if the genome has to be loaded from scratch,
+            'gbk': True if the gbk file changed,
+            'sequences': True if the gbk, faa or ffn file changed (locus index and blast dbs are outdated),
+            'assembly': True if the assembly fasta changed,
+            'load': [custom files to (re)load],
+            'remove': [custom files to unload],
+            'fingerprints': {file: fingerprint} to store after the update
+        }
+        """
+        if metadata is None:
+            genome = self.genome
+            base_path = genome.base_path(relative=False)
+            metadata = {field: getattr(genome, field) for field in [*SEQUENCE_FILES.values(), 'custom_annotations']}
+
+        # genomes imported before hashes were stored: trust the file size of the gbk, like before
+        legacy = not self.input_files and self._gbk_file_size != 0
+
+        known, fingerprints = fingerprints or {}, {}
+
+        def has_changed(file: str, legacy_changed: bool) -> bool:
+            previous = self.input_files.get(file)
+            fingerprints[file] = fingerprint(f'{base_path}/{file}', previous, known.get(file))
+            if previous is None:
+                return legacy_changed if legacy else True
+            return previous['sha1'] != fingerprints[file]['sha1']
+
+        changed = set()
+        for kind, field in SEQUENCE_FILES.items():
+            file = metadata.get(field)
+            if not file:
+                continue
+            legacy_changed = kind == 'gbk' and self._gbk_file_size != os.stat(f'{base_path}/{file}').st_size
+            if has_changed(file, legacy_changed):
+                changed.add(kind)
+
+        loaded = {file_dict['file']: file_dict for file_dict in self.custom_files}
+        wanted = {file_dict['file']: file_dict for file_dict in metadata.get('custom_annotations') or []}
+
+        # removed files and files whose type or date changed
+        remove = [file_dict for file, file_dict in loaded.items() if wanted.get(file) != file_dict]
+        load = [file_dict for file, file_dict in wanted.items()
+                if has_changed(file, legacy_changed=False) or loaded.get(file) != file_dict]
+
+        # genes that reappear in the gbk need the links of the custom files again (only the diff is written)
+        if 'gbk' in changed:
+            load += [file_dict for file_dict in wanted.values() if file_dict not in load]
+
+        # links are removed based on the snapshots of the last import, without them, everything has to be reloaded
+        # (validating the snapshots hashes them, only do that if they are needed)
+        needs_diff = 'gbk' in changed or remove or any(file_dict['file'] in loaded for file_dict in load)
+        full_reload = bool(needs_diff) and (self._gbk_file_size == 0 or not all(
+            link_snapshot_file(self, source, import_state_path=f'{base_path}/.import_state') is not None
+            for source in self.link_sources()))
+
+        return {
+            'full_reload': full_reload,
+            'gbk': 'gbk' in changed,
+            'sequences': bool(changed & {'gbk', 'faa', 'ffn'}),
+            'assembly': 'assembly' in changed,
+            'load': load,
+            'remove': remove,
+            'fingerprints': fingerprints,
+        }
+
+    def update(self, parsed: dict = None) -> dict:
+        """
+        Only re-parse input files whose content changed and only write the Gene-Annotation links that changed.
+
+        :param parsed: pre-parsed files (output of parse_genome), e.g. from a worker process. Files that are
+                       required but missing from parsed are parsed here. parsed['fingerprints'] (optional): output
+                       of plan_update in the worker, so the files are not hashed again
+        :returns: the output of plan_update
+        """
+        plan = self.plan_update(fingerprints=parsed.get('fingerprints') if parsed else None)
+
+        if plan['full_reload']:
+            self.wipe_data(genes=True)
+            load_genome(self, parsed=parsed)
             create_blast_dbs(self, reload=True)
-            self.save()
-            return
-
-        # was one of the files removed or changed? if so -> reload everything
-        for file_dict in self.custom_files:
-            if file_dict not in self.genome.custom_annotations:
-                self.wipe_data(genes=True)
-                load_genome(self)
-                self.save()
-                return
-
-        # was a new file added? -> load it
-        for file_dict in self.genome.custom_annotations:
-            if file_dict not in self.custom_files:
-                load_custom_file(self, file_dict)
+        else:
+            if plan['gbk']:
+                update_gbk(self, parsed=parsed)  # also reloads all custom files, see plan_update
+            for file_dict in plan['remove']:
+                unload_custom_file(self, file_dict)
+            for file_dict in plan['load']:
+                rows = parsed['custom_files'].get(file_dict['file']) if parsed else None
+                load_custom_file(self, file_dict, rows=rows)
+            if plan['sequences']:
+                create_locus_index(self)
+                create_blast_dbs(self, reload=True)
+
+        if plan['full_reload'] or plan['gbk'] or plan['remove'] or plan['load']:
+            GenomeContentAnnotation.objects.refresh(genomecontent=self)
+
+        self.input_files = plan['fingerprints']
         self.save()
+        return plan
 
     def wipe_data(self, genes=False):
         if genes:
             self._gbk_file_size = 0
             self.gene_set.all().delete()
         self.custom_files = []
+        self.input_files = {}
+        self.link_snapshots = {}
         self.annotations.clear()
+        # after a rollback, link_snapshots no longer matches the files: the next update reloads everything
+        if os.path.isdir(self.import_state_path(relative=False)):
+            import shutil
+            shutil.rmtree(self.import_state_path(relative=False))
+
+    def forget_links(self, anno_types: [str], custom_files: [dict]) -> None:
+        """
+        Keep the link snapshots consistent after links were removed manually (manage_ogb.py reload-custom-annotations).
+
+        :param anno_types: remove the links of these anno_types from all snapshots
+        :param custom_files: drop the snapshots and fingerprints of these custom files
+        """
+        for file_dict in custom_files:
+            self.input_files.pop(file_dict['file'], None)
+            remove_link_snapshot(self, custom_source(file_dict))
+        for source in self.link_sources():
+            if link_snapshot_file(self, source) is not None:
+                links = read_link_snapshot(self, source)
+                write_link_snapshot(self, source, {link for link in links if link[2] not in anno_types})
+
+
+SEQUENCE_FILES = {
+    'assembly': 'assembly_fasta_file',
+    'gbk': 'cds_tool_gbk_file',
+    'faa': 'cds_tool_faa_file',
+    'ffn': 'cds_tool_ffn_file',
+}
+
+
+@receiver(post_delete, sender=GenomeContent)
+def mark_deleted_genome_dirty(sender, instance: GenomeContent, **kwargs) -> None:
+    """
+    Empty the rows of deleted genomes in the presence matrices. A signal rather than GenomeContent.delete, because
+    genomes are also deleted in bulk and by cascade (e.g. with their organism).
+    """
+    from .helpers.presence_matrix import mark_dirty
+    identifier = instance.identifier
+    transaction.on_commit(lambda: mark_dirty([identifier]))
+
+
+def file_sha1(file: str) -> str:
+    import hashlib
+    sha1 = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def fingerprint(file: str, *known: dict) -> dict:
+    """
+    :param file: absolute path to the file
+    :param known: earlier fingerprints of the file (None is allowed), e.g. of the last import. If mtime and size of
+                  one of them are unchanged, its hash is reused, i.e. unchanged files are not read.
+    :returns: {'sha1': str, 'mtime': float, 'size': int}
+    """
+    stat = os.stat(file)
+    for previous in known:
+        if previous and previous['mtime'] == stat.st_mtime and previous['size'] == stat.st_size:
+            return previous
+    return {'sha1': file_sha1(file), 'mtime': stat.st_mtime, 'size': stat.st_size}
+
+
+def custom_source(file_dict: dict) -> str:
+    return f"custom/{file_dict['file']}"
+
+
+def link_snapshot_file(genomecontent: GenomeContent, source: str, import_state_path: str = None) -> str or None:
+    """
+    :param import_state_path: absolute path, default: genomecontent.import_state_path
+    :returns: the snapshot file whose sha1 matches genomecontent.link_snapshots, None if there is none. While the
+              transaction that wrote it is open, this is {source}.tsv.pending, see open_link_snapshot
+    """
+    expected = genomecontent.link_snapshots.get(source)
+    if expected is None:
+        return None
+    if import_state_path is None:
+        import_state_path = genomecontent.import_state_path(relative=False)
+    snapshot = f'{import_state_path}/{source}.tsv'
+    for file in [f'{snapshot}.pending', snapshot]:
+        if os.path.isfile(file) and file_sha1(file) == expected:
+            return file
+    return None
+
+
+@contextmanager
+def open_link_snapshot(genomecontent: GenomeContent, source: str):
+    """
+    :returns: csv writer for rows of (locus_tag, annotation name, anno_type)
+
+    The snapshot is written to {source}.tsv.pending and its sha1 to genomecontent.link_snapshots (saved by the caller,
+    in the same transaction as the links). The file replaces {source}.tsv when the transaction commits. After a
+    rollback, the old file still matches the old sha1 in the database.
+    """
+    snapshot = genomecontent.link_snapshot(source, relative=False)
+    os.makedirs(os.path.dirname(snapshot), exist_ok=True)
+    with open(f'{snapshot}.pending.tmp', 'w', newline='') as f:
+        yield csv.writer(f, delimiter='\t')
+    os.replace(f'{snapshot}.pending.tmp', f'{snapshot}.pending')
+    genomecontent.link_snapshots[source] = file_sha1(f'{snapshot}.pending')
+
+    def promote():
+        if os.path.isfile(f'{snapshot}.pending'):
+            os.replace(f'{snapshot}.pending', snapshot)
+
+    transaction.on_commit(promote)
+
 
+def write_link_snapshot(genomecontent: GenomeContent, source: str, links: {(str, str, str)}) -> None:
+    with open_link_snapshot(genomecontent, source) as writer:
+        writer.writerows(sorted(links))
 
-def load_genome(genomecontent: GenomeContent):
+
+def remove_link_snapshot(genomecontent: GenomeContent, source: str) -> None:
+    """ The file is removed when the transaction commits. """
+    genomecontent.link_snapshots.pop(source, None)
+    snapshot = genomecontent.link_snapshot(source, relative=False)
+
+    def remove():
+        for file in [snapshot, f'{snapshot}.pending']:
+            if os.path.isfile(file):
+                os.remove(file)
+
+    transaction.on_commit(remove)
+
+
+def read_link_snapshot(genomecontent: GenomeContent, source: str) -> {(str, str, str)}:
+    """ :returns: the links of source that are in the database, empty if there is no valid snapshot """
+    file = link_snapshot_file(genomecontent, source)
+    if file is None:
+        return set()
+    with open(file, newline='') as f:
+        return set(tuple(row) for row in csv.reader(f, delimiter='\t'))
+
+
+def apply_links(genomecontent: GenomeContent, source: str, links: {(str, str, str)}) -> None:
+    """
+    Write only the Gene-Annotation links of an input file that changed since the last import.
+
+    Links that disappeared from the file are only removed if no other input file provides them. Links to genes that
+    do not exist (anymore) are skipped and not recorded in the snapshot, i.e. they are inserted once the gene exists.
+
+    :param source: 'gbk' or 'custom/{file}', see GenomeContent.link_sources
+    :param links: {(locus_tag, annotation name, anno_type), ...}
+    """
     from .Gene import Gene
-    from Bio import SeqIO
-    print("       (re)loading gbk")
-    genomecontent.wipe_data()
+    old_links = read_link_snapshot(genomecontent, source)
+
+    if source != 'gbk' and links - old_links:
+        genes = set(genomecontent.gene_set.values_list('identifier', flat=True))
+        unknown = {link for link in links if link[0] not in genes}
+        if unknown:
+            logging.warning(f'{genomecontent}: {source} links {len(unknown)} annotations to unknown genes, skipped')
+            links = links - unknown
+
+    removed = old_links - links
+    if removed:
+        for other in genomecontent.link_sources():
+            if other != source:
+                removed -= read_link_snapshot(genomecontent, other)
+        copy_delete(
+            table=Gene.annotations.through._meta.db_table,
+            columns=['gene_id', 'annotation_id'],
+            rows=((locus_tag, name) for locus_tag, name, anno_type in removed)
+        )
+
+    added = links - old_links
+    copy_annotations(
+        annotations={(name, anno_type) for locus_tag, name, anno_type in added},
+        links={(locus_tag, name) for locus_tag, name, anno_type in added}
+    )
+
+    write_link_snapshot(genomecontent, source, links)
+
+
+def parse_gbk(gbk: str, load_ec: bool = True):
+    """
+    Stream a GenBank file, one scaffold at a time, so memory stays bounded by the size of the largest scaffold.
 
-    # create objects in bulk -> much faster
-    gene_id_set = set()
-    gene_code_set = set()
-    product_set = set()
-    ec_set = set()
-    gene_code_relationships = set()  # [('gene1', 'anno1), ('gene1', 'anno2), ...]
-    product_relationships = set()
-    ec_relationships = set()
+    :param gbk: path to the GenBank file
+    :param load_ec: whether to extract EC numbers
+    :returns: generator of (locus_tags: [str], annotations: {(name, anno_type)}, links: {(locus_tag, name)}), one per scaffold
+    """
+    from Bio import SeqIO
 
     # regex_split_gene_code = re.compile('^(.+)(_[0-9]+)$')
     # disallowed_types = ['CDS', 'misc_RNA', 'rRNA', 'repeat_region', 'tRNA', 'tmRNA']
 
-    with open(genomecontent.genome.cds_gbk(relative=False), "r") as input_handle:
+    with open(gbk, "r") as input_handle:
         for scf in SeqIO.parse(input_handle, "genbank"):
+            locus_tags = []
+            annotations = set()  # {('anno1', 'GC'), ('anno2', 'GP'), ...}
+            links = set()  # {('gene1', 'anno1), ('gene1', 'anno2), ...}
             for f in scf.features:
                 if 'locus_tag' in f.qualifiers:
                     # if f.type not in disallowed_types and 'locus_tag' in f.qualifiers:
                     assert len(f.qualifiers["locus_tag"]) == 1
                     locus_tag = f.qualifiers["locus_tag"][0]
-                    gene_id_set.add(locus_tag)
+                    locus_tags.append(locus_tag)
                     if 'pseudo' in f.qualifiers:
-                        gene_code_set.add('pseudo-gene')
-                        gene_code_relationships.add((locus_tag, 'pseudo-gene'))
+                        annotations.add(('pseudo-gene', 'GC'))
+                        links.add((locus_tag, 'pseudo-gene'))
                     else:
                         if 'gene' in f.qualifiers:
                             # gene_code = regex_split_gene_code.match(f.qualifiers['gene'])
                             # if gene_code:
                             #     d['gene'] = gene_code.groups()[0]
                             for ge in f.qualifiers['gene']:
-                                gene_code_set.add(ge)
-                                gene_code_relationships.add((locus_tag, ge))
+                                annotations.add((ge, 'GC'))
+                                links.add((locus_tag, ge))
                         if 'product' in f.qualifiers:
                             for pr in f.qualifiers['product']:
                                 pr = pr.replace(',', '-').replace(';', '-')
-                                product_set.add(pr)
-                                product_relationships.add((locus_tag, pr))
-                        if 'EC_number' in f.qualifiers:
+                                annotations.add((pr, 'GP'))
+                                links.add((locus_tag, pr))
+                        if load_ec and 'EC_number' in f.qualifiers:
                             for ec in f.qualifiers['EC_number']:
-                                ec_set.add('EC:' + ec)
-                                ec_relationships.add((locus_tag, 'EC:' + ec))
-
-    # create Gene objects
-    Gene.objects.bulk_create([Gene(identifier=identifier, genomecontent=genomecontent) for identifier in gene_id_set])
-
-    # Create Annotation-Objects
-    add_many_annotations(model=genomecontent, anno_type='GC', annos_to_add=gene_code_set)
-    add_many_annotations(model=genomecontent, anno_type='GP', annos_to_add=product_set)
-    if settings.GENBANK_LOAD_EC:
-        add_many_annotations(model=genomecontent, anno_type='EC', annos_to_add=ec_set)
-
-    # Create many-to-many relationships
-    # Gene-Codes
-    objects = [Gene.annotations.through(gene_id=gene, annotation_id=anno) for gene, anno in
-               gene_code_relationships]
-    Gene.annotations.through.objects.bulk_create(objects)
-    # Product
-    objects = [Gene.annotations.through(gene_id=gene, annotation_id=anno) for gene, anno in
-               product_relationships]
-    Gene.annotations.through.objects.bulk_create(objects,
-                                                 ignore_conflicts=True)  # ignore_conflicts if gene code and product are the same
-    # EC
-    if settings.GENBANK_LOAD_EC:
-        objects = [Gene.annotations.through(gene_id=gene, annotation_id=anno) for gene, anno in ec_relationships]
-        Gene.annotations.through.objects.bulk_create(objects)
+                                annotations.add(('EC:' + ec, 'EC'))
+                                links.add((locus_tag, 'EC:' + ec))
+            # gene and CDS features share the locus_tag
+            yield list(dict.fromkeys(locus_tags)), annotations, links
+
+
+def copy_genes(genomecontent: GenomeContent, locus_tags: [str]) -> None:
+    """
+    Create the genes of a genome. Locus tags must be unique across all genomes: if one already belongs to another
+    genome, an AssertionError is raised (the gene would silently be skipped otherwise).
+    """
+    from .Gene import Gene
+    locus_tags = list(dict.fromkeys(locus_tags))
+    n_inserted = copy_merge(
+        table=Gene._meta.db_table,
+        columns=['identifier', 'genomecontent_id'],
+        rows=((locus_tag, genomecontent.identifier) for locus_tag in locus_tags)
+    )
+    if n_inserted < len(locus_tags):
+        taken = Gene.objects.filter(identifier__in=locus_tags).exclude(genomecontent=genomecontent) \
+            .values_list('identifier', 'genomecontent_id')
+        assert not taken, f'{genomecontent}: {len(taken)} locus tags already belong to other genomes, ' \
+                          f'e.g. {", ".join(f"{locus_tag} ({genome})" for locus_tag, genome in taken[:5])}'
+
+
+def copy_annotations(annotations: {(str, str)}, links: {(str, str)}) -> None:
+    """
+    Create missing Annotation objects (without description) and the Gene-Annotation links.
+
+    The Genome-Annotation links are derived from these, see GenomeContentAnnotation.objects.refresh.
+
+    :param annotations: {(name, anno_type), ...}
+    :param links: {(locus_tag, name), ...}
+    """
+    from .Gene import Gene
+    copy_merge(
+        table=Annotation._meta.db_table,
+        columns=['name', 'description', 'anno_type'],
+        rows=((name, '', anno_type) for name, anno_type in annotations)
+    )
+    copy_merge(
+        table=Gene.annotations.through._meta.db_table,
+        columns=['gene_id', 'annotation_id'],
+        rows=links
+    )
+
+
+def update_missing_descriptions(anno_types: [str] = None) -> None:
+    """
+    Fill in the descriptions of annotations that were created without one.
+
+    The loaders create annotations without descriptions, call this once at the end of an import run.
+
+    :param anno_types: default: all anno_types in annotations.json
+    """
+    if anno_types is None:
+        anno_types = annotation_types.keys()
+    for anno_type in anno_types:
+        try:
+            adf = AnnotationDescriptionFile(anno_type=anno_type, create_cdb=False)
+            adf.update_descriptions(reload=False)
+        except FileNotFoundError:
+            pass
+
+
+def parse_genome(gbk: str, base_path: str, custom_annotations: [dict], load_ec: bool, with_gbk: bool = True) -> dict:
+    """
+    Parse the files of a genome. Does not touch the database, i.e. can be run in a worker process.
+
+    :param gbk: absolute path to the gbk file
+    :param base_path: absolute path to the genome folder
+    :param custom_annotations: custom files to parse
+    :param load_ec: whether to extract EC numbers from the gbk file
+    :param with_gbk: whether to parse the gbk file
+    :returns: {'gbk': (locus_tags, annotations, links) or None, 'custom_files': {file: output of parse_custom_file}}
+    """
+    parsed = {'gbk': None, 'custom_files': {}}
+
+    if with_gbk:
+        locus_tags, annotations, links = [], set(), set()
+        for scf_locus_tags, scf_annotations, scf_links in parse_gbk(gbk, load_ec=load_ec):
+            locus_tags.extend(scf_locus_tags)
+            annotations.update(scf_annotations)
+            links.update(scf_links)
+        parsed['gbk'] = (locus_tags, annotations, links)
+
+    for file_dict in custom_annotations:
+        parsed['custom_files'][file_dict['file']] = parse_custom_file(base_path, file_dict)
+
+    return parsed
+
+
+def gbk_links(annotations: {(str, str)}, links: {(str, str)}) -> {(str, str, str)}:
+    """ Convert the output of parse_gbk to {(locus_tag, annotation name, anno_type), ...} """
+    anno_types = dict(annotations)
+    return {(locus_tag, name, anno_types[name]) for locus_tag, name in links}
+
+
+def load_genome(genomecontent: GenomeContent, parsed: dict = None):
+    """
+    :param parsed: pre-parsed files (output of parse_genome), parse the files if None
+    """
+    print("       (re)loading gbk")
+    genomecontent.wipe_data()
+
+    if parsed and parsed['gbk'] is not None:
+        batches = [parsed['gbk']]
+    else:
+        batches = parse_gbk(genomecontent.genome.cds_gbk(relative=False), load_ec=settings.GENBANK_LOAD_EC)
+
+    # stream scaffold by scaffold into PostgreSQL (COPY) -> much faster than bulk_create, bounded memory
+    n_genes = 0
+    with open_link_snapshot(genomecontent, 'gbk') as snapshot:
+        for locus_tags, annotations, links in batches:
+            copy_genes(genomecontent, locus_tags)
+            copy_annotations(annotations, links)
+            snapshot.writerows(gbk_links(annotations, links))
+            n_genes += len(locus_tags)
 
     # Save file size of imported gbk.
-    genomecontent.n_genes = len(gene_id_set)
+    genomecontent.n_genes = n_genes
     genomecontent._gbk_file_size = os.stat(genomecontent.genome.cds_gbk(relative=False)).st_size
 
     # load custom files:
     for file_dict in genomecontent.genome.custom_annotations:
         if file_dict not in genomecontent.custom_files:
-            load_custom_file(genomecontent, file_dict)
+            rows = parsed['custom_files'].get(file_dict['file']) if parsed else None
+            load_custom_file(genomecontent, file_dict, rows=rows)
+
+    # index sequence files for random access
+    create_locus_index(genomecontent)
+
+
+def update_gbk(genomecontent: GenomeContent, parsed: dict = None):
+    """
+    Apply a changed gbk file: only genes and Gene-Annotation links that changed since the last import are written.
+
+    :param parsed: pre-parsed files (output of parse_genome), parse the gbk file if None
+    """
+    print("       updating gbk")
+    if parsed and parsed['gbk'] is not None:
+        locus_tags, annotations, links = parsed['gbk']
+    else:
+        genome = genomecontent.genome
+        locus_tags, annotations, links = parse_genome(
+            gbk=genome.cds_gbk(relative=False), base_path=genome.base_path(relative=False),
+            custom_annotations=[], load_ec=settings.GENBANK_LOAD_EC
+        )['gbk']
+
+    old_genes = set(genomecontent.gene_set.values_list('identifier', flat=True))
+    new_genes = set(locus_tags)
+    removed_genes = old_genes - new_genes
+    genomecontent.gene_set.filter(identifier__in=removed_genes).delete()
+    copy_genes(genomecontent, [locus_tag for locus_tag in dict.fromkeys(locus_tags) if locus_tag not in old_genes])
+
+    # the links of removed genes were deleted by the cascade: the snapshots of the custom files must forget them
+    if removed_genes:
+        for source in genomecontent.link_sources()[1:]:
+            snapshot_links = read_link_snapshot(genomecontent, source)
+            if any(link[0] in removed_genes for link in snapshot_links):
+                write_link_snapshot(genomecontent, source, {link for link in snapshot_links if link[0] not in removed_genes})
+
+    apply_links(genomecontent, 'gbk', gbk_links(annotations, links))
+
+    genomecontent.n_genes = len(new_genes)
+    genomecontent._gbk_file_size = os.stat(genomecontent.genome.cds_gbk(relative=False)).st_size
+
+
+def create_locus_index(genomecontent: GenomeContent) -> None:
+    """
+    Create random-access indices for the gbk, faa and ffn files of a genome. See lib/sequence_index.
+
+    Without these, every gene lookup has to parse the whole gbk file.
+    """
+    from lib.sequence_index import GbkIndex, FastaIndex
+
+    genome = genomecontent.genome
+
+    GbkIndex.create(gbk=genome.cds_gbk(relative=False), index=genomecontent.locus_index_gbk(relative=False))
+    FastaIndex.create(fasta=genome.cds_faa(relative=False), index=genomecontent.locus_index_faa(relative=False))
+    if genome.cds_ffn(relative=False):
+        FastaIndex.create(fasta=genome.cds_ffn(relative=False), index=genomecontent.locus_index_ffn(relative=False))
 
 
 def create_blast_dbs(genomecontent: GenomeContent, reload=False):
@@ -212,98 +677,64 @@ def create_blast_dbs(genomecontent: GenomeContent, reload=False):
         blast.mkblastdb(file=blast_db_location, dbtype=dbtype, overwrite=True)
 
 
-def load_custom_file(genomecontent: GenomeContent, file_dict):
+def load_custom_file(genomecontent: GenomeContent, file_dict, rows: dict = None):
+    """
+    Load a new or changed custom file. Only the Gene-Annotation links that changed are written.
+
+    :param rows: pre-parsed output of parse_custom_file (e.g. from a worker process), parse the file if None
+    """
     print("       add new file:", file_dict)
-    if file_dict['type'].startswith('eggnog'):
-        load_eggnog_file(genomecontent, file_dict)
-    else:
-        load_regular_file(genomecontent, file_dict)
+    if rows is None:
+        rows = parse_custom_file(genomecontent.genome.base_path(relative=False), file_dict)
+
+    links = {
+        (locus_tag, name, anno_type)
+        for anno_type, (all_annotations, annotations_relationships) in rows.items()
+        for locus_tag, name in annotations_relationships
+    }
+    apply_links(genomecontent, custom_source(file_dict), links)
 
+    genomecontent.custom_files = [f for f in genomecontent.custom_files if f['file'] != file_dict['file']]
     genomecontent.custom_files.append(file_dict)
 
 
-def load_eggnog_file(genomecontent: GenomeContent, file_dict):
-    supported_versions = ['eggnog', 'eggnog-2.1.2']
-    assert file_dict['type'] in supported_versions
-    from .Gene import Gene
+def unload_custom_file(genomecontent: GenomeContent, file_dict):
+    """ Remove the Gene-Annotation links that only this custom file provided. """
+    print("       remove file:", file_dict)
+    source = custom_source(file_dict)
+    apply_links(genomecontent, source, set())
+    remove_link_snapshot(genomecontent, source)
 
-    go = (set(), set(), annotation_types['GO'])  # gene ontology
-    ec = (set(), set(), annotation_types['EC'])  # enzyme commission
-    kg = (set(), set(), annotation_types['KG'])  # kegg gene
-    kr = (set(), set(), annotation_types['KR'])  # kegg reaction
-    ep = (set(), set(), annotation_types['EP'])  # eggnog protein name
-    eo = (set(), set(), annotation_types['EO'])  # eggnog ortholog
-    ed = (set(), set(), annotation_types['ED'])  # eggnog description
-
-    def add_anno(annotations: list, all_annotations, annotations_relationships, anno_type: AnnotationType):
-        for annotation in annotations:
-            assert anno_type.regex.match(
-                annotation) is not None, f"Error: Annotation '{annotation}' does not match regex '{anno_type.regex.pattern}'!"
-            all_annotations.update(annotations)
-            annotations_relationships.update([(locus_tag, anno) for anno in annotations])
-        pass
-
-    if file_dict['type'] == 'eggnog':
-        expected_line_length = 22
-
-        def line_parser(line: [str]):
-            if line[6] != '':
-                add_anno(line[6].split(','), *go)
-            if line[7] != '':
-                add_anno([f'EC:{l}' for l in line[7].split(',')], *ec)
-            if line[8] != '':
-                add_anno([l[3:] for l in line[8].split(',')], *kg)
-            if line[11] != '':
-                add_anno(line[11].split(','), *kr)
-            if line[5] != '':
-                add_anno([f'EP:{line[5]}'], *ep)
-            if line[18] != '':
-                add_anno([f'EO:{line[18].split("@", maxsplit=1)[0]}'], *eo)
-            if line[21] != '':
-                add_anno([f"ED:{line[21].split(',', maxsplit=1)[0].split(';', maxsplit=1)[0]}"], *ed)
-    elif file_dict['type'] == 'eggnog-2.1.2':
-        expected_line_length = 21
-
-        def line_parser(line: [str]):
-            if line[9] != '-':
-                add_anno(line[9].split(','), *go)
-            if line[10] != '-':
-                add_anno([f'EC:{l}' for l in line[10].split(',')], *ec)
-            if line[11] != '-':
-                add_anno([l[3:] for l in line[11].split(',')], *kg)
-            if line[14] != '-':
-                add_anno(line[14].split(','), *kr)
-            if line[8] != '-':
-                add_anno([f'EP:{line[8]}'], *ep)
-            if line[4] != '-':
-                add_anno([f'EO:{line[4].split("@", maxsplit=1)[0]}'], *eo)
-            if line[7] != '-':
-                add_anno([f"ED:{line[7].split(',', maxsplit=1)[0].split(';', maxsplit=1)[0]}"], *ed)
-    else:
-        raise AssertionError(
-            f'Error parsing file. Eggnog version not supported: {genomecontent} {file_dict} {supported_versions=}')
+    genomecontent.custom_files = [f for f in genomecontent.custom_files if f != file_dict]
 
-    with open(F"{genomecontent.genome.base_path(relative=False)}/{file_dict['file']}") as f:
-        for line in f:
-            if line.startswith('#'): continue
-            line = line.rstrip('\n').split("\t")
-            assert len(
-                line) == expected_line_length, f'Error parsing file: {genomecontent} {file_dict} {len(line)=} {expected_line_length=} {line=}'
 
-            locus_tag = line[0].rsplit('|', maxsplit=1)[-1]
-            line_parser(line)
+def parse_custom_file(base_path: str, file_dict) -> {str: ({str}, {(str, str)})}:
+    """
+    Parse a custom annotation file. Does not touch the database, i.e. can be run in a worker process.
 
-    # Create Annotation-Objects and many-to-many relationships
-    for all_annotations, annotations_relationships, anno_type in (go, ec, kg, kr, ep, eo, ed):
-        add_many_annotations(model=genomecontent, anno_type=anno_type.anno_type, annos_to_add=all_annotations)
-        objects = [Gene.annotations.through(gene_id=gene, annotation_id=anno) for gene, anno in
-                   annotations_relationships]
-        Gene.annotations.through.objects.bulk_create(objects, ignore_conflicts=True)
+    :param base_path: absolute path to the genome folder
+    :param file_dict: {"date": "2016-02-29", "file": "FAM19038.ko", "type": "KG"}
+    :returns: {anno_type: ({'anno1', 'anno2', ...}, {('gene1', 'anno1), ('gene1', 'anno2'), ...})}
+    """
+    if file_dict['type'].startswith('eggnog'):
+        return parse_eggnog_file(base_path, file_dict)
+    else:
+        return parse_regular_file(base_path, file_dict)
 
 
-def load_regular_file(genomecontent: GenomeContent, file_dict):
-    from .Gene import Gene
+def parse_eggnog_file(base_path: str, file_dict) -> {str: ({str}, {(str, str)})}:
+    from lib.eggnog import parse_eggnog, EGGNOG_VERSIONS, EGGNOG_ANNO_TYPES
+    assert file_dict['type'] in EGGNOG_VERSIONS, \
+        f'Error parsing file. Eggnog version not supported: {base_path} {file_dict} {list(EGGNOG_VERSIONS)=}'
+
+    return parse_eggnog(
+        file=f"{base_path}/{file_dict['file']}",
+        version=file_dict['type'],
+        regexes={anno_type: annotation_types[anno_type].regex for anno_type in EGGNOG_ANNO_TYPES}
+    )
+
 
+def parse_regular_file(base_path: str, file_dict) -> {str: ({str}, {(str, str)})}:
     anno_type = file_dict['type']
     assert anno_type in annotation_types, \
         f'Error in annotation file:{file_dict}\nType {anno_type} is not defined in {settings.FOLDER_STRUCTURE}/annotations.json.'
@@ -312,7 +743,7 @@ def load_regular_file(genomecontent: GenomeContent, file_dict):
     all_annotations = set()  # {'anno1', 'anno2', ...}
     annotations_relationships = set()  # {('gene1', 'anno1), ('gene1', 'anno2'), ...}
 
-    with open(F"{genomecontent.genome.base_path(relative=False)}/{file_dict['file']}") as f:
+    with open(F"{base_path}/{file_dict['file']}") as f:
         line = f.readline().strip()
         while line:
             line = line.split("\t")
@@ -328,30 +759,4 @@ def load_regular_file(genomecontent: GenomeContent, file_dict):
                     f"'Error in file{file_dict['file']}': all lines must contain exactly one tab character. {line=}")
             line = f.readline().strip()
 
-    # Create Annotation-Objects and many-to-many relationships
-    add_many_annotations(model=genomecontent, anno_type=anno_type, annos_to_add=all_annotations)
-    objects = [Gene.annotations.through(gene_id=gene, annotation_id=anno) for gene, anno in
-               annotations_relationships]
-    Gene.annotations.through.objects.bulk_create(objects, ignore_conflicts=True)
-
-
-def add_many_annotations(model, anno_type: str, annos_to_add: set):
-    # static method because it's also used elsewhere
-    assert anno_type in annotation_types
-
-    # create missing annotation objects (without description)
-    Annotation.objects.bulk_create([
-        Annotation(name=name, anno_type=anno_type)
-        for name in annos_to_add], ignore_conflicts=True)
-
-    # add new annotations to existing annotations
-    map_has = set(model.annotations.all().values_list('name', flat=True))
-    map_should_have = map_has.union(annos_to_add)
-    model.annotations.set(Annotation.objects.filter(name__in=map_should_have))
-
-    # update descriptions where missing
-    try:
-        adf = AnnotationDescriptionFile(anno_type=anno_type, create_cdb=False)
-        adf.update_descriptions(reload=False)
-    except FileNotFoundError:
-        pass
+    return {anno_type: (all_annotations, annotations_relationships)}
@@ -0,0 +1,87 @@
+from django.db import models, connection, transaction
+from .Annotation import Annotation
+
+
+class GenomeContentAnnotationManager(models.Manager):
+    def refresh(self, genomecontent=None, anno_types: [str] = None) -> None:
+        """
+        Recompute the Genome-Annotation links from the Gene-Annotation links. Only rows whose count changed are
+        written, links that are no longer backed by a gene are removed.
+
+        :param genomecontent: only refresh this genome, default: all genomes
+        :param anno_types: only refresh annotations of these anno_types, default: all anno_types
+        """
+        from .Gene import Gene
+        from .helpers.presence_matrix import mark_dirty, invalidate
+        table = self.model._meta.db_table
+        gene_anno_table = Gene.annotations.through._meta.db_table
+
+        conditions, params = [], []
+        if genomecontent is not None:
+            conditions.append('gene.genomecontent_id = %s')
+            params.append(genomecontent.identifier)
+        if anno_types is not None:
+            conditions.append('anno.anno_type = ANY(%s)')
+            params.append(list(anno_types))
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+
+        stale_conditions, stale_params = [], []
+        if genomecontent is not None:
+            stale_conditions.append('r.genomecontent_id = %s')
+            stale_params.append(genomecontent.identifier)
+        if anno_types is not None:
+            stale_conditions.append(
+                f'r.annotation_id IN (SELECT name FROM "{Annotation._meta.db_table}" WHERE anno_type = ANY(%s))')
+            stale_params.append(list(anno_types))
+        stale_where = ''.join(f'{condition} AND ' for condition in stale_conditions)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                WITH counts AS (
+                    SELECT gene.genomecontent_id, gene_anno.annotation_id, COUNT(*) AS n_genes
+                    FROM "{gene_anno_table}" gene_anno
+                    JOIN "{Gene._meta.db_table}" gene ON gene.identifier = gene_anno.gene_id
+                    JOIN "{Annotation._meta.db_table}" anno ON anno.name = gene_anno.annotation_id
+                    {where}
+                    GROUP BY gene.genomecontent_id, gene_anno.annotation_id
+                ), upserted AS (
+                    INSERT INTO "{table}" (genomecontent_id, annotation_id, n_genes)
+                    SELECT genomecontent_id, annotation_id, n_genes FROM counts
+                    ON CONFLICT (genomecontent_id, annotation_id) DO UPDATE SET n_genes = EXCLUDED.n_genes
+                    WHERE "{table}".n_genes <> EXCLUDED.n_genes
+                )
+                DELETE FROM "{table}" r
+                WHERE {stale_where}NOT EXISTS (
+                    SELECT 1 FROM counts c
+                    WHERE c.genomecontent_id = r.genomecontent_id AND c.annotation_id = r.annotation_id
+                )
+            ''', params + stale_params)
+
+        # keep the presence matrices up to date
+        if genomecontent is not None:
+            identifier = genomecontent.identifier
+            transaction.on_commit(lambda: mark_dirty([identifier]))
+        else:
+            transaction.on_commit(lambda: invalidate(anno_types))
+
+
+class GenomeContentAnnotation(models.Model):
+    """
+    Genome-Annotation links, derived from the Gene-Annotation links. Do not write to this table directly, call
+    GenomeContentAnnotation.objects.refresh after changing Gene-Annotation links.
+
+        :param n_genes: number of genes of the genome that have the annotation (copy number)
+    """
+
+    objects = GenomeContentAnnotationManager()
+
+    genomecontent = models.ForeignKey('website.GenomeContent', on_delete=models.CASCADE)
+    annotation = models.ForeignKey(Annotation, on_delete=models.CASCADE)
+    n_genes = models.IntegerField('Number of genes', default=1)
+
+    class Meta:
+        db_table = 'website_genomecontent_annotations'
+        unique_together = ('genomecontent', 'annotation')
+
+    def __str__(self):
+        return f'<GenomeContentAnnotation {self.genomecontent_id}:{self.annotation_id} ({self.n_genes})>'
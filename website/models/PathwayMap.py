@@ -1,10 +1,14 @@
 import os
 import json
-import bs4
+from hashlib import sha1
+from functools import partial
 from django.utils.text import slugify
-from django.db import models
-from website.models.Annotation import Annotation
-from website.models.GenomeContent import add_many_annotations
+from django.db import models, transaction
+from website.models.Annotation import Annotation, annotation_types
+from website.models.GenomeContent import update_missing_descriptions
+from website.models.helpers import pathway_incidence, pathway_assets
+from website.models.helpers.bulk_copy import copy_merge
+from lib.pathway_parser import parse_map, parse_maps
 from OpenGenomeBrowser import settings
 
 
@@ -21,6 +25,8 @@ class PathwayMap(models.Model):
 
     filename = models.CharField(max_length=200, unique=True)
 
+    source_sha1 = models.CharField(max_length=40, default='', blank=True)  # of the imported svg, see reload_maps
+
     annotations = models.ManyToManyField(Annotation)
 
     def __str__(self):
@@ -28,8 +34,9 @@ class PathwayMap(models.Model):
 
     @property
     def svg(self) -> str:
-        with open(f'{settings.PATHWAY_MAPS}/{self.filename}') as f:
-            return f.read()
+        """ :returns: minified svg, see pathway_assets """
+        return pathway_assets.read_svg(self.slug)
+
     @property
     def html(self):
         return f'<span class="ogb-tag pathway" title="{self.title}">{self.slug}</span>'
@@ -44,68 +51,96 @@ class PathwayMap(models.Model):
             return type_dict
 
     @staticmethod
-    def reload_maps():
-        from progressbar import progressbar  # pip install progressbar2
+    def reload_maps(incremental: bool = False, workers: int = None):
+        """
+        Import all maps in settings.PATHWAY_MAPS.
+
+        :param incremental: only reload maps whose svg changed (sha1, see source_sha1) and remove missing maps,
+                            otherwise wipe all maps first
+        :param workers: number of processes that parse the svgs, default: os.cpu_count()
+        """
+        type_dict = PathwayMap._get_type_dict()
+        files = sorted(file for file in os.listdir(settings.PATHWAY_MAPS) if file.endswith('.svg'))
+
+        if incremental:
+            imported = {filename: (slug, source_sha1) for filename, slug, source_sha1 in
+                        PathwayMap.objects.values_list('filename', 'slug', 'source_sha1')}
+            existing = {filename: slug for filename, (slug, _) in imported.items()}
+            removed = [slug for filename, slug in existing.items() if filename not in files]
+            changed = []
+            for file in files:
+                with open(f'{settings.PATHWAY_MAPS}/{file}', 'rb') as f:
+                    if file not in imported or imported[file][1] != sha1(f.read()).hexdigest():
+                        changed.append(file)
+        else:
+            PathwayMap.wipe_maps()
+            existing, removed, changed = {}, [], files
 
-        print('Reloading svg maps using ', end='')
+        print(f'Pathway maps: {len(changed)} to load, {len(removed)} to remove, {len(files) - len(changed)} unchanged')
+        if len(changed) == 0 and len(removed) == 0:
+            return
 
-        # remove all maps
-        PathwayMap.wipe_maps()
+        parsed_maps = parse_maps(
+            [f'{settings.PATHWAY_MAPS}/{file}' for file in changed], minify=True, workers=workers
+        )
+        with transaction.atomic():
+            PathwayMap.objects.filter(slug__in=removed + [existing[file] for file in changed if file in existing]).delete()
+            slugs = PathwayMap.save_maps(parsed_maps, type_dict)
 
-        type_dict = PathwayMap._get_type_dict()
+        for slug in removed:
+            pathway_assets.remove(slug)
+        print(f'Loaded {len(slugs)} maps')
 
-        # load maps, their names and their annotations
-        maps = [file for file in os.listdir(settings.PATHWAY_MAPS) if file.endswith('.svg')]
-        for file in progressbar(maps, max_value=len(maps), redirect_stdout=True):
-            print(f'Loading {file}')
-            PathwayMap.load_map(
-                filename=file,
-                type_dict=type_dict
-            )
+        update_missing_descriptions()
+        pathway_incidence.invalidate()
 
     @staticmethod
-    def load_map(filename: str, type_dict: dict):
-        slug = slugify(filename.rstrip('.svg'))
-        path = f'{settings.PATHWAY_MAPS}/{filename}'
-
-        soup = bs4.BeautifulSoup(open(path).read(), 'xml')
-        title = soup.svg['title']
-
-        annotations = []
-        for shape in soup.select('[data-annotations]'):
-            try:
-                shape_annotations = json.loads(shape['data-annotations'])
-            except Exception as e:
-                print(f'Error in map: {filename} - shape: {shape}.')
-                raise e
-            assert type(shape_annotations) is list, f'Map {filename} contains a shape with an invalid shape: {shape}'
-            annotations.extend(shape_annotations)
-
-        anno_objects = {anno_type: set() for anno_type in type_dict.values() if anno_type != 'ignore'}
-
-        for annotation in annotations:
-            assert annotation['type'] in type_dict, \
-                f'Map {filename} contains an annotation ({annotation}) that has an unknown type {annotation["type"]}. \
-                Please add it to type_dictionary.json.'
-            anno_type = type_dict[annotation['type']]
-            if anno_type == 'ignore':
-                continue
-            anno_objects[anno_type].add(annotation['name'])
-
-        map = PathwayMap(
-            slug=slug,
-            title=title,
-            filename=filename
+    def save_maps(parsed_maps, type_dict: dict) -> [str]:
+        """
+        Create maps and their annotations, with one bulk statement for all annotations and one for all links.
+
+        :param parsed_maps: iterable of results of lib.pathway_parser.parse_map with minify=True
+        :param type_dict: {type in svg: anno_type or 'ignore'}
+        :returns: slugs of the new maps
+        """
+        maps, annotations, links = [], set(), set()
+        for parsed in parsed_maps:
+            filename = parsed['filename']
+            slug = slugify(filename.rstrip('.svg'))
+            for shape in parsed['shapes']:
+                for annotation in shape:
+                    assert annotation['type'] in type_dict, \
+                        f'Map {filename} contains an annotation ({annotation}) that has an unknown type {annotation["type"]}. \
+                        Please add it to type_dictionary.json.'
+                    anno_type = type_dict[annotation['type']]
+                    if anno_type == 'ignore':
+                        continue
+                    assert anno_type in annotation_types, f'type_dictionary.json maps to unknown anno_type: {anno_type}'
+                    annotations.add((annotation['name'], '', anno_type))
+                    links.add((slug, annotation['name']))
+
+            maps.append(PathwayMap(slug=slug, title=parsed['title'], filename=filename, source_sha1=parsed['sha1']))
+            # minified, precompressed svg, published when the transaction commits
+            pathway_assets.build(slug=slug, parsed=parsed)
+            transaction.on_commit(partial(pathway_assets.publish, slug))
+
+        PathwayMap.objects.bulk_create(maps)
+        copy_merge(table=Annotation._meta.db_table, columns=['name', 'description', 'anno_type'], rows=annotations)
+        field = PathwayMap._meta.get_field('annotations')
+        copy_merge(
+            table=field.remote_field.through._meta.db_table,
+            columns=[field.m2m_column_name(), field.m2m_reverse_name()],
+            rows=links
         )
-        map.save()
+        return [map.slug for map in maps]
 
-        for anno_type, annotations in anno_objects.items():
-            if len(annotations) == 0:
-                continue
-            add_many_annotations(model=map, anno_type=anno_type, annos_to_add=anno_objects[anno_type])
-
-        return soup, annotations
+    @staticmethod
+    def load_map(filename: str, type_dict: dict) -> str:
+        """ Import a single map. :returns: its slug """
+        return PathwayMap.save_maps([parse_map(f'{settings.PATHWAY_MAPS}/{filename}', minify=True)], type_dict)[0]
 
     @staticmethod
     def wipe_maps():
         PathwayMap.objects.all().delete()
+        pathway_incidence.invalidate()
+        pathway_assets.wipe()
@@ -2,7 +2,7 @@ from .Tag import Tag, TagDescriptions
 from .TaxID import TaxID
 from .Organism import Organism
 from .Genome import Genome
-from .GenomeContent import GenomeContent, GenomeSimilarity
+from .GenomeContent import GenomeContent, GenomeSimilarity, GenomeContentAnnotation
 from .Annotation import Annotation, AnnotationType, annotation_types
 from .Gene import Gene
 from .PathwayMap import PathwayMap
@@ -0,0 +1,129 @@
+from io import StringIO
+from django.db import connection
+
+
+def _escape(value) -> str:
+    """ Escape a value for PostgreSQL's COPY text format. """
+    if value is None:
+        return '\\N'
+    return str(value) \
+        .replace('\\', '\\\\') \
+        .replace('\t', '\\t') \
+        .replace('\n', '\\n') \
+        .replace('\r', '\\r')
+
+
+def _to_buffer(rows) -> (StringIO, int):
+    buffer = StringIO()
+    n_rows = 0
+    for row in rows:
+        buffer.write('\t'.join(_escape(value) for value in row))
+        buffer.write('\n')
+        n_rows += 1
+    buffer.seek(0)
+    return buffer, n_rows
+
+
+def _staging_table(cursor, table: str) -> str:
+    """
+    Empty temporary table with the columns of table, to COPY rows into.
+
+    It is created once per database connection (i.e. once per import) and emptied before each use: creating and
+    dropping it for every batch of rows would add catalog churn to each of them.
+
+    :returns: name of the staging table
+    """
+    staging = f'_staging_{table}'
+    cursor.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS "{staging}" AS SELECT * FROM "{table}" WITH NO DATA')
+    cursor.execute(f'TRUNCATE "{staging}"')
+    return staging
+
+
+def copy_merge(table: str, columns: [str], rows) -> int:
+    """
+    Insert many rows into a table using COPY FROM STDIN.
+
+    The rows are copied into a temporary staging table first, then merged into the target table with
+    INSERT ... ON CONFLICT DO NOTHING, i.e. rows that already exist are skipped (like bulk_create(ignore_conflicts=True),
+    but without the ORM overhead).
+
+    :param table: name of the target table, e.g. Gene._meta.db_table
+    :param columns: columns to fill, in the same order as the values in each row
+    :param rows: iterable of tuples
+    :returns: number of rows that were inserted into the target table
+    """
+    buffer, n_rows = _to_buffer(rows)
+    if n_rows == 0:
+        return 0
+
+    column_list = ', '.join(f'"{c}"' for c in columns)
+
+    with connection.cursor() as cursor:
+        staging = _staging_table(cursor, table)
+        cursor.copy_expert(f'COPY "{staging}" ({column_list}) FROM STDIN', buffer)
+        cursor.execute(f'INSERT INTO "{table}" ({column_list}) SELECT {column_list} FROM "{staging}" ON CONFLICT DO NOTHING')
+        n_inserted = cursor.rowcount
+
+    return n_inserted
+
+
+def copy_delete(table: str, columns: [str], rows) -> int:
+    """
+    Delete many rows from a table: the rows are copied into a temporary staging table, then deleted with DELETE ... USING.
+
+    :param table: name of the target table, e.g. Gene.annotations.through._meta.db_table
+    :param columns: columns that identify a row, in the same order as the values in each row
+    :param rows: iterable of tuples
+    :returns: number of rows that were deleted from the target table
+    """
+    buffer, n_rows = _to_buffer(rows)
+    if n_rows == 0:
+        return 0
+
+    column_list = ', '.join(f'"{c}"' for c in columns)
+    condition = ' AND '.join(f't."{c}" = s."{c}"' for c in columns)
+
+    with connection.cursor() as cursor:
+        staging = _staging_table(cursor, table)
+        cursor.copy_expert(f'COPY "{staging}" ({column_list}) FROM STDIN', buffer)
+        cursor.execute(f'DELETE FROM "{table}" t USING "{staging}" s WHERE {condition}')
+        n_deleted = cursor.rowcount
+
+    return n_deleted
+
+
+class _CopyStream:
+    """ File-like object that encodes rows for COPY FROM STDIN on the fly, so they never have to be held in memory. """
+
+    def __init__(self, rows):
+        self._lines = ('\t'.join(_escape(value) for value in row) + '\n' for row in rows)
+        self._buffer = ''
+
+    def read(self, size: int = -1) -> str:
+        chunks, n_chars = [self._buffer], len(self._buffer)
+        while size < 0 or n_chars < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            n_chars += len(line)
+        data = ''.join(chunks)
+        if size < 0:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def copy_stream(table: str, columns: [str], rows) -> None:
+    """
+    COPY rows into a table. Unlike copy_merge, the rows are streamed, i.e. memory usage is constant.
+    No conflict handling: use it to fill staging tables.
+
+    :param table: name of the target table
+    :param columns: columns to fill, in the same order as the values in each row
+    :param rows: iterable of tuples, e.g. a generator
+    """
+    column_list = ', '.join(f'"{c}"' for c in columns)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY "{table}" ({column_list}) FROM STDIN', _CopyStream(rows), size=1 << 16)
@@ -0,0 +1,149 @@
+import os
+import json
+import gzip
+import shutil
+import logging
+from hashlib import sha1
+
+from OpenGenomeBrowser.settings import PATHWAY_ASSETS_DIR, PATHWAY_MAPS
+from lib.ogb_cache.backends import file_lock
+from lib.pathway_parser import parse_map
+
+"""
+Pathway map assets, written when the maps are imported (see PathwayMap.reload_maps) and served by
+PathwayView.pathway_asset:
+
+PATHWAY_ASSETS_DIR/<slug>.svg(.gz|.br):    minified svg and precompressed variants
+PATHWAY_ASSETS_DIR/<slug>.meta.json:       etags of the assets, sha1 of the source svg, title
+
+The annotations of the shapes stay in the svg (data-annotations), PathwaySvgLib.js reads them from there.
+
+The assets are derived data: the database (PathwayMap.source_sha1) records which version of each svg was imported.
+Assets that are built during an import are written to PATHWAY_ASSETS_DIR/.staging/ and published when the
+transaction commits, see build and publish.
+
+Brotli variants require brotli: pip install brotli
+If the assets of a map are missing (e.g. PATHWAY_ASSETS_DIR was removed), they are rebuilt from the source svg.
+"""
+
+_STAGING_DIR = os.path.join(PATHWAY_ASSETS_DIR, '.staging')
+
+ASSETS = {'svg': 'image/svg+xml'}
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}  # preferred first
+
+
+def _path(slug: str, suffix: str, dir: str = PATHWAY_ASSETS_DIR) -> str:
+    return os.path.join(dir, f'{slug}.{suffix}')
+
+
+def _write(file: str, data: bytes) -> None:
+    with open(f'{file}.{os.getpid()}.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(f'{file}.{os.getpid()}.tmp', file)
+
+
+def _write_compressed(file: str, data: bytes) -> None:
+    _write(file, data)
+    _write(file + ENCODINGS['gzip'], gzip.compress(data, compresslevel=9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        return
+    _write(file + ENCODINGS['br'], brotli.compress(data, quality=11))
+
+
+def build(slug: str, parsed: dict) -> dict:
+    """
+    Write the assets of a pathway map to the staging directory, see publish.
+
+    :param slug: of the map
+    :param parsed: result of lib.pathway_parser.parse_map with minify=True
+    :returns: meta data: {slug, title, filename, source_sha1, etags: {svg}}
+    """
+    svg = parsed['svg']
+
+    os.makedirs(_STAGING_DIR, exist_ok=True)
+    _write_compressed(_path(slug, 'svg', _STAGING_DIR), svg)
+    meta = dict(
+        slug=slug, title=parsed['title'], filename=parsed['filename'], source_sha1=parsed['sha1'],
+        etags=dict(svg=sha1(svg).hexdigest()[:20])
+    )
+    _write(_path(slug, 'meta.json', _STAGING_DIR), json.dumps(meta).encode('utf-8'))
+    return meta
+
+
+def publish(slug: str) -> None:
+    """ Move the assets of a map from the staging directory into PATHWAY_ASSETS_DIR. meta.json is moved last. """
+    staged = sorted(
+        (file.name for file in os.scandir(_STAGING_DIR) if file.name.startswith(f'{slug}.')),
+        key=lambda name: name.endswith('.meta.json')
+    )
+    for file in os.scandir(PATHWAY_ASSETS_DIR):
+        if file.name.startswith(f'{slug}.') and file.is_file() and file.name not in staged:
+            os.remove(file.path)  # e.g. a variant of an encoding that is no longer available
+    for name in staged:
+        os.replace(os.path.join(_STAGING_DIR, name), os.path.join(PATHWAY_ASSETS_DIR, name))
+
+
+def meta(slug: str) -> dict:
+    """
+    :returns: meta data of the assets of a map, see build
+    :raises PathwayMap.DoesNotExist: if the map does not exist
+    """
+    try:
+        with open(_path(slug, 'meta.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+
+    from website.models import PathwayMap
+    filename, imported_sha1 = PathwayMap.objects.values_list('filename', 'source_sha1').get(slug=slug)
+    os.makedirs(PATHWAY_ASSETS_DIR, exist_ok=True)
+    with file_lock(os.path.join(PATHWAY_ASSETS_DIR, f'.{slug}.lock')):
+        if not os.path.isfile(_path(slug, 'meta.json')):
+            parsed = parse_map(os.path.join(PATHWAY_MAPS, filename), minify=True)
+            if parsed['sha1'] != imported_sha1:
+                logging.warning(f'Pathway map {filename} changed since it was imported. '
+                                f'Its annotations are outdated until the maps are imported again.')
+            meta = build(slug, parsed)
+            publish(slug)
+            return meta
+    with open(_path(slug, 'meta.json')) as f:
+        return json.load(f)
+
+
+def url(slug: str, asset: str = 'svg') -> str:
+    """ :returns: versioned url of the asset, can be cached forever """
+    from django.urls import reverse
+    return f"{reverse('website:pathway-asset', args=[slug, asset])}?v={meta(slug)['etags'][asset]}"
+
+
+def file(slug: str, asset: str, accept_encoding: str) -> (str, str):
+    """
+    :param asset: 'svg'
+    :param accept_encoding: Accept-Encoding header of the request
+    :returns: path of the best variant, its content encoding (None: not compressed)
+    """
+    assert asset in ASSETS, f'Unknown asset: {asset}. Options: {list(ASSETS)}'
+    accepted = {encoding.split(';')[0].strip() for encoding in accept_encoding.split(',')}
+    for encoding, extension in ENCODINGS.items():
+        path = _path(slug, asset) + extension
+        if encoding in accepted and os.path.isfile(path):
+            return path, encoding
+    return _path(slug, asset), None
+
+
+def read_svg(slug: str) -> str:
+    meta(slug)  # build if necessary
+    with open(_path(slug, 'svg'), encoding='utf-8') as f:
+        return f.read()
+
+
+def remove(slug: str) -> None:
+    for file in os.scandir(PATHWAY_ASSETS_DIR) if os.path.isdir(PATHWAY_ASSETS_DIR) else []:
+        if file.name.startswith(f'{slug}.') and file.is_file():
+            os.remove(file.path)
+
+
+def wipe() -> None:
+    shutil.rmtree(PATHWAY_ASSETS_DIR, ignore_errors=True)
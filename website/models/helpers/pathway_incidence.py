@@ -0,0 +1,172 @@
+import os
+import json
+import threading
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+from django.db import connection
+
+from OpenGenomeBrowser.settings import PRESENCE_MATRIX_DIR
+from lib.ogb_cache.backends import file_lock
+from website.models.helpers.presence_matrix import PresenceMatrix, presence
+
+"""
+Precomputed incidence of annotations in pathway maps, to score all maps at once (see PathwayView.score_pathway_maps).
+
+PRESENCE_MATRIX_DIR/pathway-maps/index.json:        slugs of all maps, anno_types that occur in maps
+PRESENCE_MATRIX_DIR/pathway-maps/<anno_type>.bin:   rows: maps, columns: annotations, format: see presence_matrix
+
+The files are written when first needed and removed when the maps are reloaded. They live in their own directory
+so that presence_matrix.invalidate does not remove them.
+"""
+
+INCIDENCE_DIR = os.path.join(PRESENCE_MATRIX_DIR, 'pathway-maps')
+
+_lock = threading.Lock()
+_loaded = None  # ((st_ino, st_mtime_ns), (maps, {anno_type: PresenceMatrix}))
+
+
+def _index_file() -> str:
+    return os.path.join(INCIDENCE_DIR, 'index.json')
+
+
+def _file(anno_type: str) -> str:
+    return os.path.join(INCIDENCE_DIR, f'{anno_type}.bin')
+
+
+def _fetch_links() -> pd.DataFrame:
+    from website.models import Annotation, PathwayMap
+
+    through_table = PathwayMap.annotations.through._meta.db_table
+    sql = f'''
+        SELECT pa.pathwaymap_id, pa.annotation_id, anno.anno_type
+        FROM "{through_table}" pa
+        JOIN "{Annotation._meta.db_table}" anno ON anno.name = pa.annotation_id
+    '''
+    buffer = StringIO()
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY ({sql}) TO STDOUT', buffer)
+    buffer.seek(0)
+    return pd.read_csv(
+        buffer, sep='\t', header=None, names=['map', 'annotation', 'anno_type'], dtype=str, keep_default_na=False,
+        quoting=3
+    )
+
+
+def _build() -> None:
+    from website.models import PathwayMap
+
+    maps = sorted(PathwayMap.objects.values_list('slug', flat=True))
+    links = _fetch_links()
+    anno_types = sorted(links['anno_type'].unique())
+    for anno_type, anno_type_links in links.groupby('anno_type'):
+        PresenceMatrix.from_links(
+            anno_type_links.rename(columns={'map': 'genome'})[['genome', 'annotation']], log_offset=0
+        ).write(_file(anno_type))
+
+    # the index is written last: it marks the matrices as complete
+    with open(f'{_index_file()}.{os.getpid()}.tmp', 'w') as f:
+        json.dump(dict(maps=maps, anno_types=anno_types), f)
+    os.replace(f'{_index_file()}.{os.getpid()}.tmp', _index_file())
+
+
+def load() -> ([str], {str: PresenceMatrix}):
+    """ :returns: slugs of all maps, {anno_type: incidence matrix (rows: maps, columns: annotations)} """
+    global _loaded
+    try:
+        stat = os.stat(_index_file())
+        key = (stat.st_ino, stat.st_mtime_ns)
+    except FileNotFoundError:
+        key = None
+
+    with _lock:
+        if key is not None and _loaded is not None and _loaded[0] == key:
+            return _loaded[1]
+
+    os.makedirs(INCIDENCE_DIR, exist_ok=True)
+    with file_lock(os.path.join(INCIDENCE_DIR, '.lock')):
+        if not os.path.isfile(_index_file()):
+            _build()
+        with open(_index_file()) as f:
+            index = json.load(f)
+        matrices = {anno_type: PresenceMatrix.read(_file(anno_type)) for anno_type in index['anno_types']}
+        stat = os.stat(_index_file())
+
+    with _lock:
+        _loaded = ((stat.st_ino, stat.st_mtime_ns), (index['maps'], matrices))
+    return index['maps'], matrices
+
+
+def invalidate() -> None:
+    """ The pathway maps changed: remove the incidence matrices, they are rebuilt when needed. """
+    if not os.path.isdir(INCIDENCE_DIR):
+        return
+    with file_lock(os.path.join(INCIDENCE_DIR, '.lock')):
+        for file in os.scandir(INCIDENCE_DIR):
+            if file.name.endswith(('.json', '.bin')):
+                os.remove(file.path)
+
+
+def score_maps(groups: {str: [str]}) -> ([str], np.ndarray):
+    """
+    Score all pathway maps at once.
+
+    For each group and annotation, the fraction of genomes that have the annotation is calculated (relative presence).
+    One group: score = mean relative presence of the annotations of the map (coverage).
+    Several groups: score = mean over the annotations of the map of (max - min relative presence of the groups).
+
+    :param groups: {group_id: [identifier, ...]}, no group may be empty
+    :returns: slugs of all maps, scores
+    """
+    assert len(groups) > 0, 'No groups of genomes!'
+    for group_id, genomes in groups.items():
+        assert len(genomes) > 0, f'Group {group_id} contains no genomes!'
+
+    maps, matrices = load()
+    all_genomes = [genome for genomes in groups.values() for genome in genomes]
+    group_rows = np.cumsum([0] + [len(genomes) for genomes in groups.values()])
+
+    n_annos = np.zeros(len(maps), dtype=np.int64)
+    score_sum = np.zeros(len(maps), dtype=np.float64)
+    for anno_type, incidence in matrices.items():
+        incidence = incidence.select(maps)
+        n_annos += np.diff(incidence.matrix.indptr)
+
+        # relative presence of the annotations of the maps in each group
+        genome_presence = presence(all_genomes, anno_type)
+        columns = pd.Index(incidence.annotations).get_indexer(genome_presence.annotations)
+        in_maps = columns >= 0
+        relative = np.zeros((len(groups), len(incidence.annotations)), dtype=np.float64)
+        for i, (start, end) in enumerate(zip(group_rows[:-1], group_rows[1:])):
+            counts = genome_presence.counts(slice(start, end))
+            relative[i, columns[in_maps]] = counts[in_maps] / (end - start)
+
+        per_annotation = relative[0] if len(groups) == 1 else relative.max(axis=0) - relative.min(axis=0)
+        score_sum += incidence.matrix.astype(np.float64) @ per_annotation
+
+    scores = np.divide(score_sum, n_annos, out=np.zeros(len(maps), dtype=np.float64), where=n_annos > 0)
+    return maps, scores
+
+
+def genome_annotations(slug: str, genomes: [str]) -> {str: [str]}:
+    """
+    :param slug: of the pathway map
+    :param genomes: identifiers
+    :returns: {genome: [annotations of the map that the genome has]}
+    """
+    maps, matrices = load()
+    genomes = list(dict.fromkeys(genomes))
+    result = {genome: [] for genome in genomes}
+    for anno_type, incidence in matrices.items():
+        map_annotations = incidence.select([slug]).annotations
+        if len(map_annotations) == 0:
+            continue
+
+        genome_presence = presence(genomes, anno_type)
+        in_map = np.flatnonzero(np.isin(genome_presence.annotations, map_annotations))
+        annotations = genome_presence.annotations[in_map]
+        matrix = genome_presence.matrix[:, in_map]
+        for row, genome in enumerate(genomes):
+            result[genome].extend(annotations[matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]].tolist())
+    return result
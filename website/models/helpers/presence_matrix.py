@@ -0,0 +1,296 @@
+import os
+import json
+import mmap
+import threading
+from io import StringIO
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from django.db import connection
+
+from OpenGenomeBrowser.settings import PRESENCE_MATRIX_DIR
+from lib.ogb_cache.backends import file_lock
+
+"""
+Precomputed genome x annotation presence matrices, one per anno_type, for analyses that need to know which genomes
+have which annotations (gene trait matching, flower plots, ...).
+
+PRESENCE_MATRIX_DIR/<anno_type>.bin:  CSR matrix (rows: genomes, columns: annotations), memory-mapped when loaded
+PRESENCE_MATRIX_DIR/dirty.log:        identifiers of genomes whose annotations changed, one per line
+
+A matrix is built from website_genomecontent_annotations when it is first needed. Afterwards, only the rows of the
+genomes that were appended to dirty.log since are updated. Deleted genomes are appended too: their rows are emptied.
+When all matrices are invalidated, no matrix refers to dirty.log anymore and it is started over.
+
+File format: MAGIC, length of header (uint64), header (json), indptr (int64), indices (int32)
+"""
+
+MAGIC = b'ogbpm\x01\x00\x00'
+
+_lock = threading.Lock()
+_loaded = {}  # {anno_type: ((st_ino, st_mtime_ns), PresenceMatrix)}
+
+
+class Presence:
+    """
+    Presence of annotations in a list of genomes.
+
+        :param genomes: rows, in the requested order
+        :param annotations: columns, all annotations that occur in at least one of the genomes
+        :param matrix: sparse boolean matrix (csr)
+    """
+
+    def __init__(self, genomes: [str], annotations: np.ndarray, matrix: csr_matrix):
+        self.genomes = genomes
+        self.annotations = annotations
+        self.matrix = matrix
+
+    def counts(self, rows: slice = slice(None)) -> np.ndarray:
+        """ :returns: for each annotation, the number of genomes (in rows) that have it """
+        matrix = self.matrix[rows]
+        return np.bincount(matrix.indices, minlength=len(self.annotations))
+
+
+class PresenceMatrix:
+    def __init__(self, genomes: [str], annotations: [str], indptr: np.ndarray, indices: np.ndarray, log_offset: int):
+        self.genomes = genomes
+        self.annotations = annotations
+        self.indptr = indptr
+        self.indices = indices
+        self.log_offset = log_offset  # position in dirty.log up to which the changes are contained
+
+    @cached_property
+    def genome_index(self) -> {str: int}:
+        return {genome: i for i, genome in enumerate(self.genomes)}
+
+    @cached_property
+    def annotation_array(self) -> np.ndarray:
+        return np.array(self.annotations, dtype=object)
+
+    def select(self, genomes: [str]) -> Presence:
+        """
+        :param genomes: identifiers. Genomes without annotations of this type are allowed and have empty rows
+        """
+        genomes = list(genomes)
+        rows = [self.genome_index.get(genome) for genome in genomes]
+        chunks = [self.indices[self.indptr[row]:self.indptr[row + 1]] for row in rows if row is not None]
+        lengths = [0 if row is None else self.indptr[row + 1] - self.indptr[row] for row in rows]
+
+        columns, indices = np.unique(np.concatenate(chunks) if chunks else np.empty(0, np.int32), return_inverse=True)
+        indptr = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        matrix = csr_matrix(
+            (np.ones(len(indices), dtype=bool), indices, indptr),
+            shape=(len(genomes), len(columns))
+        )
+        return Presence(genomes, self.annotation_array[columns], matrix)
+
+    def replace_rows(self, rows: {str: [str]}, log_offset: int) -> 'PresenceMatrix':
+        """
+        :param rows: {genome: [annotation, ...]}, new content of the rows of these genomes
+        :param log_offset: new position in dirty.log
+        :returns: new matrix, new genomes and annotations are appended
+        """
+        genomes, annotations = list(self.genomes), list(self.annotations)
+        genome_index, annotation_index = dict(self.genome_index), {a: i for i, a in enumerate(annotations)}
+        for genome, genome_annotations in rows.items():
+            if genome not in genome_index:
+                genome_index[genome] = len(genomes)
+                genomes.append(genome)
+            for annotation in genome_annotations:
+                if annotation not in annotation_index:
+                    annotation_index[annotation] = len(annotations)
+                    annotations.append(annotation)
+
+        n_old = len(self.genomes)
+        old_lengths = np.diff(self.indptr)
+        lengths = np.zeros(len(genomes), dtype=np.int64)
+        lengths[:n_old] = old_lengths
+        replaced = np.array([genome_index[genome] for genome in rows], dtype=np.int64)
+        lengths[replaced] = [len(genome_annotations) for genome_annotations in rows.values()]
+        indptr = np.concatenate(([0], np.cumsum(lengths)))
+        indices = np.empty(indptr[-1], dtype=np.int32)
+
+        # copy unchanged rows in bulk
+        old_row = np.repeat(np.arange(n_old), old_lengths)
+        keep = ~np.isin(old_row, replaced)
+        position_in_row = np.arange(len(self.indices)) - self.indptr[old_row]
+        indices[indptr[old_row[keep]] + position_in_row[keep]] = self.indices[keep]
+
+        for genome, genome_annotations in rows.items():
+            row = genome_index[genome]
+            indices[indptr[row]:indptr[row + 1]] = sorted(annotation_index[a] for a in genome_annotations)
+
+        return PresenceMatrix(genomes, annotations, indptr, indices, log_offset)
+
+    def write(self, file: str) -> None:
+        header = json.dumps(dict(
+            genomes=self.genomes, annotations=self.annotations, log_offset=self.log_offset,
+            n_indptr=len(self.indptr), n_indices=len(self.indices)
+        )).encode('utf-8')
+        header += b' ' * (-len(header) % 8)  # align arrays
+        with open(f'{file}.{os.getpid()}.tmp', 'wb') as f:
+            f.write(MAGIC)
+            f.write(np.uint64(len(header)).tobytes())
+            f.write(header)
+            f.write(np.ascontiguousarray(self.indptr, dtype=np.int64).tobytes())
+            f.write(np.ascontiguousarray(self.indices, dtype=np.int32).tobytes())
+        os.replace(f'{file}.{os.getpid()}.tmp', file)
+
+    @classmethod
+    def read(cls, file: str) -> 'PresenceMatrix':
+        with open(file, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        assert data[:len(MAGIC)] == MAGIC, f'Not a presence matrix: {file}'
+        header_length = int(np.frombuffer(data, dtype=np.uint64, count=1, offset=len(MAGIC))[0])
+        offset = len(MAGIC) + 8
+        header = json.loads(data[offset:offset + header_length])
+        offset += header_length
+        indptr = np.frombuffer(data, dtype=np.int64, count=header['n_indptr'], offset=offset)
+        offset += indptr.nbytes
+        indices = np.frombuffer(data, dtype=np.int32, count=header['n_indices'], offset=offset)
+        return cls(header['genomes'], header['annotations'], indptr, indices, header['log_offset'])
+
+    @classmethod
+    def from_links(cls, links: pd.DataFrame, log_offset: int) -> 'PresenceMatrix':
+        """ :param links: DataFrame with the columns genome, annotation """
+        genome_codes, genomes = pd.factorize(links['genome'])
+        annotation_codes, annotations = pd.factorize(links['annotation'])
+        order = np.lexsort((annotation_codes, genome_codes))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(genome_codes, minlength=len(genomes)))))
+        return cls(list(genomes), list(annotations), indptr, annotation_codes[order].astype(np.int32), log_offset)
+
+
+def _file(anno_type: str) -> str:
+    return os.path.join(PRESENCE_MATRIX_DIR, f'{anno_type}.bin')
+
+
+def _log_file() -> str:
+    return os.path.join(PRESENCE_MATRIX_DIR, 'dirty.log')
+
+
+def _log_size() -> int:
+    try:
+        return os.path.getsize(_log_file())
+    except FileNotFoundError:
+        return 0
+
+
+def _fetch_links(anno_type: str, genomes: [str] = None) -> pd.DataFrame:
+    from website.models import Annotation, GenomeContentAnnotation
+
+    sql = f'''
+        SELECT gca.genomecontent_id, gca.annotation_id
+        FROM "{GenomeContentAnnotation._meta.db_table}" gca
+        JOIN "{Annotation._meta.db_table}" anno ON anno.name = gca.annotation_id
+        WHERE anno.anno_type = %s
+    '''
+    params = [anno_type]
+    if genomes is not None:
+        sql += ' AND gca.genomecontent_id = ANY(%s)'
+        params.append(list(genomes))
+
+    buffer = StringIO()
+    with connection.cursor() as cursor:
+        cursor.copy_expert(cursor.mogrify(f'COPY ({sql}) TO STDOUT', params).decode('utf-8'), buffer)
+    buffer.seek(0)
+    return pd.read_csv(
+        buffer, sep='\t', header=None, names=['genome', 'annotation'], dtype=str, keep_default_na=False, quoting=3
+    )
+
+
+def _dirty_genomes(start: int, end: int) -> {str}:
+    with open(_log_file(), 'rb') as f:
+        f.seek(start)
+        return set(f.read(end - start).decode('utf-8').split())
+
+
+def load(anno_type: str) -> PresenceMatrix:
+    """ :returns: up-to-date presence matrix of anno_type, built or updated if necessary """
+    file = _file(anno_type)
+    try:
+        stat = os.stat(file)
+        key = (stat.st_ino, stat.st_mtime_ns)
+    except FileNotFoundError:
+        key = None
+
+    with _lock:
+        cached_key, matrix = _loaded.get(anno_type, (None, None))
+    if key is None or key != cached_key:
+        matrix = None
+    if matrix is not None and _log_size() <= matrix.log_offset:
+        return matrix
+
+    with file_lock(os.path.join(PRESENCE_MATRIX_DIR, f'.{anno_type}.lock')):
+        log_size = _log_size()
+        # only consume complete lines
+        if log_size:
+            with open(_log_file(), 'rb') as f:
+                log_size = f.read(log_size).rfind(b'\n') + 1
+
+        if os.path.isfile(file):
+            matrix = PresenceMatrix.read(file)
+            if matrix.log_offset < log_size:
+                genomes = _dirty_genomes(matrix.log_offset, log_size)
+                links = _fetch_links(anno_type, genomes=genomes)
+                rows = {genome: [] for genome in genomes}
+                for genome, annotations in links.groupby('genome')['annotation']:
+                    rows[genome] = annotations.tolist()
+                matrix.replace_rows(rows, log_offset=log_size).write(file)
+                matrix = PresenceMatrix.read(file)
+        else:
+            PresenceMatrix.from_links(_fetch_links(anno_type), log_offset=log_size).write(file)
+            matrix = PresenceMatrix.read(file)
+
+        stat = os.stat(file)
+    with _lock:
+        _loaded[anno_type] = ((stat.st_ino, stat.st_mtime_ns), matrix)
+    return matrix
+
+
+def presence(genomes: [str], anno_type: str) -> Presence:
+    """
+    Which of these genomes have which annotations of anno_type.
+
+    :param genomes: identifiers
+    :param anno_type: annotation type, e.g. 'KG'
+    :returns: Presence, rows: genomes, columns: annotations that occur in at least one of the genomes
+    """
+    from website.models.Annotation import annotation_types
+    assert anno_type in annotation_types, f'Unknown anno_type: {anno_type}. Options: {list(annotation_types)}'
+    return load(anno_type).select(genomes)
+
+
+def version(anno_type: str) -> str:
+    """ :returns: token that changes whenever the presence matrix of anno_type changes, e.g. to key cached results """
+    load(anno_type)
+    with _lock:
+        (inode, mtime_ns), matrix = _loaded[anno_type]
+    return f'{inode}-{mtime_ns}-{matrix.log_offset}'
+
+
+def mark_dirty(genomes: [str]) -> None:
+    """ The annotations of these genomes changed: update their rows when the matrices are loaded next time. """
+    os.makedirs(PRESENCE_MATRIX_DIR, exist_ok=True)
+    with open(_log_file(), 'a') as f:
+        f.write(''.join(f'{genome}\n' for genome in genomes))
+
+
+def invalidate(anno_types: [str] = None) -> None:
+    """ Remove matrices, they are rebuilt from scratch when needed. Default: all anno_types, and dirty.log """
+    if not os.path.isdir(PRESENCE_MATRIX_DIR):
+        return
+    if anno_types is None:
+        from website.models.Annotation import annotation_types
+        # first, so that matrices that are being built concurrently refer to the old log and are removed below
+        if os.path.isfile(_log_file()):
+            os.remove(_log_file())
+        files = {f.path for f in os.scandir(PRESENCE_MATRIX_DIR) if f.name.endswith('.bin')}
+        files.update(_file(anno_type) for anno_type in annotation_types)
+    else:
+        files = [_file(anno_type) for anno_type in anno_types]
+    for file in files:
+        with file_lock(os.path.join(PRESENCE_MATRIX_DIR, f'.{os.path.basename(file)[:-4]}.lock')):
+            if os.path.isfile(file):
+                os.remove(file)
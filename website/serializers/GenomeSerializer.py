@@ -50,13 +50,14 @@ class GenomeSerializer(serializers.ModelSerializer):
         return super().is_valid(raise_exception=raise_exception)
 
     @staticmethod
-    def update_genomecontent(genome: Genome, wipe=False):
+    def update_genomecontent(genome: Genome, wipe=False, parsed: dict = None):
         if wipe:
             genome.genomecontent.wipe_data(genes=True)
         # update genomecontent
-        genome.genomecontent.update()
+        plan = genome.genomecontent.update(parsed=parsed)
         # update assembly stats
-        genome.update_assembly_info()
+        if plan['assembly'] or genome.assembly_gc is None:
+            genome.update_assembly_info()
 
     @staticmethod
     def json_matches_genome(genome, json_dict: dict, organism_name: str) -> (bool, dict):
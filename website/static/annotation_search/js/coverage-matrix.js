@@ -0,0 +1,143 @@
+"use strict"
+
+/**
+ * Virtualized coverage matrix: only the rows and columns in view (plus a margin) are in the DOM, the rest is replaced
+ * by spacers. Rendering time does not grow with the number of genomes and annotations.
+ * The genes of a cell are loaded when the cell is clicked.
+ *
+ * @param container: element to render into
+ * @param data: {genomes: [html], annotations: [html], counts: [[number of genes]]}, see MatrixMaker.to_json
+ * @param genesUrl: url of AnnotationSearch.matrix_genes
+ */
+class CoverageMatrix {
+    constructor(container, data, genesUrl) {
+        this.data = data
+        this.genesUrl = genesUrl
+        this.nRows = data.annotations.length
+        this.nColumns = data.genomes.length
+        this.annotationNames = data.annotations.map(html => $(html).text())
+        this.genomeIdentifiers = data.genomes.map(html => $(html).text())
+        this.genomeSpecies = data.genomes.map(html => $(html).data('species'))
+
+        // initial estimates, measured after the first render
+        this.rowHeight = 28
+        this.columnWidth = 40
+        this.headerHeight = 0
+        this.annotationColumnWidth = 0
+        this.overscan = 5
+
+        this.viewport = $('<div class="coverage-matrix-viewport"></div>').appendTo($(container).empty())
+        this.table = $(`
+<table id="coverage-matrix" class="table table-bordered table-sm white-links">
+    <thead class="thead-dark"></thead>
+    <tbody></tbody>
+</table>`).appendTo(this.viewport)
+
+        this.range = null  // rendered rows and columns: [first row, last row, first column, last column]
+        this.renderScheduled = false
+        this.viewport.on('scroll', () => this.scheduleRender())
+        $(window).on('resize', () => this.scheduleRender())
+        this.viewport.on('click', 'td[data-row]', event => this.showGenes(event))
+
+        this.render()
+        this.measure()
+        this.render(true)
+    }
+
+    measure() {
+        const genomeHeader = this.table.find('thead th[data-column]')[0]
+        const row = this.table.find('tbody tr[data-row]')[0]
+        if (genomeHeader) this.columnWidth = genomeHeader.getBoundingClientRect().width
+        if (row) this.rowHeight = row.getBoundingClientRect().height
+        this.headerHeight = this.table.find('thead')[0].getBoundingClientRect().height
+        this.annotationColumnWidth = this.table.find('thead th')[0].getBoundingClientRect().width
+    }
+
+    scheduleRender() {
+        if (this.renderScheduled) return
+        this.renderScheduled = true
+        window.requestAnimationFrame(() => {
+            this.renderScheduled = false
+            this.render()
+        })
+    }
+
+    visibleRange(scroll, viewSize, itemSize, nItems) {
+        const first = Math.max(0, Math.floor(scroll / itemSize) - this.overscan)
+        const last = Math.min(nItems, Math.ceil((scroll + viewSize) / itemSize) + this.overscan)
+        return [Math.min(first, last), last]
+    }
+
+    render(force = false) {
+        const viewport = this.viewport[0]
+        const [firstRow, lastRow] = this.visibleRange(
+            Math.max(0, viewport.scrollTop - this.headerHeight), viewport.clientHeight, this.rowHeight, this.nRows)
+        const [firstColumn, lastColumn] = this.visibleRange(
+            Math.max(0, viewport.scrollLeft - this.annotationColumnWidth), viewport.clientWidth, this.columnWidth, this.nColumns)
+
+        const range = [firstRow, lastRow, firstColumn, lastColumn]
+        const columnsChanged = force || this.range === null || firstColumn !== this.range[2] || lastColumn !== this.range[3]
+        if (!force && this.range !== null && range.every((value, i) => value === this.range[i])) return
+        this.range = range
+
+        const spacer = (tag, width) => width > 0 ? `<${tag} class="coverage-matrix-spacer" style="width: ${width}px; min-width: ${width}px"></${tag}>` : ''
+        const leftSpacer = firstColumn * this.columnWidth
+        const rightSpacer = (this.nColumns - lastColumn) * this.columnWidth
+
+        if (columnsChanged) {
+            let header = `<tr><th></th>${spacer('th', leftSpacer)}`
+            for (let column = firstColumn; column < lastColumn; column++) {
+                header += `<th scope="col" data-column="${column}">${this.data.genomes[column]}</th>`
+            }
+            header += `${spacer('th', rightSpacer)}</tr>`
+            this.table.find('thead').html(header)
+        }
+
+        const nCells = lastColumn - firstColumn + 3
+        const spacerRow = height => height > 0 ? `<tr class="coverage-matrix-spacer"><td colspan="${nCells}" style="height: ${height}px"></td></tr>` : ''
+        let body = spacerRow(firstRow * this.rowHeight)
+        for (let row = firstRow; row < lastRow; row++) {
+            const counts = this.data.counts[row]
+            body += `<tr data-row="${row}"><th>${this.data.annotations[row]}</th>${spacer('td', leftSpacer)}`
+            for (let column = firstColumn; column < lastColumn; column++) {
+                const count = counts[column]
+                body += count === 0 ?
+                    `<td><p style="color: lightgray">0</p></td>` :
+                    `<td data-row="${row}" data-column="${column}"><p>${count}</p></td>`
+            }
+            body += `${spacer('td', rightSpacer)}</tr>`
+        }
+        body += spacerRow((this.nRows - lastRow) * this.rowHeight)
+        this.table.find('tbody').html(body)
+
+        this.activateTags(columnsChanged ? this.table : this.table.find('tbody'))
+    }
+
+    activateTags(element) {
+        element.find('.ogb-tag')
+            .ogbTooltip()
+            .each(function () {
+                if ($(this).hasClass('genome')) {
+                    this.setAttribute('onclick', `showGenomeClickMenu(event, 'auto', 'auto', $(this).parent().parent() )`)
+                } else if ($(this).hasClass('annotation')) {
+                    this.setAttribute('onclick', `showAnnotationClickMenu(event, 'auto', $(this).parent(), {'': $(this).parent().parent().parent().parent()} )`)
+                }
+            })
+    }
+
+    showGenes(event) {
+        const row = Number(event.currentTarget.dataset.row)
+        const column = Number(event.currentTarget.dataset.column)
+        $.post(this.genesUrl, {annotation: this.annotationNames[row], genome: this.genomeIdentifiers[column]})
+            .done(data => showGenesClickMenu(event, data.genes, this.genomeSpecies[column]))
+            .fail(jqXHR => alertModal('danger', 'Failed to load genes', jqXHR.responseJSON?.message ?? jqXHR.statusText))
+    }
+
+    countsTsv() {
+        let tsv = ['Annotation', ...this.genomeIdentifiers].join('\t') + '\r\n'
+        for (let row = 0; row < this.nRows; row++) {
+            tsv += [this.annotationNames[row], ...this.data.counts[row]].join('\t') + '\r\n'
+        }
+        return tsv
+    }
+}
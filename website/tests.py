@@ -1,3 +1,27 @@
-from django.test import TestCase
+from unittest import mock
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from website.models import GenomeContent as genome_content_module
+
+
+class TestUpdateGbk(SimpleTestCase):
+    def test_removed_gene_with_custom_file(self):
+        # gbk update that removes gene_2 from a genome that has one custom annotation file
+        gc = mock.MagicMock()
+        gc.gene_set.values_list.return_value = ['gene_1', 'gene_2']
+        gc.link_sources.return_value = ['gbk', 'custom/custom.KG']
+        custom_snapshot = {('gene_1', 'K00001', 'KG'), ('gene_2', 'K00002', 'KG')}
+        parsed = {'gbk': (['gene_1'], {('GO:0000001', 'GO')}, {('gene_1', 'GO:0000001')}), 'custom_files': {}}
+
+        m = genome_content_module
+        with mock.patch.object(m, 'copy_genes'), \
+                mock.patch.object(m, 'read_link_snapshot', return_value=custom_snapshot), \
+                mock.patch.object(m, 'write_link_snapshot') as write_link_snapshot, \
+                mock.patch.object(m, 'apply_links') as apply_links, \
+                mock.patch.object(m.os, 'stat'):
+            m.update_gbk(gc, parsed=parsed)
+
+        gc.gene_set.filter.assert_called_once_with(identifier__in={'gene_2'})
+        write_link_snapshot.assert_called_once_with(gc, 'custom/custom.KG', {('gene_1', 'K00001', 'KG')})
+        # the gbk links come from the gbk file, not from the snapshot of the custom file
+        apply_links.assert_called_once_with(gc, 'gbk', {('gene_1', 'GO:0000001', 'GO')})
@@ -39,9 +39,11 @@ urlpatterns = [
     # ex: /annotation-search/?annotations={K01626}+{EC:4.4.4.4}&genomes={organism1}+{organism2}
     path('annotation-search/', AnnotationSearch.annotation_view, name='annotation-search'),
     path('annotation-search-matrix/', AnnotationSearch.matrix, name='annotation-search-matrix'),
+    path('annotation-search-genes/', AnnotationSearch.matrix_genes, name='annotation-search-genes'),
 
     # ex: /pathway/?map_slug={kegg-map-00400}&genomes={organism1}+{organism2}
     path('pathway/', PathwayView.pathway_view, name='pathway'),
+    path('pathway-asset/<slug:slug>.<str:asset>', PathwayView.pathway_asset, name='pathway-asset'),
 
     # ex: /trees/?genomes={organism1}+{organism2}
     path('trees/', Trees.trees, name='trees'),
@@ -84,12 +86,14 @@ urlpatterns = [
     path('api/dna-feature-viewer-multi/', Api.dna_feature_viewer_multi, name='api-dna-feature-viewer'),
     path('api/align/', Api.align, name='api-align'),
     path('api/get-gene/', Api.get_gene, name='api-get-gene'),
+    path('api/get-sequences/', Api.get_sequences, name='api-get-sequences'),
     path('api/get-annotation/', Api.get_annotation, name='api-get-annotation'),
     path('api/get-tree/', Api.get_tree, name='api-get-tree'),
     path('api/reload-orthofinder/', Api.reload_orthofinder, name='api-reload-orthofinder'),
     path('api/get-dotplot/', get_dotplot, name='api-get-dotplot'),
     path('api/get-dotplot-annotations/', get_dotplot_annotations, name='api-get-dotplot-annotations'),
     path('api/score-pathway-maps/', PathwayView.score_pathway_maps, name='api-score-pathway-maps'),
+    path('api/pathway-genome-annotations/', PathwayView.pathway_genome_annotations, name='api-pathway-genome-annotations'),
 
     # ex /test-click-menu/
     path('test-click-menu/', ClickMenu.click_view, name='test-click-menu'),
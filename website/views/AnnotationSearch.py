@@ -1,17 +1,21 @@
 from django.shortcuts import render, HttpResponse
-from django.db.models import Q
+from django.http import JsonResponse
+from django.db.models import Count
 from django.contrib.postgres.aggregates.general import ArrayAgg
+from functools import cached_property
 
+import numpy as np
 import pandas as pd
 import json
 
-from website.models import Genome
+from website.models import Genome, Gene
 from website.models.Annotation import Annotation
 from website.views.helpers.extract_errors import extract_errors
 from website.views.helpers.extract_requests import contains_data, extract_data
 
 from website.views.GenomeDetailView import dataframe_to_bootstrap_html
 from website.views.helpers.magic_string import MagicQueryManager
+from lib.pattern_order import pattern_order
 
 
 def annotation_view(request):
@@ -41,6 +45,14 @@ def annotation_view(request):
 
 
 def matrix(request):
+    """
+    Coverage matrix of annotations (rows) in genomes (columns).
+
+    POST format:
+        - html (default): html table, every cell contains its genes
+        - json: integer-coded matrix, see MatrixMaker.to_json. The genes are loaded per cell, see matrix_genes
+        - genes-tsv: download, every cell contains its genes (comma-separated)
+    """
     # check input
     if not 'genomes[]' and 'annotations[]' in request.POST:
         return HttpResponse('Request failed! Please POST genomes[] and annotations[].')
@@ -61,9 +73,18 @@ def matrix(request):
         return HttpResponse('Request failed: annotations[] incorrect.')
 
     all_genomes = magic_query_manager.all_genomes
+    format = request.POST.get('format', 'html')
+
+    if format == 'json':
+        return JsonResponse(MatrixMaker(all_genomes, annotations, with_genes=False).to_json())
 
     mm = MatrixMaker(all_genomes, annotations)
 
+    if format == 'genes-tsv':
+        response = HttpResponse(mm.genes_tsv(), content_type='text/tab-separated-values')
+        response['Content-Disposition'] = 'attachment; filename="coverage-matrix-genes.tsv"'
+        return response
+
     context = dict(
         matrix_header=mm.coverage_matrix.columns.to_list(),
         matrix_body=zip(mm.coverage_matrix.index, mm.coverage_matrix.values.tolist()),
@@ -74,8 +95,29 @@ def matrix(request):
     return render(request, 'website/annotation_search_matrix.html', context)
 
 
+def matrix_genes(request):
+    """
+    Genes of one cell of the coverage matrix, loaded when the cell is clicked.
+
+    POST: annotation, genome
+    :returns: {success, genes: [identifier, ...]}
+    """
+    annotation, genome = request.POST.get('annotation'), request.POST.get('genome')
+    if not annotation or not genome:
+        return JsonResponse(dict(success='false', message='Request failed! Please POST annotation and genome.'), status=400)
+
+    genes = Gene.objects \
+        .filter(genomecontent_id=genome, annotations__name=annotation) \
+        .order_by('identifier') \
+        .values_list('identifier', flat=True)
+    return JsonResponse(dict(success='true', genes=list(genes)))
+
+
 class MatrixMaker:
-    def __init__(self, genomes: [Genome], annotations: [Annotation]):
+    def __init__(self, genomes: [Genome], annotations: [Annotation], with_genes: bool = True):
+        """
+        :param with_genes: whether to load the genes of each cell (coverage_matrix), otherwise only count them
+        """
         self.genomes = list(genomes)
         self.genome_identifiers = [g.identifier for g in genomes]
         self.annotations = list(annotations)
@@ -84,52 +126,53 @@ class MatrixMaker:
 
         self.annotation_to_html = {a.name: a.html for a in annotations}
 
-        self.coverage_matrix = self.__create_coverage_matrix()
+        self.count_matrix, self.coverage_matrix = self.__create_coverage_matrix(with_genes)
 
-        self.html_matrix = self.pandas_to_html(table=self.coverage_matrix, id='coverage-matrix')
+    @cached_property
+    def html_matrix(self) -> str:
+        return self.pandas_to_html(table=self.coverage_matrix, id='coverage-matrix')
 
-    def __create_coverage_matrix(self):
-        """
-        use Postgres subqueries to efficiently calculate matrix
+    def __create_coverage_matrix(self, with_genes: bool) -> (pd.DataFrame, pd.DataFrame):
         """
+        One query for all genomes: (annotation, genome, number of genes, genes), pivoted into annotation x genome
+        matrices
 
-        # design query
-        annotations_qs = Annotation.objects
-
-        # annotate Annotations with genomes
-        for identifier in self.genome_identifiers:
-            annotations_qs = annotations_qs.annotate(**{identifier: ArrayAgg('gene', filter=Q(gene__genomecontent__identifier=identifier))})
-
-        # filter Annotations with annotations
-        annotations_qs = annotations_qs.filter(name__in=[a.name for a in self.annotations])
+        :returns: number of genes per cell, genes per cell (None if not with_genes)
+        """
+        annotation_names = [a.name for a in self.annotations]
+        aggregates = dict(n_genes=Count('gene_id'))
+        if with_genes:
+            aggregates['genes'] = ArrayAgg('gene_id', ordering='gene_id')
+        links = Gene.annotations.through.objects \
+            .filter(annotation_id__in=annotation_names, gene__genomecontent_id__in=self.genome_identifiers) \
+            .values('annotation_id', 'gene__genomecontent_id') \
+            .annotate(**aggregates) \
+            .values_list('annotation_id', 'gene__genomecontent_id', *aggregates)
+
+        shape = (len(annotation_names), len(self.genome_identifiers))
+        counts = np.zeros(shape, dtype=np.int32)
+        cells = np.frompyfunc(lambda _: [], 1, 1)(np.empty(shape, dtype=object)) if with_genes else None
+        if links:
+            annotations, genomes, n_genes, *genes = zip(*links)
+            rows = pd.Index(annotation_names).get_indexer(annotations)
+            columns = pd.Index(self.genome_identifiers).get_indexer(genomes)
+            counts[rows, columns] = n_genes
+            if with_genes:
+                for row, column, cell_genes in zip(rows, columns, genes[0]):
+                    cells[row, column] = cell_genes
 
-        # create pd.DataFrame
-        matrix_values = annotations_qs.values_list(*['name'] + self.genome_identifiers)
-        matrix = pd.DataFrame(matrix_values, columns=['name'] + self.genome_identifiers)
-        matrix.set_index('name', inplace=True)
+        # sort so that highest numbers are top left
+        row_order = pattern_order(counts > 0)
+        column_order = pattern_order((counts[row_order] > 0).T)
 
-        return self.__sort_coverage_matrix(matrix)
+        def to_frame(values: np.ndarray) -> pd.DataFrame:
+            return pd.DataFrame(
+                values[np.ix_(row_order, column_order)],
+                index=pd.Index(annotation_names, name='name')[row_order],
+                columns=pd.Index(self.genome_identifiers)[column_order]
+            )
 
-    def __sort_coverage_matrix(self, matrix):
-        def sort_by_pattern(row_or_col):
-            return pattern_to_rank[tuple([bool(rc) for rc in row_or_col.values])]
-
-        # sort so that highest numbers are top left
-        for axis in [0, 1]:
-            pattern_to_rank = self.__pattern_to_rank(matrix, axis=axis)
-            matrix = matrix.reindex(matrix.apply(sort_by_pattern, axis=0 if axis == 1 else 1).sort_values(ascending=False).index, axis=axis)
-
-        return matrix
-
-    def __pattern_to_rank(self, matrix, axis: int):
-        # sort by most common pattern
-        if axis == 0:
-            patterns = list(set([tuple(row.values) for i, row in matrix.applymap(bool).iterrows()]))
-        else:
-            patterns = list(set([tuple(row.values) for i, row in matrix.applymap(bool).iteritems()]))
-        patterns = sorted(patterns, key=lambda x: sum(x))
-        pattern_to_rank = {p: i for i, p in enumerate(patterns)}
-        return pattern_to_rank
+        return to_frame(counts), to_frame(cells) if with_genes else None
 
     def pandas_to_html(self, table: pd.DataFrame, id: str) -> str:
         tmp = table.__deepcopy__()
@@ -148,3 +191,20 @@ class MatrixMaker:
         html = dataframe_to_bootstrap_html(tmp, table_id=id, index=True)
 
         return html
+
+    def to_json(self) -> dict:
+        """
+        :returns: {genomes: [html], annotations: [html], counts: [[number of genes]]}, the annotations are the rows of
+                  counts, the genomes the columns
+        """
+        return dict(
+            genomes=[self.genome_to_html[g] for g in self.count_matrix.columns],
+            annotations=[self.annotation_to_html[a] for a in self.count_matrix.index],
+            counts=self.count_matrix.values.tolist()
+        )
+
+    def genes_tsv(self) -> str:
+        """ :returns: coverage matrix as tsv, every cell contains its genes (comma-separated) """
+        genes = self.coverage_matrix.applymap(','.join)
+        genes.index.name = 'Annotation'
+        return genes.to_csv(sep='\t')
@@ -248,7 +248,8 @@ class Api:
 
         gene_identifiers = request.POST.getlist('gene_identifiers[]')
 
-        gs = Gene.objects.filter(identifier__in=gene_identifiers)
+        gs = Gene.objects.filter(identifier__in=gene_identifiers) \
+            .select_related('genomecontent__genome__organism__taxid')
 
         loci_of_interest = [
             dict(gbk=g.genomecontent.genome.cds_gbk(relative=False), gene=g.identifier, title=g.identifier)
@@ -297,7 +298,7 @@ class Api:
         script = script[35:-10]  # remove <script type="text/javascript"> and </script>
 
         gene_divs = [g.html for g in gs]
-        species_divs = [g.genomecontent.organism.taxid.html for g in gs]
+        species_divs = [g.genomecontent.genome.organism.taxid.html for g in gs]
 
         plot_div = ""
         for gene, species, plot in zip(gene_divs, species_divs, plot_divs):
@@ -334,20 +335,20 @@ class Api:
         method = request.POST['method']
         sequence_type = request.POST['sequence_type']
 
-        genes = Gene.objects.filter(identifier__in=gene_identifiers)
-        if not len(set(gene_identifiers)) == len(genes):
-            return err(F"{len(set(gene_identifiers))} were submitted but only {len(genes)} genes were found.")
-
-        if sequence_type == 'dna':
-            FASTAS = [g.fasta_nucleotide() for g in genes]
-        elif sequence_type == 'protein':
-            try:
-                FASTAS = [g.fasta_protein() for g in genes]
-            except KeyError as e:
-                return err(str(e))
-        else:
+        if sequence_type not in ['dna', 'protein']:
             return err(F"'sequence_type' must be either 'dna' or 'protein', got {sequence_type}.")
 
+        try:
+            sequences = list(Gene.objects.sequences(gene_identifiers, kind=sequence_type))
+        except KeyError as e:
+            return err(str(e))
+
+        non_coding = [identifier for identifier, sequence in sequences if sequence is None]
+        if non_coding:
+            return err(f'The genes {non_coding} are not protein-coding.')
+
+        FASTAS = [f'>{identifier}\n{sequence}' for identifier, sequence in sequences]
+
         if method == 'clustalo':
             METHOD = ClustalOmega()
         elif method == 'mafft':
@@ -363,6 +364,32 @@ class Api:
 
         return JsonResponse(dict(fastas=FASTAS, method=method, version=version, alignment=alignment))
 
+    @staticmethod
+    def get_sequences(request):
+        """
+        Get the sequences of many genes. Each gbk/fasta file is only read once.
+
+        Query:
+            - gene_identifiers[]: list of gene identifiers
+            - sequence_type: 'dna', 'protein'
+
+        Returns JSON: sequences = {identifier: sequence}, fasta = multi-fasta string
+        """
+        gene_identifiers = request.POST.getlist('gene_identifiers[]')
+        sequence_type = request.POST.get('sequence_type', 'dna')
+
+        if sequence_type not in ['dna', 'protein']:
+            return err(F"'sequence_type' must be either 'dna' or 'protein', got {sequence_type}.")
+
+        try:
+            sequences = dict(Gene.objects.sequences(gene_identifiers, kind=sequence_type))
+        except KeyError as e:
+            return err(str(e))
+
+        fasta = '\n'.join(f'>{identifier}\n{sequence}' for identifier, sequence in sequences.items() if sequence is not None)
+
+        return JsonResponse(dict(sequences=sequences, fasta=fasta))
+
     @staticmethod
     def get_annotation(request):
         """
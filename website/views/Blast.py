@@ -1,5 +1,5 @@
-from django.shortcuts import render, HttpResponse
-from django.http import HttpResponseBadRequest, JsonResponse
+from django.shortcuts import render
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 
 from website.views.helpers.extract_errors import extract_errors
 from website.views.helpers.magic_string import MagicQueryManager, MagicError
@@ -83,8 +83,8 @@ def blast_submit(request):
     fasta_files = tuple(sorted(set(fasta_files)))
 
     try:
-        blast_output = calculate_blast(fasta_string=query, db=fasta_files, mode=blast_algorithm, **kwargs)
+        blast_output = calculate_blast.stream(fasta_string=query, db=fasta_files, mode=blast_algorithm, **kwargs)
     except Exception as e:
         return JsonResponse(dict(success='false', message='Blast failed. Reason:' + str(e)), status=500)
 
-    return HttpResponse(blast_output, content_type="text/plain")
+    return StreamingHttpResponse(blast_output, content_type="text/plain")
@@ -9,9 +9,11 @@ from django.http import JsonResponse
 from website.views.helpers.extract_errors import extract_errors
 from website.views.helpers.magic_string import MagicQueryManager
 from lib.ogb_cache.ogb_cache import clear_cache
+from lib.ogb_cache.eviction import enforce_budget
+from lib.ogb_cache.stats import get_stats
 from website.views.helpers.extract_requests import contains_data, extract_data
 from website.models import Genome, Organism
-from OpenGenomeBrowser.settings import CACHE_DIR, CACHE_MAXSIZE, FOLDER_STRUCTURE
+from OpenGenomeBrowser.settings import CACHE_DIR, CACHE_MAXSIZE, CACHE_MAXBYTES, CACHE_EVICTION_POLICY, FOLDER_STRUCTURE
 
 # future: use nginx directly
 # nginx mod_zip: https://github.com/evanmiller/mod_zip/
@@ -142,6 +144,8 @@ def downloader_submit(request):
         os.remove(zip_path)
 
     clear_cache(cache_fn_dir=f'{CACHE_DIR}/downloader', maxsize=CACHE_MAXSIZE)
+    if CACHE_MAXBYTES:
+        enforce_budget(CACHE_DIR, maxbytes=CACHE_MAXBYTES, policy=CACHE_EVICTION_POLICY, stats=get_stats(CACHE_DIR))
 
     return JsonResponse(dict(success=True))
 
@@ -1,19 +1,21 @@
-from io import StringIO
-
-from django.db.models import Q
-import pandas as pd
+import numpy as np
+from scipy.sparse import csr_matrix
 from django.db.models import Count
 from django.shortcuts import render
 from django.http import JsonResponse
 
-from flower_plot import flower_plot
+from lib.plot_renderer import render_flower_plot
+from lib.ogb_cache.ogb_cache import ogb_cache
+from OpenGenomeBrowser.settings import CACHE_DIR, CACHE_MAXSIZE, CACHE_BACKEND, CACHE_MEMORY_MAXBYTES, CACHE_MAXBYTES, \
+    CACHE_EVICTION_POLICY, CACHE_COMPRESS, PLOT_WORKERS
 
 from website.views.helpers.extract_errors import extract_errors
 from website.views.helpers.magic_string import MagicQueryManager
 from website.views.helpers.extract_requests import contains_data, extract_data
 
-from website.models import Genome, GenomeContent, Annotation
+from website.models import Genome, GenomeContent
 from website.models.Annotation import annotation_types, settings
+from website.models.helpers.presence_matrix import presence, version as presence_version
 
 
 def flower_view(request):
@@ -70,63 +72,47 @@ def flower_svg(request):
     except Exception as e:
         return JsonResponse(dict(success='false', message=f'Magic query is bad: {e}'), status=500)
 
-    genome_to_data, n_core = get_flower_data(genomes_to_taxname.keys(), anno_type, add_non_annotated)
-
-    import matplotlib.pyplot as plt
-    plt.close()
-    ax = flower_plot(genome_to_data, n_core)
-    plt.tight_layout()
-
-    pipe = StringIO()
-    plt.savefig(pipe, format='svg')
-    svg = pipe.getvalue()
+    try:
+        svg = cached_flower_svg(
+            genomes=sorted(genomes_to_taxname), anno_type=anno_type, add_non_annotated=add_non_annotated,
+            presence_version=presence_version(anno_type)
+        )
+    except Exception as e:
+        return JsonResponse(dict(success='false', message=f'Failed to render flower plot: {e}'), status=500)
 
     return JsonResponse(dict(success='true', svg=svg, anno_type=anno_type, genomes_taxname=genomes_to_taxname))
 
 
-def get_flower_data(genomes: [str], anno_type: str, add_non_annotated) -> (int, dict[str:int], dict[str:int]):
+@ogb_cache(cache_root=CACHE_DIR, maxsize=CACHE_MAXSIZE, backend=CACHE_BACKEND, memory_maxbytes=CACHE_MEMORY_MAXBYTES,
+           maxbytes=CACHE_MAXBYTES, policy=CACHE_EVICTION_POLICY, compress=CACHE_COMPRESS)
+def cached_flower_svg(genomes: [str], anno_type: str, add_non_annotated: bool, presence_version: str) -> str:
     """
-    Calculate the number of core, shell and unique annotations
-
-    :param genomes:
-    :param anno_type:
-    :param add_non_annotated:
-    :return: n_core:int, n_unique:dict, n_shell:dict
+    :param genomes: sorted identifiers
+    :param presence_version: see presence_matrix.version, invalidates the svg when annotations change
+    :returns: flower plot as svg, rendered in a worker process, see lib/plot_renderer
     """
-    genomes_qs = Genome.objects.filter(identifier__in=genomes)
-    assert len(genomes) == genomes_qs.count(), f'Failed to find some genomes! {len(genomes)=} != {genomes_qs.count()=}'
-
-    genome_to_color = dict(genomes_qs.values_list('identifier', 'organism__taxid__color'))
-
-    annos_qs = Annotation.objects.filter(anno_type=anno_type, genomecontent__identifier__in=genomes)
-    for g in genomes:
-        annos_qs = annos_qs.annotate(**{g: Count('genomecontent', filter=Q(genomecontent__identifier=g))})
-    annos_qs = annos_qs.values_list('name', *genomes)
-
-    annos = pd.DataFrame(list(annos_qs), columns=['name', *genomes])
-    annos.set_index('name', inplace=True)
-    annos = annos.applymap(bool)
-
-    total_annos = len(annos)
-    n_total = annos.sum().to_dict()
-
-    core_mask = annos.all(axis=1)  # core
-    n_core = sum(core_mask)
-
-    annos = annos[~core_mask]  # remove core
+    genome_to_data, n_core = get_flower_data(genomes, anno_type, add_non_annotated)
+    return render_flower_plot(genome_to_data, n_core, workers=PLOT_WORKERS)
 
-    unique_mask = annos.sum(axis=1) == 1
-    unique = annos[unique_mask]
-    genome_to_n_unique = unique.sum().to_dict()
 
-    annos = annos[~unique_mask]  # remove singletons, we are left with shell annotations
+def get_flower_data(genomes: [str], anno_type: str, add_non_annotated) -> (dict[str:dict], int):
+    """
+    Calculate the number of core, shell and unique annotations
 
-    assert n_core + sum(genome_to_n_unique.values()) + len(annos) == total_annos
+    :param genomes: identifiers
+    :param anno_type: annotation type, e.g. 'KG'
+    :param add_non_annotated: count genes without annotation of anno_type as unique
+    :return: genome_to_data: {genome: {color, shell, unique}}, n_core: int
+    """
+    genomes = list(genomes)
+    genome_to_color = dict(Genome.objects.filter(identifier__in=genomes).values_list('identifier', 'organism__taxid__color'))
+    missing = set(genomes).difference(genome_to_color)
+    assert len(missing) == 0, f'Failed to find some genomes! {missing=}'
 
-    genome_to_n_shell = annos.sum().to_dict()
+    n_core, n_shell, n_unique = flower_counts(presence(genomes, anno_type).matrix)
 
-    for g in genomes:
-        assert n_core + genome_to_n_unique[g] + genome_to_n_shell[g] == n_total[g]
+    genome_to_n_unique = dict(zip(genomes, n_unique.tolist()))
+    genome_to_n_shell = dict(zip(genomes, n_shell.tolist()))
 
     if add_non_annotated:
         # add genes with no annotations
@@ -150,3 +136,29 @@ def get_flower_data(genomes: [str], anno_type: str, add_non_annotated) -> (int,
     } for i in genomes}
 
     return genome_to_data, n_core
+
+
+def flower_counts(matrix: csr_matrix) -> (int, np.ndarray, np.ndarray):
+    """
+    Core annotations occur in all genomes, unique annotations in exactly one, shell annotations in the others.
+
+    Linear in the number of (genome, annotation) links, no dense genome x annotation matrix is created.
+
+    :param matrix: presence of annotations (columns) in genomes (rows), boolean csr matrix
+    :return: n_core: int, n_shell: per genome, n_unique: per genome
+    """
+    n_genomes, n_annotations = matrix.shape
+    n_genomes_per_anno = np.bincount(matrix.indices, minlength=n_annotations)
+    core_mask = n_genomes_per_anno == n_genomes
+    n_core = int(core_mask.sum())
+
+    # for each link (genome has annotation): in how many genomes the annotation occurs
+    link_genome = np.repeat(np.arange(n_genomes), np.diff(matrix.indptr))
+    link_count = n_genomes_per_anno[matrix.indices]
+
+    # core annotations are not unique, even if there is only one genome
+    unique_links = (link_count == 1) & ~core_mask[matrix.indices]
+    n_unique = np.bincount(link_genome[unique_links], minlength=n_genomes)
+    n_shell = np.diff(matrix.indptr) - n_core - n_unique
+
+    return n_core, n_shell, n_unique
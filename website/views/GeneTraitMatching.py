@@ -2,21 +2,28 @@ from html import escape
 
 from django.shortcuts import render, HttpResponse
 from django.http import JsonResponse
-from django.db import connection
 
+import numpy as np
 import pandas as pd
-from scipy.stats import fisher_exact, boschloo_exact
-from fast_fisher import fast_fisher_cython
 from statsmodels.stats.multitest import multipletests
 
-from website.models.Annotation import annotation_types, settings
+from website.models.Annotation import Annotation, annotation_types, settings
+from website.models.helpers.presence_matrix import Presence, presence, version as presence_version
+from lib.exact_tests import METHODS, exact_test
+from lib.permutation_test import PermutationJob, pack, popcount, adjusted_pvalues
+from lib.ogb_cache.ogb_cache import ogb_cache, clear_cache
+from lib.ogb_cache.serialization import hash_arguments
+from plugins import calculate_gtm_permutations
+from OpenGenomeBrowser.settings import CACHE_DIR, CACHE_MAXSIZE, CACHE_BACKEND, CACHE_MEMORY_MAXBYTES, CACHE_MAXBYTES, \
+    CACHE_EVICTION_POLICY, CACHE_COMPRESS, GTM_PERMUTATIONS, HUEY_WORKERS
 
 from website.views.GenomeDetailView import dataframe_to_bootstrap_html
 from website.views.helpers.extract_errors import extract_errors
 from website.views.helpers.magic_string import MagicQueryManager
 from website.views.helpers.extract_requests import contains_data, extract_data
 
-methods = ['fast-fisher', 'fisher', 'boschloo']
+# permutation: Fisher's exact test, family-wise error rate controlled by permutations (replaces multiple_testing_method)
+methods = METHODS + ['permutation']
 
 multiple_testing_methods = {
     'bonferroni': 'Bonferroni: one-step correction',
@@ -32,6 +39,18 @@ multiple_testing_methods = {
 }
 
 
+class GtmNotDoneError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+class GtmFailedError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
 def gtm_view(request):
     """
     This function loads the page /gene-trait-matching/
@@ -113,13 +132,16 @@ def gtm_view(request):
 
 def gtm_table(request):
     """
-    This function is activated in gene_trait_matching.html. The getJSON-request must contain the parameters for the gtm-function below.
+    This function is activated in gene_trait_matching.html. The POST-request must contain the parameters for the gtm-function below.
+
+    The result of gtm is cached, the table is paginated on the server (DataTables server-side processing):
+      - without DataTables parameters: calculate, return the columns and the number of rows
+      - with DataTables parameters (draw, start, length, order, search): return one page
+      - with format=csv: return the whole table as csv file
 
     :param request: must contain: ['g1[]', 'g2[]', 'alpha', 'anno_type', 'multiple_testing_method']
-    :return: gene-trait-matching-table in json format, as required by DataTables.
+    :return: gene-trait-matching-table in json format, as required by DataTables, see https://datatables.net/manual/server-side
     """
-    context = {}
-
     # check input
     for input in ['g1[]', 'g2[]', 'alpha', 'method', 'anno_type', 'multiple_testing_method']:
         if input not in request.POST:
@@ -143,17 +165,79 @@ def gtm_table(request):
     multiple_testing_method = request.POST.get('multiple_testing_method')
 
     try:
-        gtm_df = gtm(
-            g1=set(magic_query_manager_g1.all_genomes.values_list('identifier', flat=True)),
-            g2=set(magic_query_manager_g2.all_genomes.values_list('identifier', flat=True)),
+        gtm_df = cached_gtm(
+            g1=sorted(magic_query_manager_g1.all_genomes.values_list('identifier', flat=True)),
+            g2=sorted(magic_query_manager_g2.all_genomes.values_list('identifier', flat=True)),
             method=method, anno_type=anno_type, alpha=alpha, multiple_testing_method=multiple_testing_method)
+    except GtmNotDoneError as e:
+        return JsonResponse(dict(success='false', status='still_running', message=e.message), status=420)  # like get_tree
     except Exception as e:
         return JsonResponse(dict(success='false', message=str(e)), status=500)
 
     if len(gtm_df) == 0:
         return JsonResponse(dict(success='false', message='Found no significantly different annotations.'), status=409)
 
-    return JsonResponse(to_json(gtm_df=gtm_df))
+    if request.POST.get('format') == 'csv':
+        response = HttpResponse(to_csv(gtm_df), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="gene-trait-matching.csv"'
+        return response
+
+    if 'draw' not in request.POST:
+        return JsonResponse(dict(
+            columns=[dict(title=c) for c in prettify(slice_rows(gtm_df, slice(0, 1))).columns],
+            recordsTotal=len(gtm_df)
+        ))
+
+    try:
+        return JsonResponse(to_datatables_page(gtm_df, request.POST))
+    except (ValueError, IndexError) as e:
+        return JsonResponse(dict(success='false', message=f'Request failed: bad DataTables parameters. {e}'), status=500)
+
+
+def cached_gtm(
+        g1: [str],
+        g2: [str],
+        anno_type: str = 'OL',
+        method: str = 'fast-fisher',
+        alpha: float = 0.2,
+        multiple_testing_method: str = 'fdr_bh'
+) -> pd.DataFrame:
+    """
+    Cached version of gtm. Do not modify the returned dataframe, it may be shared with other requests.
+
+    The results are invalidated when the annotations change, i.e. when genomes are imported or removed: the version of
+    the presence matrix is part of the cache key.
+
+    Only finished results are cached: for the method 'permutation', the permutations are started and polled before
+    the cached function is called.
+
+    :returns: see gtm
+    :raises GtmNotDoneError: if method is 'permutation' and the permutations are still running
+    """
+    assert anno_type in annotation_types, f'Unknown anno_type: {anno_type}. Options: {list(annotation_types)}'
+    kwargs = dict(
+        g1=sorted(g1), g2=sorted(g2), anno_type=anno_type, method=method, alpha=alpha,
+        multiple_testing_method=multiple_testing_method, presence_version=presence_version(anno_type)
+    )
+    if method == 'permutation' and not _cached_gtm.cached(**kwargs):
+        check_groups(set(g1), set(g2))
+        permutation_min_pvalues(presence(kwargs['g1'] + kwargs['g2'], anno_type), n1=len(g1), n2=len(g2))
+    return _cached_gtm(**kwargs)
+
+
+@ogb_cache(cache_root=CACHE_DIR, maxsize=CACHE_MAXSIZE, backend=CACHE_BACKEND, memory_maxbytes=CACHE_MEMORY_MAXBYTES,
+           maxbytes=CACHE_MAXBYTES, policy=CACHE_EVICTION_POLICY, compress=CACHE_COMPRESS)
+def _cached_gtm(g1: [str], g2: [str], anno_type: str, method: str, alpha: float, multiple_testing_method: str,
+                presence_version: str) -> pd.DataFrame:
+    return gtm(set(g1), set(g2), anno_type=anno_type, method=method, alpha=alpha,
+               multiple_testing_method=multiple_testing_method)
+
+
+def check_groups(g1: {str}, g2: {str}) -> None:
+    intersection = set.intersection(g1, g2)
+    assert len(intersection) == 0, f'The following genomes occur in both lists: {", ".join(intersection)}'
+    assert len(g1) > 0, 'Group 1 contains no genomes.'
+    assert len(g2) > 0, 'Group 2 contains no genomes.'
 
 
 def gtm(
@@ -170,71 +254,54 @@ def gtm(
     :param g1: First group of genomes
     :param g2: Second group of genomes
     :param anno_type: Annotation type to be used to link proteins between genomes
-    :param method: test to be applied, either 'fast-fisher', 'fisher' or 'boschloo'
+    :param method: test to be applied, either 'fast-fisher', 'fisher', 'boschloo' or 'permutation'
     :param alpha: Alpha / FWER (family-wise error rate)
     :param multiple_testing_method: See https://www.statsmodels.org/dev/generated/statsmodels.stats.multitest.multipletests.html
+        Ignored if method is 'permutation'
     :return: Table of proteins that are significantly over- or underrepresented.
+    :raises GtmNotDoneError: if method is 'permutation' and the permutations are still running
     """
-    intersection = set.intersection(g1, g2)
-    all_g = set.union(g1, g2)
-    assert len(intersection) == 0, f'The following genomes occur in both lists: {", ".join(intersection)}'
-    assert len(g1) > 0, 'Group 1 contains no genomes.'
-    assert len(g2) > 0, 'Group 2 contains no genomes.'
+    check_groups(g1, g2)
 
-    if method == 'fisher':
-        test_fn = lambda r: fisher_exact([
-            [r.g1, r.g2],
-            [r.not_g1, r.not_g2]
-        ])[1]
-    elif method == 'boschloo':
-        # column sums must be fixed!
-        test_fn = lambda r: boschloo_exact([
-            [r.g1, r.g2],
-            [r.not_g1, r.not_g2]
-        ]).pvalue
-    elif method == 'fast-fisher':
-        # test1t: directly call two-tailed Cython method
-        test_fn = lambda r: fast_fisher_cython.test1t(r.g1, r.g2, r.not_g1, r.not_g2)
-    else:
-        raise AssertionError(f"method must be either 'fast-fisher', 'fisher' or 'boschloo'. {method=}")
-
-    with connection.cursor() as cursor:
-        cursor.execute(
-            '''
-            SELECT * FROM (
-                SELECT "name", "description",
-                    COUNT(genomecontent_id) FILTER ( WHERE genomecontent_id IN %s ) as g1,
-                    COUNT(genomecontent_id) FILTER ( WHERE genomecontent_id IN %s ) as g2
-                FROM website_genomecontent_annotations
-                     LEFT OUTER JOIN website_annotation ON ("name" = "annotation_id")
-                WHERE "anno_type" = %s AND "genomecontent_id" IN %s
-                GROUP BY "name"
-            ) AS foo WHERE NOT (g1 = %s AND g2 = %s);
-            ''',
-            [tuple(g1), tuple(g2), anno_type, tuple(all_g), len(g1), len(g2)]
-        )
+    assert method in methods, f"method must be either 'fast-fisher', 'fisher', 'boschloo' or 'permutation'. {method=}"
 
-        annos = pd.DataFrame(list(cursor.fetchall()), columns=['annotation', 'description', 'g1', 'g2'])
+    # count how many genomes of each group have each annotation
+    genome_presence = presence(sorted(g1) + sorted(g2), anno_type)
+    annos = pd.DataFrame(dict(
+        annotation=genome_presence.annotations,
+        g1=genome_presence.counts(slice(0, len(g1))),
+        g2=genome_presence.counts(slice(len(g1), None))
+    ))
+    annos = annos[~((annos['g1'] == len(g1)) & (annos['g2'] == len(g2)))]
 
     assert len(annos) > 0, f'No annotations found for anno_type={anno_type}'
 
+    if method == 'permutation':
+        min_pvalues = permutation_min_pvalues(genome_presence, n1=len(g1), n2=len(g2))
+
     # get unique combinations of g1 and g2 to calculate fewer tests:
     gtm_df = annos[['g1', 'g2']].drop_duplicates().reset_index(drop=True)
-    gtm_df['not_g1'] = len(g1) - gtm_df['g1']
-    gtm_df['not_g2'] = len(g2) - gtm_df['g2']
-    gtm_df['pvalue'] = gtm_df.apply(test_fn, axis=1)
-    gtm_df.drop(['not_g1', 'not_g2'], axis=1, inplace=True)
+    # all tables at once, see lib/exact_tests
+    gtm_df['pvalue'] = exact_test(
+        'fisher' if method == 'permutation' else method,
+        gtm_df['g1'].values, gtm_df['g2'].values, len(g1), len(g2)
+    )
 
     # most significant first
     gtm_df.sort_values(by='pvalue', inplace=True)
 
-    # apply multiple testing correction
-    reject, pvals_corrected, alphac_sidak, alphac_bonf = multipletests(
-        gtm_df['pvalue'], is_sorted=True,
-        alpha=alpha, method=multiple_testing_method
-    )
-    gtm_df['p_corrected'] = pvals_corrected
-    gtm_df['reject'] = reject
+    if method == 'permutation':
+        # the permutations control the family-wise error rate
+        gtm_df['p_corrected'] = adjusted_pvalues(gtm_df['pvalue'].values, min_pvalues)
+        gtm_df['reject'] = gtm_df['p_corrected'] <= alpha
+    else:
+        # apply multiple testing correction
+        reject, pvals_corrected, alphac_sidak, alphac_bonf = multipletests(
+            gtm_df['pvalue'], is_sorted=True,
+            alpha=alpha, method=multiple_testing_method
+        )
+        gtm_df['p_corrected'] = pvals_corrected
+        gtm_df['reject'] = reject
 
     # remove rows where corrected p-value is 1
     gtm_df = gtm_df[gtm_df['p_corrected'] < 1]
@@ -246,6 +313,10 @@ def gtm(
     # perform left outer join
     gtm_df = pd.merge(gtm_df, annos, on=['g1', 'g2'], how='left')
 
+    # add descriptions, only for the remaining annotations
+    descriptions = dict(Annotation.objects.filter(name__in=gtm_df['annotation'].tolist()).values_list('name', 'description'))
+    gtm_df['description'] = gtm_df['annotation'].map(descriptions)
+
     # add parameters of gtm to pandas dataframe attributes
     gtm_df.attrs.update({
         'g1': g1, 'g2': g2,
@@ -257,6 +328,44 @@ def gtm(
     return gtm_df
 
 
+def permutation_min_pvalues(genome_presence: Presence, n1: int, n2: int) -> np.ndarray:
+    """
+    Calculate the permutations of the method 'permutation' as huey tasks, see lib/permutation_test.
+
+    The job is identified by the presence patterns, i.e. it is recalculated if the annotations of the genomes change.
+
+    :param genome_presence: rows: n1 genomes of group 1, then n2 genomes of group 2
+    :returns: smallest p-value of each permutation
+    :raises GtmNotDoneError: if the permutations are still running. (Be sure huey is running! (./manage.py run_huey))
+    :raises GtmFailedError: if the permutations failed. The job is removed: the next request restarts it
+    """
+    matrix = genome_presence.matrix.tocoo()
+    packed = pack(matrix.col, matrix.row, shape=(matrix.shape[1], matrix.shape[0]))  # rows: annotations
+    # identical presence patterns have identical p-values, constant ones are never significant
+    packed = np.unique(packed, axis=0)
+    row_sums = popcount(packed)
+    packed = np.ascontiguousarray(packed[(row_sums > 0) & (row_sums < n1 + n2)])
+
+    job_hash = hash_arguments((n1, n2, GTM_PERMUTATIONS, packed.tobytes()), {})
+    job = PermutationJob(f'{CACHE_DIR}/gtm-permutations/{job_hash}')
+
+    if not job.exists:
+        clear_cache(cache_fn_dir=f'{CACHE_DIR}/gtm-permutations', maxsize=CACHE_MAXSIZE)
+        if job.create(packed, n1, n2, n_permutations=GTM_PERMUTATIONS, n_chunks=4 * HUEY_WORKERS):
+            for chunk in range(len(job.config['chunks'])):
+                calculate_gtm_permutations(job.job_dir, chunk)
+
+    n_done, n_failed, n_chunks = job.progress()
+    if n_failed > 0:
+        errors = job.errors()
+        job.remove()
+        raise GtmFailedError(f'Permutations failed: {errors[0] if errors else "unknown error"}')
+    if n_chunks == 0 or n_done < n_chunks:
+        raise GtmNotDoneError(f'Permutations are still being calculated: {n_done}/{n_chunks or "?"} chunks done.')
+
+    return job.min_pvalues()
+
+
 def prettify(gtm_df: pd.DataFrame) -> pd.DataFrame:
     assert list(gtm_df.columns) == ['g1', 'g2', 'pvalue', 'p_corrected', 'reject', 'g1_%', 'g2_%', 'annotation', 'description'], \
         f'Columns do not match. Got: {list(gtm_df.columns)}'
@@ -279,26 +388,69 @@ def prettify(gtm_df: pd.DataFrame) -> pd.DataFrame:
     gtm_df[['pvalue', 'p_corrected']] = gtm_df[['pvalue', 'p_corrected']].applymap('{:.2g}'.format)  # 2 significant figures
 
     method_str = f'pvalue ({method.capitalize()}\'s test)'
+    corrected_str = 'qvalue (corrected)'
+    if method == 'permutation':
+        method_str = 'pvalue (Fisher\'s test)'
+        corrected_str = 'qvalue (permutations, FWER)'
     gtm_df = gtm_df[[
         'annotation', 'description', 'annotation_html', 'g1_%', 'g2_%', 'g1', 'g2', 'pvalue', 'p_corrected', 'reject'
     ]]
     gtm_df.columns = [
-        '_annotation', 'Description', 'Annotation', 'Group 1 [%]', 'Group 2 [%]', 'Group 1', 'Group 2', method_str, 'qvalue (corrected)', 'reject H0'
+        '_annotation', 'Description', 'Annotation', 'Group 1 [%]', 'Group 2 [%]', 'Group 1', 'Group 2', method_str, corrected_str, 'reject H0'
     ]
     return gtm_df
 
 
 def to_html(gtm_df: pd.DataFrame) -> str:
-    gtm_df = prettify(gtm_df)
+    gtm_df = prettify(gtm_df.copy())
     return dataframe_to_bootstrap_html(gtm_df, index=False, table_id='gene-trait-matching-table')
 
 
-def to_json(gtm_df: pd.DataFrame) -> dict:
-    gtm_df = prettify(gtm_df)
+def to_csv(gtm_df: pd.DataFrame) -> str:
+    gtm_df = prettify(gtm_df.copy())
+    gtm_df = gtm_df.drop(columns=['Annotation']).rename(columns={'_annotation': 'Annotation'})
+    return gtm_df.to_csv(index=False)
 
-    json_response = dict(
-        dataset=gtm_df.values.tolist(),
-        columns=[dict(title=c) for c in gtm_df.columns]
-    )
 
-    return json_response
+# column of the prettified table -> column of the gtm dataframe to sort by
+SORT_COLUMNS = ['annotation', 'description', 'annotation', 'g1_%', 'g2_%', 'g1', 'g2', 'pvalue', 'p_corrected', 'reject']
+
+
+def slice_rows(gtm_df: pd.DataFrame, rows: slice) -> pd.DataFrame:
+    """ :returns: copy of these rows of gtm_df, including the attrs required by prettify """
+    sliced = gtm_df.iloc[rows].copy()
+    sliced.attrs.update(gtm_df.attrs)
+    return sliced
+
+
+def to_datatables_page(gtm_df: pd.DataFrame, params) -> dict:
+    """
+    Filter, sort and slice the gtm dataframe on the server. Only the requested page is prettified.
+
+    :param gtm_df: result of gtm
+    :param params: DataTables server-side parameters: draw, start, length, order[0][column], order[0][dir], search[value]
+    :returns: dict in the format required by DataTables: draw, recordsTotal, recordsFiltered, data
+    """
+    draw = int(params['draw'])
+    start = max(int(params.get('start', 0)), 0)
+    length = int(params.get('length', 25))  # -1: all rows
+    sort_column = SORT_COLUMNS[int(params.get('order[0][column]', 7))]
+    ascending = params.get('order[0][dir]', 'asc') != 'desc'
+    search = params.get('search[value]', '').strip().lower()
+
+    df = gtm_df
+    if search:
+        df = df[
+            df['annotation'].str.lower().str.contains(search, regex=False) |
+            df['description'].fillna('').str.lower().str.contains(search, regex=False)
+            ]
+    df = df.sort_values(by=sort_column, ascending=ascending, kind='stable')
+    df.attrs.update(gtm_df.attrs)
+
+    rows = slice(start, None if length < 0 else start + length)
+    return dict(
+        draw=draw,
+        recordsTotal=len(gtm_df),
+        recordsFiltered=len(df),
+        data=prettify(slice_rows(df, rows)).values.tolist()
+    )
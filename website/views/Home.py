@@ -2,7 +2,8 @@ from django.shortcuts import render
 from website.models.helpers.backup_file import read_file_or_default
 from website.views.helpers.extract_errors import extract_errors
 from lib.ogb_cache.ogb_cache import ogb_cache, timedelta
-from OpenGenomeBrowser.settings import LOGIN_REQUIRED, FOLDER_STRUCTURE, CACHE_DIR, CACHE_MAXSIZE
+from OpenGenomeBrowser.settings import LOGIN_REQUIRED, FOLDER_STRUCTURE, CACHE_DIR, CACHE_MAXSIZE, CACHE_BACKEND, \
+    CACHE_MEMORY_MAXBYTES, CACHE_MAXBYTES, CACHE_EVICTION_POLICY, CACHE_COMPRESS
 
 
 def home_view(request):
@@ -229,7 +230,9 @@ def load_starburst_data():
     return df, columns[:-2], colormap
 
 
-@ogb_cache(cache_root=CACHE_DIR, maxsize=CACHE_MAXSIZE, wait_tolerance=timedelta(seconds=10), invalid_after=timedelta(hours=24))
+@ogb_cache(cache_root=CACHE_DIR, maxsize=CACHE_MAXSIZE, invalid_after=timedelta(hours=24),
+           backend=CACHE_BACKEND, memory_maxbytes=CACHE_MEMORY_MAXBYTES,
+           maxbytes=CACHE_MAXBYTES, policy=CACHE_EVICTION_POLICY, compress=CACHE_COMPRESS)
 def sunburst():
     import json
     from io import StringIO
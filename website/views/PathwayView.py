@@ -4,8 +4,8 @@ from OpenGenomeBrowser import settings
 from website.views.helpers.extract_errors import extract_errors
 from website.views.helpers.magic_string import MagicQueryManager, MagicError
 from website.views.helpers.extract_requests import contains_data, extract_data
-from collections import Counter
-from django.db.models import Q, Count
+from website.models.helpers.pathway_incidence import score_maps, genome_annotations
+from website.models.helpers import pathway_assets
 
 type_dict = PathwayMap._get_type_dict()
 
@@ -17,7 +17,6 @@ def pathway_view(request):
     map_is_valid = False
 
     context['type_dict'] = type_dict
-    context['PATHWAY_MAPS_RELATIVE'] = settings.PATHWAY_MAPS_RELATIVE
     context['genome_to_visualization'] = '{}'
 
     if contains_data(request, key='map'):
@@ -25,6 +24,7 @@ def pathway_view(request):
         try:
             map = PathwayMap.objects.get(slug=map_slug)
             context['map'] = map
+            context['svg_url'] = pathway_assets.url(map.slug, 'svg')
             map_is_valid = True
         except PathwayMap.DoesNotExist:
             context['error_danger'].append(f'Could not find map by slug: {map_slug}.')
@@ -32,7 +32,6 @@ def pathway_view(request):
     magic_query_managers = []
     genome_to_visualization = {}
 
-    groups_of_genomes = {}
     i = 1
     while contains_data(request, key=f'g{i}'):
         try:
@@ -41,22 +40,14 @@ def pathway_view(request):
             magic_query_manager = MagicQueryManager(queries=qs)
             magic_query_managers.append(magic_query_manager)
             genome_to_visualization.update(magic_query_manager.genome_to_visualization())
-
-            if map_is_valid:
-                organism_to_annotations = {
-                    genome.identifier: list(map.annotations.filter(genomecontent__genome=genome).values_list(flat=True))
-                    for genome in magic_query_manager.all_genomes
-                }
-
-                groups_of_genomes[f'g{i}'] = organism_to_annotations
-
             i += 1
         except Exception:
             context['error_danger'].append(f'Failed to extract genomes from group {i}.')
-            groups_of_genomes = {}
+            magic_query_managers = []
             break
 
-    context['groups_of_genomes'] = groups_of_genomes
+    # the annotations of the genomes are loaded asynchronously, see pathway_genome_annotations
+    context['has_groups_of_genomes'] = map_is_valid and len(magic_query_managers) > 0
 
     context['magic_query_managers'] = magic_query_managers
     context['initial_queries'] = [list(m.queries) for m in magic_query_managers]
@@ -66,8 +57,79 @@ def pathway_view(request):
     return render(request, 'website/pathway.html', context)
 
 
+def pathway_asset(request, slug: str, asset: str):
+    """
+    Minified, precompressed svg of a pathway map, see pathway_assets.
+
+    Versioned urls (?v=<etag>, see pathway_assets.url) are cached forever, otherwise the browser revalidates (304).
+    """
+    from django.http import FileResponse, HttpResponse, Http404
+    from django.utils.http import parse_etags
+
+    if asset not in pathway_assets.ASSETS:
+        raise Http404(f'Unknown asset: {asset}')
+    try:
+        etag = pathway_assets.meta(slug)['etags'][asset]
+    except PathwayMap.DoesNotExist:
+        raise Http404(f'Could not find map by slug: {slug}.')
+
+    visibility = 'private' if settings.LOGIN_REQUIRED else 'public'
+    if request.GET.get('v') == etag:
+        cache_control = f'{visibility}, max-age=31536000, immutable'
+    else:
+        cache_control = f'{visibility}, no-cache'
+
+    if_none_match = [tag.removeprefix('W/').strip('"') for tag in parse_etags(request.headers.get('If-None-Match', ''))]
+    if etag in if_none_match or '*' in if_none_match:
+        response = HttpResponse(status=304)
+    else:
+        path, encoding = pathway_assets.file(slug, asset, request.headers.get('Accept-Encoding', ''))
+        response = FileResponse(open(path, 'rb'), content_type=pathway_assets.ASSETS[asset])
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    response['ETag'] = f'"{etag}"'
+    response['Cache-Control'] = cache_control
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def pathway_genome_annotations(request):
+    """
+    Annotations of a pathway map that the genomes of each group have, to color the map in pathway.html.
+
+    Query:
+        - map: slug of the pathway map
+        - g1[], g2[], ...: magic queries of the groups of genomes
+    :returns: {success, groups_of_genomes: {g1: {genome: [annotation, ...], ...}, g2: ...}}
+    """
+    from django.http import JsonResponse
+
+    map_slug = request.POST.get('map')
+    if not PathwayMap.objects.filter(slug=map_slug).exists():
+        return JsonResponse(dict(success='false', message=f'Could not find map by slug: {map_slug}.'), status=400)
+
+    groups_of_genomes = {}
+    i = 1
+    while f'g{i}[]' in request.POST:
+        try:
+            magic_query_manager = MagicQueryManager(queries=set(request.POST.getlist(f'g{i}[]')))
+        except Exception as e:
+            return JsonResponse(dict(success='false', message=f'Failed to extract genomes from group {i}. {e}'), status=400)
+        groups_of_genomes[f'g{i}'] = list(magic_query_manager.all_genomes.values_list('identifier', flat=True))
+        i += 1
+
+    # all genomes at once, see pathway_incidence
+    genome_to_annotations = genome_annotations(
+        map_slug, [genome for genomes in groups_of_genomes.values() for genome in genomes]
+    )
+    return JsonResponse(dict(success='true', groups_of_genomes={
+        group_id: {genome: genome_to_annotations[genome] for genome in genomes}
+        for group_id, genomes in groups_of_genomes.items()
+    }))
+
+
 def score_pathway_maps(request):
-    from django.contrib.postgres.aggregates.general import ArrayAgg
     from django.http import JsonResponse
 
     group_ids = []
@@ -86,61 +148,25 @@ def score_pathway_maps(request):
             return JsonResponse(dict(success='false', result=e.message))
 
         identifiers = list(magic_query_manager.all_genomes.values_list('identifier', flat=True))
-        assert len(identifiers) > 0, f'Group g{i} contains no genomes!'
+        assert len(identifiers) > 0, f'Group {group_id} contains no genomes!'
         groups_of_genomes[group_id] = identifiers
 
     if len(groups_of_genomes) == 0:
         res = [dict(slug=m.slug, title=m.title, score='none') for m in PathwayMap.objects.all()]
         message = 'No genomes selected: show all pathways'
     else:
-        qs = PathwayMap.objects \
-            .annotate(n_annos=Count('annotations'))
-        for group_id, genomes in groups_of_genomes.items():
-            qs = qs.annotate(**{group_id: ArrayAgg('annotations', filter=Q(annotations__genomecontent__in=genomes))})
-
         if len(groups_of_genomes) == 1:
-            fn = get_score_one
             message = 'One group: most covered pathways first'
         else:
-            fn = get_score_many
             message = f'{len(groups_of_genomes)} groups: most different pathways first'
 
-        res = [dict(slug=m.slug, title=m.title, score=fn(m, groups_of_genomes)) for m in qs.all()]
+        # all maps in one vectorized pass, see pathway_incidence
+        slugs, scores = score_maps(groups_of_genomes)
+        slug_to_title = dict(PathwayMap.objects.values_list('slug', 'title'))
+        res = [
+            dict(slug=slug, title=slug_to_title[slug], score=round(float(score), 10))
+            for slug, score in zip(slugs, scores) if slug in slug_to_title
+        ]
         res = sorted(res, key=lambda k: k['score'], reverse=True)
 
     return JsonResponse(dict(success='true', result=res, message=message))
-
-
-def get_score_one(map: PathwayMap, groups_of_genomes) -> float:
-    """
-    :param map: PathwayMap, annotated with g{i} and n_annos
-    :param groups_of_genomes: dict of list of identifiers ({g1: [identifier, identifier, ...], g2: [...])
-    :return: float: how covered the pathway is
-    """
-    grp_id = list(groups_of_genomes.keys())[0]
-    anno_to_count = Counter(getattr(map, grp_id))
-    score = sum(anno_to_count.values()) / len(groups_of_genomes[grp_id]) / map.n_annos
-    return round(score, 10)
-
-
-def get_score_many(map: PathwayMap, groups_of_genomes) -> float:
-    """
-    :param map: PathwayMap, annotated with g{i} and n_annos
-    :param groups_of_genomes: dict of list of identifiers ({g1: [identifier, identifier, ...], g2: [...])
-    :return: float: the more different the groups are with regards to the pathway, the higher the score
-    """
-    keys = set()
-    counters = []
-    group_lenths = []
-    for group_name, genomes in groups_of_genomes.items():
-        group_lenths.append(len(genomes))
-        anno_to_count = Counter(getattr(map, group_name))
-        counters.append(anno_to_count)
-        keys = keys.union(set(anno_to_count.keys()))
-
-    score = 0.0
-    for key in keys:
-        rel_have = [c.get(key, 0) / n for c, n in zip(counters, group_lenths)]
-        score += max(rel_have) - min(rel_have)
-
-    return round(score / map.n_annos, 10)